@@ -0,0 +1,205 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict
+
+from metrics import observe_stage
+
+"""
+StudyMate Admission Control
+
+Bounds the number of LLM calls outstanding in the process. Calls beyond the
+concurrency limit wait in a bounded priority queue; when the queue is full, or a
+call has waited longer than the queue timeout, it is rejected immediately with a
+Retry-After hint instead of piling onto the upstream rate limit.
+"""
+
+# Priority class per request type. Lower values are admitted first, so a burst
+# of career guidance requests cannot starve notes.
+PRIORITIES: Dict[str, int] = {
+    "notes": 0,
+    "questions": 1,
+    "career_guidance": 2,
+}
+
+
+class AdmissionRejected(Exception):
+  """
+  Raised when a call cannot be admitted. `retry_after` is a hint in seconds.
+  """
+
+  def __init__(self, reason: str, retry_after: int):
+    super().__init__(reason)
+    self.reason = reason
+    self.retry_after = retry_after
+
+
+class AdmissionController:
+  """
+  Concurrency limiter with a bounded, prioritised wait queue.
+
+  Args:
+      max_concurrency (int): Calls allowed to run at once.
+      max_queue (int): Calls allowed to wait for a slot.
+      queue_timeout (float): Seconds a call may wait before being rejected.
+  """
+
+  def __init__(self, max_concurrency: int = 8, max_queue: int = 64, queue_timeout: float = 30.0):
+    if max_concurrency < 1:
+      raise ValueError("max_concurrency must be at least 1")
+    self.max_concurrency = max_concurrency
+    self.max_queue = max_queue
+    self.queue_timeout = queue_timeout
+    self._active = 0
+    self._waiters = []  # heap of [priority, sequence, future]
+    self._sequence = itertools.count()
+    self._service_time = 1.0  # moving average of slot hold time, seconds
+    self.admitted = 0
+    self.rejected = 0
+    self.timed_out = 0
+    self.wait_time_total = 0.0
+    self.wait_time_max = 0.0
+
+  @property
+  def in_flight(self) -> int:
+    return self._active
+
+  @property
+  def queue_depth(self) -> int:
+    return len(self._waiters)
+
+  def retry_after(self) -> int:
+    """
+    Estimate in whole seconds how long until a new call could be admitted.
+    """
+    backlog = self.queue_depth + 1
+    return max(1, math.ceil(self._service_time * backlog / self.max_concurrency))
+
+  async def acquire(self, priority: int = 0) -> None:
+    """
+    Wait for a slot, raising AdmissionRejected if the queue is full or the
+    wait exceeds the queue timeout.
+    """
+    if self._active < self.max_concurrency and not self._waiters:
+      self._active += 1
+      self._record_wait(0.0)
+      return
+
+    if len(self._waiters) >= self.max_queue:
+      self.rejected += 1
+      raise AdmissionRejected("LLM queue is full", self.retry_after())
+
+    future = asyncio.get_running_loop().create_future()
+    entry = [priority, next(self._sequence), future]
+    heapq.heappush(self._waiters, entry)
+    started = time.monotonic()
+    try:
+      await asyncio.wait_for(future, self.queue_timeout)
+    except asyncio.TimeoutError:
+      self._discard(entry)
+      if not (future.done() and not future.cancelled()):
+        self.timed_out += 1
+        raise AdmissionRejected("Timed out waiting for an LLM slot", self.retry_after())
+    except asyncio.CancelledError:
+      self._discard(entry)
+      if future.done() and not future.cancelled():
+        # The slot was handed over just before cancellation; pass it on
+        self.release()
+      raise
+    self._record_wait(time.monotonic() - started)
+
+  def try_acquire(self) -> bool:
+    """
+    Take a slot if one is free and no call is waiting for it, without waiting.
+    A slot taken must be freed with release().
+
+    Returns:
+        bool: Whether a slot was taken.
+    """
+    if self._active < self.max_concurrency and not self._waiters:
+      self._active += 1
+      return True
+    return False
+
+  def release(self) -> None:
+    """
+    Free a slot, handing it to the highest-priority waiter if there is one.
+    """
+    while self._waiters:
+      _, _, future = heapq.heappop(self._waiters)
+      if not future.done():
+        future.set_result(None)
+        return
+    self._active -= 1
+
+  @asynccontextmanager
+  async def admit(self, priority: int = 0):
+    """
+    Hold a slot for the duration of the block.
+    """
+    await self.acquire(priority)
+    started = time.monotonic()
+    try:
+      yield
+    finally:
+      self._service_time = 0.9 * self._service_time + 0.1 * (time.monotonic() - started)
+      self.release()
+
+  def stats(self) -> dict:
+    """
+    Return queue depth, in-flight count and wait time statistics.
+    """
+    return {
+        "in_flight": self.in_flight,
+        "queue_depth": self.queue_depth,
+        "max_concurrency": self.max_concurrency,
+        "max_queue": self.max_queue,
+        "admitted": self.admitted,
+        "rejected": self.rejected,
+        "timed_out": self.timed_out,
+        "wait_time_avg": self.wait_time_total / self.admitted if self.admitted else 0.0,
+        "wait_time_max": self.wait_time_max,
+    }
+
+  def _discard(self, entry: list) -> None:
+    try:
+      self._waiters.remove(entry)
+    except ValueError:
+      return
+    heapq.heapify(self._waiters)
+
+  def _record_wait(self, waited: float) -> None:
+    observe_stage("queue_wait", waited)
+    self.admitted += 1
+    self.wait_time_total += waited
+    self.wait_time_max = max(self.wait_time_max, waited)
+
+
+_admission_controller = None
+
+
+def get_admission_controller() -> AdmissionController:
+  """
+  Return the process-wide admission controller, configured from the
+  environment on first use.
+  """
+  global _admission_controller
+  if _admission_controller is None:
+    _admission_controller = AdmissionController(
+        max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+        max_queue=int(os.getenv("LLM_MAX_QUEUE", "64")),
+        queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", "30")),
+    )
+  return _admission_controller
+
+
+def set_admission_controller(controller: AdmissionController) -> None:
+  """
+  Replace the process-wide admission controller, e.g. to change its limits.
+  """
+  global _admission_controller
+  _admission_controller = controller
@@ -0,0 +1,318 @@
+import asyncio
+import hashlib
+import math
+import os
+import random
+from typing import AsyncIterator, Callable, Dict, Optional
+
+from profiles import DEFAULT_PROFILE, GenerationProfile
+
+"""
+StudyMate LLM Backends
+
+The LLM behind get_llm_response is chosen by the LLM_BACKEND environment
+variable and constructed lazily on first use, so importing the server or an
+agent does not create a client or need an API key. Every call takes a
+GenerationProfile bounding the response, and reports the tokens it used.
+
+  gemini  Google Gemini through langchain-google-genai (default).
+  fake    Local deterministic fake with configurable latency, token rate and
+          failure rate, for benchmarks and load tests on an offline box.
+"""
+
+
+def estimate_tokens(text: str) -> int:
+  """
+  Rough token count for backends that do not report usage (about four
+  characters per token for English text).
+  """
+  return max(1, round(len(text) / 4)) if text else 0
+
+
+class Usage:
+  """
+  Token counts for one response.
+
+  Args:
+      prompt_tokens (int): Tokens in the prompt.
+      output_tokens (int): Tokens in the response.
+      finish_reason (str, optional): Why generation stopped, e.g. "stop" or
+          "length" when the output budget was reached.
+      cached (bool): Whether the response was served from the cache, in which
+          case the counts are those of the original generation.
+  """
+
+  def __init__(self, prompt_tokens: int = 0, output_tokens: int = 0,
+               finish_reason: Optional[str] = None, cached: bool = False):
+    self.prompt_tokens = prompt_tokens
+    self.output_tokens = output_tokens
+    self.finish_reason = finish_reason
+    self.cached = cached
+
+  @property
+  def total_tokens(self) -> int:
+    return self.prompt_tokens + self.output_tokens
+
+  @property
+  def truncated(self) -> bool:
+    """
+    Whether the response was cut off by the output token limit.
+    """
+    return self.finish_reason in ("length", "max_tokens")
+
+  def dict(self) -> dict:
+    return {
+        "prompt_tokens": self.prompt_tokens,
+        "output_tokens": self.output_tokens,
+        "total_tokens": self.total_tokens,
+        "finish_reason": self.finish_reason,
+        "cached": self.cached,
+    }
+
+  def update(self, other: "Usage") -> None:
+    self.prompt_tokens = other.prompt_tokens
+    self.output_tokens = other.output_tokens
+    self.finish_reason = other.finish_reason
+    self.cached = other.cached
+
+
+class Completion:
+  """
+  A response from the LLM and the tokens it used. `structured` holds the
+  parsed form of the text (see structure.py) once a parser has been applied.
+  """
+
+  def __init__(self, text: str, usage: Usage, structured: Optional[dict] = None):
+    self.text = text
+    self.usage = usage
+    self.structured = structured
+
+
+class LLMBackend:
+  """
+  Interface implemented by every LLM backend.
+  """
+
+  name = "base"
+
+  async def generate(self, prompt: str, profile: GenerationProfile = DEFAULT_PROFILE) -> Completion:
+    """
+    Return the full response for a prompt, generated within the profile's limits.
+    """
+    raise NotImplementedError
+
+  async def stream(self, prompt: str, profile: GenerationProfile = DEFAULT_PROFILE,
+                   usage: Optional[Usage] = None) -> AsyncIterator[str]:
+    """
+    Yield the response for a prompt in chunks, filling in `usage` once the
+    stream ends. Defaults to a single chunk.
+    """
+    completion = await self.generate(prompt, profile)
+    if usage is not None:
+      usage.update(completion.usage)
+    yield completion.text
+
+
+class GeminiBackend(LLMBackend):
+  """
+  Google Gemini through langchain-google-genai. One client is kept per
+  generation profile, since the output limit and temperature are client settings.
+  """
+
+  name = "gemini"
+
+  def __init__(self, model: str = "gemini-pro"):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    self.model = model
+    self._client_class = ChatGoogleGenerativeAI
+    self._clients = {}
+
+  def client(self, profile: GenerationProfile):
+    client = self._clients.get(profile.key)
+    if client is None:
+      client = self._clients[profile.key] = self._client_class(
+          model=self.model,
+          max_output_tokens=profile.max_output_tokens,
+          temperature=profile.temperature,
+      )
+    return client
+
+  @staticmethod
+  def _usage(message, prompt: str, text: str) -> Usage:
+    # usage_metadata is only populated by newer langchain versions
+    metadata = getattr(message, "usage_metadata", None) or {}
+    return Usage(
+        prompt_tokens=metadata.get("input_tokens") or estimate_tokens(prompt),
+        output_tokens=metadata.get("output_tokens") or estimate_tokens(text),
+        finish_reason=str((getattr(message, "response_metadata", None) or {}).get("finish_reason", "")).lower() or None,
+    )
+
+  async def generate(self, prompt: str, profile: GenerationProfile = DEFAULT_PROFILE) -> Completion:
+    response = await self.client(profile).ainvoke(prompt, stop=list(profile.stop) or None)
+    return Completion(response.content, self._usage(response, prompt, response.content))
+
+  async def stream(self, prompt: str, profile: GenerationProfile = DEFAULT_PROFILE,
+                   usage: Optional[Usage] = None) -> AsyncIterator[str]:
+    last_chunk = None
+    chunks = []
+    async for chunk in self.client(profile).astream(prompt, stop=list(profile.stop) or None):
+      last_chunk = chunk
+      if chunk.content:
+        chunks.append(chunk.content)
+        yield chunk.content
+    if usage is not None:
+      usage.update(self._usage(last_chunk, prompt, "".join(chunks)))
+
+
+class FakeUpstreamError(Exception):
+  """
+  Injected failure raised by FakeBackend. Classified as transient.
+  """
+
+  status_code = 503
+
+
+class FakeBackend(LLMBackend):
+  """
+  Offline LLM stand-in. The response text is derived from the prompt, so the
+  same prompt always gives the same response; latency and failures are drawn
+  from a seeded random generator.
+
+  Args:
+      latency (float): Median time to first token, in seconds.
+      latency_sigma (float): Spread of the log-normal time to first token.
+          0 gives a fixed latency; larger values give a heavier tail.
+      tokens_per_second (float): Generation rate after the first token.
+      response_tokens (int): Number of tokens in each response, unless the
+          profile's max_output_tokens is lower.
+      failure_rate (float): Probability that a call fails with FakeUpstreamError.
+      seed (int, optional): Seed for latency and failure sampling.
+  """
+
+  name = "fake"
+
+  WORDS = (
+      "energy", "cell", "reaction", "theory", "equation", "process", "example", "structure",
+      "function", "system", "cycle", "model", "principle", "analysis", "concept", "result",
+  )
+
+  def __init__(self, latency: float = 0.5, latency_sigma: float = 0.0,
+               tokens_per_second: float = 200.0, response_tokens: int = 200,
+               failure_rate: float = 0.0, seed: Optional[int] = None):
+    self.latency = latency
+    self.latency_sigma = latency_sigma
+    self.tokens_per_second = tokens_per_second
+    self.response_tokens = response_tokens
+    self.failure_rate = failure_rate
+    self._random = random.Random(seed)
+    self.calls = 0
+
+  def sample_latency(self) -> float:
+    """
+    Draw a time to first token from the configured distribution.
+    """
+    if self.latency_sigma <= 0:
+      return self.latency
+    return self._random.lognormvariate(math.log(self.latency), self.latency_sigma)
+
+  def tokens(self, prompt: str, count: Optional[int] = None):
+    """
+    Return the deterministic response tokens for a prompt.
+    """
+    digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+    count = self.response_tokens if count is None else count
+    return [self.WORDS[digest[i % len(digest)] % len(self.WORDS)] + ("." if i % 12 == 11 else "")
+            for i in range(count)]
+
+  def respond(self, prompt: str, profile: GenerationProfile):
+    """
+    Return the response tokens for a prompt within the profile's limits, and
+    the usage they amount to.
+    """
+    tokens = self.tokens(prompt, min(self.response_tokens, profile.max_output_tokens))
+    finish_reason = "length" if len(tokens) < self.response_tokens else "stop"
+    for i, token in enumerate(tokens):
+      if any(stop in token for stop in profile.stop):
+        tokens, finish_reason = tokens[:i], "stop"
+        break
+    return tokens, Usage(prompt_tokens=len(prompt.split()), output_tokens=len(tokens), finish_reason=finish_reason)
+
+  async def _start(self) -> None:
+    self.calls += 1
+    await asyncio.sleep(self.sample_latency())
+    if self._random.random() < self.failure_rate:
+      raise FakeUpstreamError("Injected upstream failure")
+
+  async def generate(self, prompt: str, profile: GenerationProfile = DEFAULT_PROFILE) -> Completion:
+    await self._start()
+    tokens, usage = self.respond(prompt, profile)
+    if self.tokens_per_second > 0:
+      await asyncio.sleep(len(tokens) / self.tokens_per_second)
+    return Completion(" ".join(tokens), usage)
+
+  async def stream(self, prompt: str, profile: GenerationProfile = DEFAULT_PROFILE,
+                   usage: Optional[Usage] = None) -> AsyncIterator[str]:
+    await self._start()
+    tokens, final_usage = self.respond(prompt, profile)
+    delay = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0
+    for i, token in enumerate(tokens):
+      if i and delay:
+        await asyncio.sleep(delay)
+      yield token if i == 0 else " " + token
+    if usage is not None:
+      usage.update(final_usage)
+
+
+def _gemini_from_env() -> LLMBackend:
+  return GeminiBackend(model=os.getenv("LLM_MODEL", "gemini-pro"))
+
+
+def _fake_from_env() -> LLMBackend:
+  seed = os.getenv("FAKE_LLM_SEED")
+  return FakeBackend(
+      latency=float(os.getenv("FAKE_LLM_LATENCY", "0.5")),
+      latency_sigma=float(os.getenv("FAKE_LLM_LATENCY_SIGMA", "0")),
+      tokens_per_second=float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "200")),
+      response_tokens=int(os.getenv("FAKE_LLM_RESPONSE_TOKENS", "200")),
+      failure_rate=float(os.getenv("FAKE_LLM_FAILURE_RATE", "0")),
+      seed=int(seed) if seed else None,
+  )
+
+
+# Backend factories by name, selected with LLM_BACKEND
+BACKENDS: Dict[str, Callable[[], LLMBackend]] = {
+    "gemini": _gemini_from_env,
+    "fake": _fake_from_env,
+}
+
+_backend = None
+
+
+def register_backend(name: str, factory: Callable[[], LLMBackend]) -> None:
+  """
+  Make a backend selectable through LLM_BACKEND.
+  """
+  BACKENDS[name] = factory
+
+
+def get_backend() -> LLMBackend:
+  """
+  Return the process-wide LLM backend, constructing it on first use.
+  """
+  global _backend
+  if _backend is None:
+    name = os.getenv("LLM_BACKEND", "gemini")
+    if name not in BACKENDS:
+      raise ValueError(f"Unknown LLM_BACKEND {name!r}. Choose one of: {', '.join(sorted(BACKENDS))}")
+    _backend = BACKENDS[name]()
+  return _backend
+
+
+def set_backend(backend: Optional[LLMBackend]) -> None:
+  """
+  Replace the process-wide LLM backend, or pass None to rebuild it from the
+  environment on next use.
+  """
+  global _backend
+  _backend = backend
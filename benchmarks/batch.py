@@ -0,0 +1,76 @@
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.load import request_body, spawned_server
+from benchmarks.stats import write_results
+
+"""
+Batch Endpoint Benchmark
+
+Generates the same set of question requests twice against the server: once as
+sequential POSTs to /questions (the baseline) and once as a single POST to
+/batch, and reports the throughput of each.
+
+Usage:
+    python -m benchmarks.batch --spawn --items 40
+"""
+
+
+async def sequential(session, url: str, bodies) -> float:
+  started = time.monotonic()
+  for body in bodies:
+    async with session.post(f"{url}/questions", json=body) as response:
+      await response.read()
+  return time.monotonic() - started
+
+
+async def batched(session, url: str, bodies) -> float:
+  items = [{"type": "questions", "request": body} for body in bodies]
+  started = time.monotonic()
+  async with session.post(f"{url}/batch", json={"items": items}) as response:
+    async for line in response.content:
+      json.loads(line)
+  return time.monotonic() - started
+
+
+async def run(url: str, items: int) -> dict:
+  import aiohttp
+
+  # Separate topics per mode so the second run is not served from the cache
+  baseline_bodies = [request_body("questions", index, 0) for index in range(items)]
+  batch_bodies = [request_body("questions", items + index, 0) for index in range(items)]
+  async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as session:
+    baseline = await sequential(session, url, baseline_bodies)
+    batch = await batched(session, url, batch_bodies)
+  return {
+      "sequential": {"seconds": baseline, "throughput_rps": items / baseline},
+      "batch": {"seconds": batch, "throughput_rps": items / batch},
+      "speedup": baseline / batch,
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Compare /batch with sequential requests")
+  parser.add_argument("--items", type=int, default=40)
+  parser.add_argument("--url", default="http://127.0.0.1:8000")
+  parser.add_argument("--spawn", action="store_true", help="start server.py on the fake backend")
+  parser.add_argument("--port", type=int, default=8100)
+  parser.add_argument("--output", default="bench_output.json")
+  args = parser.parse_args()
+
+  if args.spawn:
+    with spawned_server(args.port) as url:
+      results = asyncio.run(run(url, args.items))
+  else:
+    results = asyncio.run(run(args.url, args.items))
+
+  for mode in ("sequential", "batch"):
+    print(f"{mode:<12}{results[mode]['seconds']:>8.2f} s{results[mode]['throughput_rps']:>8.1f} req/s")
+  print(f"speedup     {results['speedup']:>8.1f}x")
+  write_results(args.output, vars(args), results)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,278 @@
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from benchmarks.stats import print_summary, summarize_by, write_results
+
+"""
+StudyMate Load Generator
+
+Drives the FastAPI server over HTTP, or the agents through a Bureau, at a
+configurable concurrency (closed loop) or arrival rate (open loop), and records
+throughput plus p50/p95/p99 latency and time to first byte per endpoint or
+protocol. Results are written to a JSON file so runs can be compared across
+changes. Everything runs against the local fake LLM backend.
+
+Usage:
+    # Start a server on the fake backend and drive it with 32 concurrent clients
+    python -m benchmarks.load http --spawn --concurrency 32 --duration 30
+
+    # Open-loop Poisson arrivals at 50 req/s against the streaming endpoints
+    python -m benchmarks.load http --spawn --mode open --rate 50 --stream
+
+    # Drive the three agents in one Bureau
+    python -m benchmarks.load bureau --concurrency 16 --duration 30
+"""
+
+PROTOCOLS = ("notes", "questions", "career-guidance")
+
+TOPICS = ("Photosynthesis", "French Revolution", "Chemical Bonding", "Python Programming",
+          "Quantum Mechanics", "Cell Biology", "World History", "Algebra")
+
+
+def request_body(protocol: str, index: int, distinct: int) -> dict:
+  """
+  Build the request fields for the index-th request of a protocol. With
+  distinct > 0 only that many different requests are generated, so repeated
+  ones can be served from the response cache; otherwise every request is unique.
+  """
+  variant = index % distinct if distinct > 0 else index
+  topic = f"{TOPICS[variant % len(TOPICS)]} {variant}"
+  if protocol == "notes":
+    return {"topic": topic, "notes_style": random.choice(["Short", "Detailed"]),
+            "reference_material": "NCERT Textbook", "additional_requirements": "NA"}
+  if protocol == "questions":
+    return {"topic": topic, "with_answers": random.choice(["Yes", "No"]), "additional_requirements": "NA"}
+  return {"education_level": "College", "degree_or_class": topic,
+          "field_of_interest": "Data Analysis", "future_goal": "Employment"}
+
+
+class Schedule:
+  """
+  Hands out requests in protocol round-robin until the duration or request
+  limit is reached.
+  """
+
+  def __init__(self, args):
+    self.duration = args.duration
+    self.max_requests = args.requests
+    self.protocols = itertools.cycle(args.protocols)
+    self.issued = 0
+    self.started = time.monotonic()
+
+  def accepting(self) -> bool:
+    if self.max_requests and self.issued >= self.max_requests:
+      return False
+    return time.monotonic() - self.started < self.duration
+
+  def next_request(self):
+    index = self.issued
+    self.issued += 1
+    return next(self.protocols), index
+
+
+async def http_request(session, base_url: str, protocol: str, body: dict, stream: bool) -> dict:
+  path = f"/{protocol}/stream" if stream else f"/{protocol}"
+  started = time.monotonic()
+  ttfb = None
+  try:
+    async with session.post(base_url + path, json=body) as response:
+      async for _ in response.content.iter_any():
+        if ttfb is None:
+          ttfb = time.monotonic() - started
+      ok = response.status == 200
+      status = response.status
+  except Exception as e:
+    ok, status = False, type(e).__name__
+  return {"endpoint": protocol, "ok": ok, "status": status, "latency": time.monotonic() - started, "ttfb": ttfb}
+
+
+async def run_http(args) -> dict:
+  import aiohttp
+
+  schedule = Schedule(args)
+  samples = []
+  timeout = aiohttp.ClientTimeout(total=args.timeout)
+  connector = aiohttp.TCPConnector(limit=0)
+  async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+
+    async def one():
+      protocol, index = schedule.next_request()
+      body = request_body(protocol, index, args.distinct)
+      samples.append(await http_request(session, args.url, protocol, body, args.stream))
+
+    if args.mode == "closed":
+      async def worker():
+        while schedule.accepting():
+          await one()
+      await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    else:
+      tasks = []
+      while schedule.accepting():
+        tasks.append(asyncio.create_task(one()))
+        await asyncio.sleep(random.expovariate(args.rate))
+      await asyncio.gather(*tasks)
+
+  elapsed = time.monotonic() - schedule.started
+  return summarize_by(samples, "endpoint", elapsed)
+
+
+def wait_for_port(host: str, port: int, timeout: float = 30.0) -> None:
+  import socket
+
+  deadline = time.monotonic() + timeout
+  while time.monotonic() < deadline:
+    try:
+      with socket.create_connection((host, port), timeout=1):
+        return
+    except OSError:
+      time.sleep(0.2)
+  raise RuntimeError(f"Server on {host}:{port} did not start within {timeout} seconds")
+
+
+@contextmanager
+def spawned_server(port: int):
+  """
+  Run server.py on the fake LLM backend in a subprocess for the duration of
+  the block, yielding its base URL.
+  """
+  env = dict(os.environ, LLM_BACKEND="fake")
+  server = subprocess.Popen(
+      [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+      env=env,
+  )
+  try:
+    wait_for_port("127.0.0.1", port)
+    yield f"http://127.0.0.1:{port}"
+  finally:
+    server.terminate()
+    server.wait()
+
+
+def http_main(args) -> dict:
+  if not args.spawn:
+    return asyncio.run(run_http(args))
+  with spawned_server(args.port) as url:
+    args.url = url
+    return asyncio.run(run_http(args))
+
+
+def bureau_main(args) -> dict:
+  os.environ.setdefault("LLM_BACKEND", "fake")
+
+  from uagents import Agent, Bureau, Context
+  from ai_engine import UAgentResponse, UAgentResponseType
+  from notes_agent import notes_agent, NotesAgentModel
+  from questions_agent import questions_agent, QuestionsAgentModel
+  from career_guidance_agent import career_guidance_agent, CareerGuidanceAgentModel
+
+  targets = {
+      "notes": (notes_agent, NotesAgentModel),
+      "questions": (questions_agent, QuestionsAgentModel),
+      "career-guidance": (career_guidance_agent, CareerGuidanceAgentModel),
+  }
+  addresses = {agent.address: protocol for protocol, (agent, _) in targets.items()}
+
+  schedule = Schedule(args)
+  samples = []
+  results = {}
+  # Replies keep the session of the request, so pending requests are matched
+  # on (agent address, session) and in send order within a session.
+  pending = {}
+  state = {"in_flight": 0, "credit": 0.0, "drain_deadline": None}
+  tick = 0.01
+
+  load_agent = Agent(name="load_agent", seed="studymate load agent", port=args.port)
+
+  @load_agent.on_interval(period=tick)
+  async def send_requests(ctx: Context):
+    if results:
+      return
+    if not schedule.accepting():
+      state["drain_deadline"] = state["drain_deadline"] or time.monotonic() + args.timeout
+      if state["in_flight"] == 0 or time.monotonic() > state["drain_deadline"]:
+        finish()
+      return
+
+    if args.mode == "closed":
+      count = args.concurrency - state["in_flight"]
+    else:
+      state["credit"] += args.rate * tick
+      count = int(state["credit"])
+      state["credit"] -= count
+
+    for _ in range(max(0, count)):
+      if not schedule.accepting():
+        break
+      protocol, index = schedule.next_request()
+      agent, model = targets[protocol]
+      message = model(**request_body(protocol, index, args.distinct))
+      started = time.monotonic()
+      await ctx.send(agent.address, message)
+      pending.setdefault((agent.address, ctx.session), deque()).append(started)
+      state["in_flight"] += 1
+
+  @load_agent.on_message(model=UAgentResponse)
+  async def receive_response(ctx: Context, sender: str, msg: UAgentResponse):
+    queue = pending.get((sender, ctx.session))
+    if not queue:
+      return
+    started = queue.popleft()
+    state["in_flight"] -= 1
+    samples.append({
+        "endpoint": addresses[sender],
+        "ok": msg.type != UAgentResponseType.ERROR,
+        "latency": time.monotonic() - started,
+        "ttfb": None,
+    })
+
+  def finish():
+    results.update(summarize_by(samples, "endpoint", time.monotonic() - schedule.started))
+    asyncio.get_event_loop().stop()
+
+  bureau = Bureau(port=args.port + 1)
+  for agent in (notes_agent, questions_agent, career_guidance_agent, load_agent):
+    bureau.add(agent)
+  try:
+    bureau.run()
+  except RuntimeError:
+    # Raised by run_until_complete once finish() stops the loop
+    pass
+  return results
+
+
+def main():
+  parser = argparse.ArgumentParser(description="StudyMate load generator")
+  parser.add_argument("target", choices=["http", "bureau"])
+  parser.add_argument("--mode", choices=["closed", "open"], default="closed",
+                      help="closed: fixed concurrency; open: Poisson arrivals at --rate")
+  parser.add_argument("--concurrency", type=int, default=16)
+  parser.add_argument("--rate", type=float, default=20.0, help="arrivals per second in open mode")
+  parser.add_argument("--duration", type=float, default=30.0, help="seconds to generate load")
+  parser.add_argument("--requests", type=int, default=0, help="stop after this many requests (0 = no limit)")
+  parser.add_argument("--protocols", nargs="+", choices=PROTOCOLS, default=list(PROTOCOLS))
+  parser.add_argument("--distinct", type=int, default=0,
+                      help="number of distinct requests per protocol (0 = every request unique)")
+  parser.add_argument("--stream", action="store_true", help="use the streaming endpoints (http only)")
+  parser.add_argument("--url", default="http://127.0.0.1:8000")
+  parser.add_argument("--spawn", action="store_true", help="start server.py on the fake backend (http only)")
+  parser.add_argument("--port", type=int, default=8100)
+  parser.add_argument("--timeout", type=float, default=120.0, help="per-request timeout in seconds")
+  parser.add_argument("--output", default="bench_output.json")
+  args = parser.parse_args()
+
+  results = http_main(args) if args.target == "http" else bureau_main(args)
+  print_summary(results)
+  write_results(args.output, vars(args), results)
+  print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,94 @@
+import timeit
+
+from pydantic import BaseModel
+
+from prompts import (PROMPTS, NOTES_PROMPT, QUESTIONS_PROMPT, ANSWERS_PROMPT, CAREER_GUIDANCE_PROMPT,
+                     DOCUMENT_CHUNK_PROMPT, DOCUMENT_REDUCE_PROMPT, FOLLOW_UP_PROMPT)
+
+"""
+Prompt Render Micro-benchmark
+
+Measures the per-request cost of rendering each prompt template and of building
+its cache key.
+
+Usage:
+    python -m benchmarks.prompt_render
+"""
+
+
+class NotesSample(BaseModel):
+  topic: str = "Photosynthesis"
+  notes_style: str = "Detailed"
+  reference_material: str = "NCERT Textbook of Class Twelve"
+  additional_requirements: str = "Include detailed explanations of the Calvin cycle and the light-dependent reactions"
+
+
+class QuestionsSample(BaseModel):
+  topic: str = "Data Analysis"
+  with_answers: str = "Yes"
+  additional_requirements: str = "Include questions on statistical analysis and machine learning algorithms"
+
+
+class AnswersSample(BaseModel):
+  topic: str = "Data Analysis"
+  additional_requirements: str = "Include questions on statistical analysis and machine learning algorithms"
+  questions: str = "\n\n".join(f"{i}. Explain concept {i} of exploratory data analysis." for i in range(1, 11))
+
+
+class DocumentChunkSample(BaseModel):
+  topic: str = "Photosynthesis"
+  additional_requirements: str = "NA"
+  excerpt: str = "Photosynthesis converts light energy into chemical energy stored in glucose. " * 100
+
+
+class DocumentReduceSample(BaseModel):
+  topic: str = "Photosynthesis"
+  notes_style: str = "Short"
+  additional_requirements: str = "NA"
+  partial_notes: str = "\n\n".join(f"- Part {i}: light reactions, Calvin cycle, limiting factors" for i in range(1, 9))
+
+
+class FollowUpSample(BaseModel):
+  service: str = "questions"
+  request: str = "Topic: Data Analysis; With Answers: No; Additional Requirements: NA"
+  history: str = "Questions 1-10: mean, median, variance, outliers, sampling, regression, clustering"
+  latest: str = "\n\n".join(f"{i}. Explain concept {i} of exploratory data analysis." for i in range(1, 11))
+  follow_up: str = "Now give me 10 more questions"
+
+
+class CareerGuidanceSample(BaseModel):
+  education_level: str = "College"
+  degree_or_class: str = "Computer Science"
+  field_of_interest: str = "Data Analysis"
+  future_goal: str = "Employment"
+
+
+SAMPLES = {
+    NOTES_PROMPT.id: NotesSample(),
+    QUESTIONS_PROMPT.id: QuestionsSample(),
+    ANSWERS_PROMPT.id: AnswersSample(),
+    CAREER_GUIDANCE_PROMPT.id: CareerGuidanceSample(),
+    DOCUMENT_CHUNK_PROMPT.id: DocumentChunkSample(),
+    DOCUMENT_REDUCE_PROMPT.id: DocumentReduceSample(),
+    FOLLOW_UP_PROMPT.id: FollowUpSample(),
+}
+
+
+def measure(fn, number: int = 20000, repeat: int = 5) -> float:
+  """
+  Return the best per-call time of fn in microseconds.
+  """
+  return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+
+
+def main():
+  print(f"{'template':<24}{'hash':<14}{'render (us)':>12}{'cache key (us)':>16}")
+  for template_id, template in PROMPTS.items():
+    request = SAMPLES[template_id]
+    render = measure(lambda: template.render(request))
+    key = measure(lambda: template.cache_key(request))
+    print(f"{template_id:<24}{template.hash:<14}{render:>12.2f}{key:>16.2f}")
+
+
+if __name__ == "__main__":
+  main()
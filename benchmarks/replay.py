@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import time
+from typing import Dict, List, Optional, get_args
+
+from benchmarks.load import spawned_server
+from benchmarks.stats import percentile, print_summary, summarize_by, write_results
+from cache import _normalize
+from capture import read_capture
+from models import NotesRequest
+
+"""
+StudyMate Traffic Replay
+
+Re-sends captured traffic (see capture.py) to the server at its original pace
+or a multiple of it, and compares the latency distributions of two replays.
+With --spawn the server runs on the fake LLM backend with a fixed seed and an
+empty cache, so replays of the same capture only differ by the code under test.
+
+Agent messages are replayed against the HTTP endpoint of the same type, which
+runs the same generation path, with the agents' spelling of a notes style
+mapped to the endpoint's. Agent follow-ups need the session of an earlier
+message and are skipped.
+
+Usage:
+    # Replay a capture at twice its original rate, before and after a change
+    python -m benchmarks.replay run capture.jsonl --spawn --speed 2 --output before.json
+    python -m benchmarks.replay run capture.jsonl --spawn --speed 2 --output after.json
+
+    # Compare the latency distributions per endpoint
+    python -m benchmarks.replay diff before.json after.json
+"""
+
+FILLER = "Replayed reference text stands in for a captured document of the same length. "
+
+# Percentiles compared by diff
+PERCENTILES = (50, 90, 95, 99)
+
+# Notes styles as the HTTP API spells them, by normalized spelling, e.g. the
+# agents' 'Last Minute Revision' for 'Last-minute revision'
+NOTES_STYLES = {_normalize(style): style for style in get_args(NotesRequest.__annotations__["notes_style"])}
+
+
+def filler(length: int) -> str:
+  """
+  Deterministic text of the given length, in lines of a few sentences.
+  """
+  line = FILLER * 4 + "\n"
+  return (line * (length // len(line) + 1))[:length]
+
+
+def expand(value):
+  """
+  Undo capture.compact, replacing recorded lengths with filler text.
+  """
+  if isinstance(value, dict):
+    if set(value) == {"$filler"}:
+      return filler(value["$filler"])
+    return {key: expand(item) for key, item in value.items()}
+  if isinstance(value, list):
+    return [expand(item) for item in value]
+  return value
+
+
+def replayable(record: dict) -> Optional[dict]:
+  """
+  Return the HTTP request for a captured record, or None if it cannot be replayed.
+  """
+  if record.get("source") == "agent":
+    if record["endpoint"].endswith("_follow_up") or not record.get("type"):
+      return None
+    request = record["request"]
+    if record["type"] == "notes" and isinstance(request.get("notes_style"), str):
+      request = {**request, "notes_style": NOTES_STYLES.get(_normalize(request["notes_style"]), request["notes_style"])}
+    return {"at": record["at"], "endpoint": f"/{record['type']}", "query": "",
+            "request": request, "accept_encoding": None}
+  if record.get("request") is None:
+    return None
+  return record
+
+
+async def send(session, base_url: str, record: dict) -> dict:
+  url = base_url + record["endpoint"] + (f"?{record['query']}" if record.get("query") else "")
+  body = expand(record["request"])
+  # Sent as captured, so compression is negotiated as it was
+  headers = {"Accept-Encoding": record.get("accept_encoding") or "identity"}
+  if isinstance(body, str):
+    arguments = {"data": body.encode("utf-8"), "headers": {**headers, "Content-Type": "text/plain"}}
+  else:
+    arguments = {"json": body, "headers": headers}
+  started = time.monotonic()
+  ttfb = None
+  try:
+    async with session.post(url, **arguments) as response:
+      async for _ in response.content.iter_any():
+        if ttfb is None:
+          ttfb = time.monotonic() - started
+      status = response.status
+      ok = 200 <= status < 300
+  except Exception as e:
+    ok, status = False, type(e).__name__
+  return {"endpoint": record["endpoint"], "ok": ok, "status": status,
+          "latency": time.monotonic() - started, "ttfb": ttfb}
+
+
+async def replay(args, records: List[dict]) -> dict:
+  import aiohttp
+
+  samples = []
+  timeout = aiohttp.ClientTimeout(total=args.timeout)
+  # Compression is handled by the server under test, not undone by the client
+  async with aiohttp.ClientSession(timeout=timeout, connector=aiohttp.TCPConnector(limit=0),
+                                   auto_decompress=False) as session:
+    first = records[0]["at"]
+    started = time.monotonic()
+
+    async def one(record: dict) -> None:
+      delay = (record["at"] - first) / args.speed - (time.monotonic() - started) if args.speed > 0 else 0
+      if delay > 0:
+        await asyncio.sleep(delay)
+      samples.append(await send(session, args.url, record))
+
+    await asyncio.gather(*(one(record) for record in records))
+    elapsed = time.monotonic() - started
+
+  results = summarize_by(samples, "endpoint", elapsed)
+  for endpoint, summary in results.items():
+    # Kept for diff, which compares whole distributions
+    summary["latencies"] = sorted(round(s["latency"], 6) for s in samples if s["endpoint"] == endpoint and s["ok"])
+  return results
+
+
+def run_main(args) -> None:
+  records = [request for request in map(replayable, read_capture(args.capture)) if request is not None]
+  records.sort(key=lambda record: record["at"])
+  if args.limit:
+    records = records[:args.limit]
+  if not records:
+    raise SystemExit(f"No replayable requests in {args.capture}")
+  print(f"Replaying {len(records)} requests")
+
+  if args.spawn:
+    # The fake backend with a fixed seed, and nothing carried over between runs
+    os.environ.update(LLM_BACKEND="fake", FAKE_LLM_SEED=str(args.seed), RESPONSE_CACHE_PATH="", CAPTURE_PATH="",
+                      WARMUP_SOURCE="", JOBS_DB_PATH=":memory:", RATE_LIMIT_PER_MINUTE="0",
+                      RATE_LIMIT_DAILY_REQUESTS="0", RATE_LIMIT_DAILY_TOKENS="0")
+    with spawned_server(args.port) as url:
+      args.url = url
+      results = asyncio.run(replay(args, records))
+  else:
+    results = asyncio.run(replay(args, records))
+  print_summary(results)
+  write_results(args.output, vars(args), results)
+  print(f"Results written to {args.output}")
+
+
+def ks_statistic(a: List[float], b: List[float]) -> float:
+  """
+  Largest distance between the empirical distributions of two sorted samples.
+  """
+  i = j = 0
+  distance = 0.0
+  while i < len(a) and j < len(b):
+    value = min(a[i], b[j])
+    while i < len(a) and a[i] == value:
+      i += 1
+    while j < len(b) and b[j] == value:
+      j += 1
+    distance = max(distance, abs(i / len(a) - j / len(b)))
+  return distance
+
+
+def diff(before: Dict[str, dict], after: Dict[str, dict]) -> Dict[str, dict]:
+  """
+  Compare the latency distributions of two replays per endpoint: percentiles
+  before and after, and whether the distributions differ (two-sample
+  Kolmogorov-Smirnov test at the 5% level).
+  """
+  report = {}
+  for endpoint in sorted(set(before) & set(after)):
+    a, b = before[endpoint].get("latencies", []), after[endpoint].get("latencies", [])
+    if not a or not b:
+      continue
+    statistic = ks_statistic(a, b)
+    report[endpoint] = {
+        "requests": (len(a), len(b)),
+        "percentiles": {q: (percentile(a, q), percentile(b, q)) for q in PERCENTILES},
+        "ks_statistic": statistic,
+        "significant": statistic > 1.358 * math.sqrt((len(a) + len(b)) / (len(a) * len(b))),
+    }
+  return report
+
+
+def diff_main(args) -> None:
+  with open(args.before) as f:
+    before = json.load(f)["results"]
+  with open(args.after) as f:
+    after = json.load(f)["results"]
+  report = diff(before, after)
+  print(f"{'endpoint':<24}{'pct':>5}{'before':>10}{'after':>10}{'change':>9}")
+  for endpoint, result in report.items():
+    for q, (old, new) in result["percentiles"].items():
+      change = (new - old) / old if old else 0.0
+      print(f"{endpoint:<24}{'p' + str(q):>5}{old * 1000:>10.0f}{new * 1000:>10.0f}{change:>+9.1%}")
+    verdict = "differs" if result["significant"] else "no significant difference"
+    print(f"{'':<24}KS {result['ks_statistic']:.3f} over {result['requests'][0]}/{result['requests'][1]} requests: {verdict}")
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  commands = parser.add_subparsers(dest="command", required=True)
+
+  run = commands.add_parser("run", help="replay a capture file")
+  run.add_argument("capture", help="capture file (CAPTURE_PATH); its rotated files are included")
+  run.add_argument("--speed", type=float, default=1.0,
+                   help="multiple of the original request rate (0 sends everything at once)")
+  run.add_argument("--limit", type=int, default=0, help="replay only the first N requests (0 = all)")
+  run.add_argument("--url", default="http://127.0.0.1:8000")
+  run.add_argument("--spawn", action="store_true", help="start server.py on the fake backend")
+  run.add_argument("--port", type=int, default=8100)
+  run.add_argument("--seed", type=int, default=0, help="seed of the fake backend with --spawn")
+  run.add_argument("--timeout", type=float, default=120.0, help="per-request timeout in seconds")
+  run.add_argument("--output", default="bench_replay.json")
+
+  compare = commands.add_parser("diff", help="compare the latency distributions of two replays")
+  compare.add_argument("before")
+  compare.add_argument("after")
+
+  args = parser.parse_args()
+  if args.command == "run":
+    run_main(args)
+  else:
+    diff_main(args)
+
+
+if __name__ == "__main__":
+  main()
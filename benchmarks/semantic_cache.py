@@ -0,0 +1,119 @@
+import argparse
+import random
+import time
+
+from benchmarks.load import TOPICS
+from models import NotesRequest
+from prompts import NOTES_PROMPT
+from semantic_cache import SemanticCache
+
+"""
+Semantic Cache Micro-benchmark
+
+Fills a semantic cache with distinct notes requests and measures lookup
+latency against index size, for reworded versions of stored topics (which
+should hit) and for unseen topics (which should miss). Then checks near misses:
+requests that differ from a stored one only in a number, class, language,
+numeral, negation or difficulty, which must never be answered from it.
+
+Usage:
+    python -m benchmarks.semantic_cache --sizes 256 1024 4096
+"""
+
+REFERENCES = ("NCERT class 11", "NCERT class 12", "lecture notes", "NA")
+
+# Pseudo-words, so that topics share vocabulary the way real syllabus topics do
+SYLLABLES = ("ba", "ce", "di", "fo", "gu", "ha", "ki", "lo", "mu", "ne", "po", "ra", "si", "tu", "ve", "zo")
+VOCABULARY = tuple(a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES[:8])
+
+
+def request_fields(index: int) -> dict:
+  rng = random.Random(index)
+  words = [rng.choice(VOCABULARY) for _ in range(rng.randint(2, 4))]
+  return {"topic": " ".join([TOPICS[index % len(TOPICS)], *words]), "reference_material": rng.choice(REFERENCES)}
+
+
+# (stored, query) notes requests asking for different things with near-identical wording
+NEAR_MISSES = (
+    ({"topic": "Photosynthesis", "reference_material": "NCERT Class 11"},
+     {"topic": "Photosynthesis", "reference_material": "NCERT Class 12"}),
+    ({"topic": "Thermodynamics class 11"}, {"topic": "Thermodynamics class 12"}),
+    ({"topic": "Cell division grade 9"}, {"topic": "Cell division grade 10"}),
+    ({"topic": "Organic chemistry", "additional_requirements": "Give 10 questions"},
+     {"topic": "Organic chemistry", "additional_requirements": "Give 50 questions"}),
+    ({"topic": "Organic chemistry", "additional_requirements": "Give ten questions"},
+     {"topic": "Organic chemistry", "additional_requirements": "Give twenty questions"}),
+    ({"topic": "Mughal Empire", "additional_requirements": "Include answers in Hindi"},
+     {"topic": "Mughal Empire", "additional_requirements": "Include answers in English"}),
+    ({"topic": "World War I"}, {"topic": "World War II"}),
+    ({"topic": "Causes of the First World War"}, {"topic": "Causes of the Second World War"}),
+    ({"topic": "Newton's first law of motion"}, {"topic": "Newton's third law of motion"}),
+    ({"topic": "Chapter 3 Electrostatics"}, {"topic": "Chapter 8 Electrostatics"}),
+    ({"topic": "Photosynthesis", "additional_requirements": "Explain with worked examples"},
+     {"topic": "Photosynthesis", "additional_requirements": "Explain without worked examples"}),
+    ({"topic": "Photosynthesis", "additional_requirements": "Include worked examples"},
+     {"topic": "Photosynthesis", "additional_requirements": "Exclude worked examples"}),
+    ({"topic": "Photosynthesis", "additional_requirements": "Questions of easy difficulty"},
+     {"topic": "Photosynthesis", "additional_requirements": "Questions of hard difficulty"}),
+    ({"topic": "Quadratic equations with worked examples"}, {"topic": "Quadratic equations without worked examples"}),
+    ({"topic": "Easy problems on probability"}, {"topic": "Hard problems on probability"}),
+)
+
+
+def notes_key(fields: dict) -> tuple:
+  """
+  Semantic cache partition and compared fields of a 'Detailed' notes request.
+  """
+  request = NotesRequest(**{"topic": "", "notes_style": "Detailed", "reference_material": "NA",
+                            "additional_requirements": "NA", **fields})
+  return NOTES_PROMPT.similarity_key(request)
+
+
+def reworded(fields: dict) -> dict:
+  # Same request with different casing, punctuation and word order
+  words = fields["topic"].split()
+  return {**fields, "topic": " - ".join([*words[1:], words[0]]).upper()}
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--sizes", type=int, nargs="+", default=[256, 1024, 4096])
+  parser.add_argument("--lookups", type=int, default=500)
+  parser.add_argument("--threshold", type=float, default=0.95)
+  args = parser.parse_args()
+
+  print(f"{'entries':>8}{'features':>10}{'hit (us)':>10}{'miss (us)':>11}{'hit rate':>10}{'false hits':>12}")
+  for size in args.sizes:
+    cache = SemanticCache(threshold=args.threshold, max_entries=size)
+    for index in range(size):
+      cache.add(*notes_key(request_fields(index)), f"key-{index}")
+
+    sample = random.Random(0).sample(range(size), min(args.lookups, size))
+    queries = [(index, reworded(request_fields(index))) for index in sample]
+    started = time.perf_counter()
+    matches = [(index, cache.search(*notes_key(fields))) for index, fields in queries]
+    hit_time = (time.perf_counter() - started) / len(sample) * 1e6
+    hits = sum(match is not None and match[0] == f"key-{index}" for index, match in matches)
+
+    queries = [request_fields(size + index) for index in sample]
+    started = time.perf_counter()
+    false_hits = sum(cache.search(*notes_key(fields)) is not None for fields in queries)
+    miss_time = (time.perf_counter() - started) / len(sample) * 1e6
+
+    stats = cache.stats()
+    print(f"{stats['entries']:>8}{stats['features']:>10}{hit_time:>10.1f}{miss_time:>11.1f}"
+          f"{hits / len(sample):>10.2f}{false_hits:>12}")
+
+  cache = SemanticCache(threshold=args.threshold)
+  false_hits = []
+  for index, (stored, query) in enumerate(NEAR_MISSES):
+    cache.add(*notes_key(stored), f"near-miss-{index}")
+    if cache.search(*notes_key(query)) is not None:
+      false_hits.append(query)
+  print(f"\nNear misses answered from a different request: {len(false_hits)} of {len(NEAR_MISSES)}")
+  for query in false_hits:
+    print(f"  {query}")
+
+
+if __name__ == "__main__":
+  main()
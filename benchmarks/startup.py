@@ -0,0 +1,123 @@
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+from benchmarks.load import request_body
+from benchmarks.stats import percentile, write_results
+
+"""
+Startup Benchmark
+
+Measures cold-start cost, which matters for autoscaled replicas: the import
+time of each module in a fresh interpreter, the modules it spends it on, and
+the time from launching the server process to its first served request.
+
+Usage:
+    python -m benchmarks.startup
+    python -m benchmarks.startup --modules server notes_agent --runs 10
+"""
+
+
+def import_profile(module: str) -> dict:
+  """
+  Import a module in a fresh interpreter with -X importtime and return its
+  total import time and the cumulative time of each module it imports
+  directly, in seconds.
+  """
+  result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True, env=dict(os.environ, LLM_BACKEND="fake"))
+  if result.returncode != 0:
+    raise RuntimeError(result.stderr.strip().splitlines()[-1])
+  # Lines are printed after the imports they trigger, indented by two spaces per level
+  children = {}
+  for line in result.stderr.splitlines():
+    if not line.startswith("import time:") or "|" not in line:
+      continue
+    _, cumulative, name = line.split("|")
+    if not cumulative.strip().isdigit():
+      continue
+    depth = (len(name) - len(name.lstrip()) - 1) // 2
+    if depth == 1:
+      children[name.strip()] = int(cumulative) / 1e6
+    elif depth == 0:
+      if name.strip() == module:
+        return {"total": int(cumulative) / 1e6, "imports": children}
+      children = {}
+  raise RuntimeError(f"No import time reported for {module}")
+
+
+def free_port() -> int:
+  with socket.socket() as s:
+    s.bind(("127.0.0.1", 0))
+    return s.getsockname()[1]
+
+
+def first_request_time(timeout: float = 30.0) -> float:
+  """
+  Launch the server on the fake backend and return the seconds until its
+  first /notes request succeeds.
+  """
+  port = free_port()
+  body = json.dumps(request_body("notes", 0, 1)).encode("utf-8")
+  env = dict(os.environ, LLM_BACKEND="fake", FAKE_LLM_LATENCY="0", FAKE_LLM_TOKENS_PER_SECOND="0",
+             RESPONSE_CACHE_PATH="", WARMUP_SOURCE="", JOBS_DB_PATH=":memory:")
+  started = time.perf_counter()
+  server = subprocess.Popen(
+      [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+      env=env,
+  )
+  try:
+    while time.perf_counter() - started < timeout:
+      request = urllib.request.Request(f"http://127.0.0.1:{port}/notes", data=body,
+                                       headers={"Content-Type": "application/json"})
+      try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+          response.read()
+          return time.perf_counter() - started
+      except OSError:
+        if server.poll() is not None:
+          raise RuntimeError("Server exited before serving a request")
+        time.sleep(0.01)
+    raise RuntimeError(f"Server did not serve a request within {timeout} seconds")
+  finally:
+    server.terminate()
+    server.wait()
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--modules", nargs="+", default=["server", "notes_agent", "questions_agent", "career_guidance_agent"])
+  parser.add_argument("--runs", type=int, default=5)
+  parser.add_argument("--top", type=int, default=5, help="heaviest imports to list per module")
+  parser.add_argument("--output", default="bench_output.json")
+  args = parser.parse_args()
+
+  results = {"imports": {}, "first_request": None}
+  for module in args.modules:
+    try:
+      profiles = [import_profile(module) for _ in range(args.runs)]
+    except RuntimeError as e:
+      print(f"{module:<24} failed to import: {e}")
+      continue
+    totals = sorted(profile["total"] for profile in profiles)
+    heaviest = sorted(profiles[0]["imports"].items(), key=lambda item: item[1], reverse=True)
+    heaviest = heaviest[:args.top]
+    results["imports"][module] = {"p50": percentile(totals, 50), "max": totals[-1], "heaviest": dict(heaviest)}
+    print(f"{module:<24} import p50 {percentile(totals, 50) * 1000:8.1f} ms   max {totals[-1] * 1000:8.1f} ms")
+    for name, seconds in heaviest:
+      print(f"    {name:<36}{seconds * 1000:8.1f} ms")
+
+  times = sorted(first_request_time() for _ in range(args.runs))
+  results["first_request"] = {"p50": percentile(times, 50), "max": times[-1]}
+  print(f"{'first request':<24}        p50 {percentile(times, 50) * 1000:8.1f} ms   max {times[-1] * 1000:8.1f} ms")
+
+  write_results(args.output, vars(args), results)
+
+
+if __name__ == "__main__":
+  main()
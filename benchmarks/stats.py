@@ -0,0 +1,94 @@
+import json
+import platform
+import subprocess
+import time
+from typing import Dict, Iterable, List, Optional
+
+"""
+Benchmark statistics and result files shared by the benchmark scripts.
+"""
+
+
+def percentile(values: List[float], q: float) -> float:
+  """
+  Return the q-th percentile (0-100) of values using linear interpolation.
+  """
+  if not values:
+    return 0.0
+  ordered = sorted(values)
+  position = (len(ordered) - 1) * q / 100
+  lower = int(position)
+  upper = min(lower + 1, len(ordered) - 1)
+  return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(samples: Iterable[dict], elapsed: float) -> dict:
+  """
+  Summarize request samples of the form
+  {"ok": bool, "latency": seconds, "ttfb": seconds or None}.
+  """
+  samples = list(samples)
+  latencies = [s["latency"] for s in samples if s["ok"]]
+  ttfbs = [s["ttfb"] for s in samples if s["ok"] and s.get("ttfb") is not None]
+  summary = {
+      "requests": len(samples),
+      "errors": len(samples) - len(latencies),
+      "throughput_rps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+  }
+  for name, values in (("latency", latencies), ("ttfb", ttfbs)):
+    if values:
+      summary[name] = {
+          "mean": sum(values) / len(values),
+          "p50": percentile(values, 50),
+          "p95": percentile(values, 95),
+          "p99": percentile(values, 99),
+          "max": max(values),
+      }
+  return summary
+
+
+def summarize_by(samples: Iterable[dict], field: str, elapsed: float) -> Dict[str, dict]:
+  """
+  Summarize samples grouped by one of their fields, e.g. "endpoint".
+  """
+  groups: Dict[str, List[dict]] = {}
+  for sample in samples:
+    groups.setdefault(sample[field], []).append(sample)
+  return {name: summarize(group, elapsed) for name, group in sorted(groups.items())}
+
+
+def _git_revision() -> Optional[str]:
+  try:
+    return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                          text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def write_results(path: str, config: dict, results: dict) -> None:
+  """
+  Write benchmark results to a JSON file together with the run configuration
+  and enough context (revision, host, time) to compare runs later.
+  """
+  document = {
+      "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+      "revision": _git_revision(),
+      "python": platform.python_version(),
+      "config": config,
+      "results": results,
+  }
+  with open(path, "w") as f:
+    json.dump(document, f, indent=2)
+
+
+def print_summary(results: Dict[str, dict]) -> None:
+  """
+  Print one line per group with throughput and latency percentiles in ms.
+  """
+  print(f"{'group':<20}{'reqs':>7}{'errs':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'ttfb p50':>10}{'ttfb p99':>10}")
+  for name, summary in results.items():
+    latency = summary.get("latency", {})
+    ttfb = summary.get("ttfb", {})
+    print(f"{name:<20}{summary['requests']:>7}{summary['errors']:>6}{summary['throughput_rps']:>9.1f}"
+          f"{latency.get('p50', 0) * 1000:>9.0f}{latency.get('p95', 0) * 1000:>9.0f}{latency.get('p99', 0) * 1000:>9.0f}"
+          f"{ttfb.get('p50', 0) * 1000:>10.0f}{ttfb.get('p99', 0) * 1000:>10.0f}")
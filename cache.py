@@ -0,0 +1,342 @@
+import asyncio
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from pydantic import BaseModel
+
+"""
+StudyMate Response Cache
+
+Caches LLM responses keyed on the normalized request model, so that repeated
+requests (e.g. the same topic and notes style around exam week) are served
+without another LLM round-trip. Entries expire after a TTL and are evicted in
+LRU order once the cache exceeds its entry or byte budget. An optional SQLite
+file keeps entries across restarts. Writes to it, including the access times
+that order its LRU eviction, are batched and applied by a background thread
+every FLUSH_INTERVAL seconds, and entries missing from memory are read from it
+in a worker thread, so the event loop never waits for the disk.
+
+Entries pre-generated by the warm-up (see warmup.py) are tagged, so the cache
+can report how many requests they served.
+"""
+
+# Source tag of entries stored by the warm-up
+WARMUP = "warmup"
+
+# Seconds between batched writes to the SQLite file, and between purges of expired entries from it
+FLUSH_INTERVAL = 1.0
+PURGE_INTERVAL = 60.0
+
+
+def _normalize(value):
+  """
+  Normalize a request field so that trivially different spellings of the same
+  request produce the same cache key, e.g. the server's 'Last-minute revision'
+  and the agents' 'Last Minute Revision'.
+  """
+  if isinstance(value, str):
+    return " ".join(value.replace("-", " ").split()).casefold()
+  return value
+
+
+def request_fields(request: BaseModel) -> dict:
+  """
+  Return the fields of a request model as a dict. The HTTP request models are
+  Pydantic 2 models; agent models may be built on the Pydantic 1 API.
+  """
+  dump = getattr(request, "model_dump", None)
+  return dump() if dump is not None else request.dict()
+
+
+def cache_key(request: BaseModel, namespace: Optional[str] = None) -> str:
+  """
+  Build a stable cache key from a request model.
+
+  Args:
+      request (BaseModel): The request model (e.g. NotesRequest, NotesAgentModel).
+      namespace (str, optional): Key namespace. Defaults to the model class name.
+
+  Returns:
+      str: A hex digest identifying the normalized request.
+  """
+  fields = {name: _normalize(value) for name, value in request_fields(request).items()}
+  payload = json.dumps([namespace or type(request).__name__, fields],
+                       sort_keys=True, separators=(",", ":"))
+  return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+  """
+  LRU response cache with TTL, entry and byte limits, and an optional
+  SQLite backend that survives restarts.
+  """
+
+  def __init__(self, ttl: float = 3600, max_entries: int = 1024,
+               max_bytes: int = 32 * 1024 * 1024, path: Optional[str] = None):
+    self.ttl = ttl
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.warm_hits = 0
+    self._entries = OrderedDict()  # key -> (expires_at, value, source)
+    self._bytes = 0
+    self._warm_keys_used = set()  # warm-up entries that have served a request
+    self._lock = threading.Lock()
+    self._db = None
+    if path:
+      self._db = sqlite3.connect(path, check_same_thread=False)
+      self._db.execute(
+          "CREATE TABLE IF NOT EXISTS responses ("
+          "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+          "expires_at REAL NOT NULL, accessed_at REAL NOT NULL, source TEXT)"
+      )
+      columns = [row[1] for row in self._db.execute("PRAGMA table_info(responses)")]
+      if "source" not in columns:
+        # Caches created before entries were tagged
+        self._db.execute("ALTER TABLE responses ADD COLUMN source TEXT")
+      self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+      self._db.commit()
+      self._db_lock = threading.Lock()
+      self._pending = {}  # key -> (value, expires_at, accessed_at, source) not yet on disk
+      self._touched = {}  # key -> accessed_at not yet on disk
+      self._purged_at = time.time()
+      self._db_count, self._db_bytes = self._db_totals()
+      threading.Thread(target=self._run_writer, name="response-cache-writer", daemon=True).start()
+      # The warm-up CLI exits right after its last set
+      atexit.register(self.flush)
+
+  async def get(self, key: str) -> Optional[str]:
+    """
+    Return the cached response for a key, or None on a miss.
+    """
+    now = time.time()
+    with self._lock:
+      entry = self._memory_get(key, now)
+      if entry is not None or self._db is None:
+        return self._record_lookup(key, entry, now)
+
+    row = await asyncio.to_thread(self._db_read, key, now)
+    with self._lock:
+      # Stored or read by another request while this one was reading
+      entry = self._memory_get(key, now)
+      if entry is None and row is not None:
+        value, expires_at, source = row
+        self._insert(key, value, expires_at, source)
+        entry = (expires_at, value, source)
+      return self._record_lookup(key, entry, now)
+
+  async def contains(self, key: str) -> bool:
+    """
+    Return whether a live response is stored under a key, without counting a
+    lookup.
+    """
+    now = time.time()
+    with self._lock:
+      if self._memory_get(key, now) is not None:
+        return True
+      if self._db is None:
+        return False
+    return await asyncio.to_thread(self._db_read, key, now) is not None
+
+  def set(self, key: str, value: str, ttl: Optional[float] = None, source: Optional[str] = None) -> None:
+    """
+    Store a response under a key, evicting old entries if needed.
+
+    Args:
+        key (str): Cache key.
+        value (str): Response to store.
+        ttl (float, optional): Lifetime of the entry in seconds. Defaults to
+            the cache's TTL.
+        source (str, optional): Tag recording what stored the entry, e.g. WARMUP.
+    """
+    now = time.time()
+    expires_at = now + (self.ttl if ttl is None else ttl)
+    with self._lock:
+      self._insert(key, value, expires_at, source)
+      if self._db is not None:
+        self._pending[key] = (value, expires_at, now, source)
+        self._touched.pop(key, None)
+
+  def clear(self) -> None:
+    """
+    Drop every entry from memory and disk.
+    """
+    with self._lock:
+      self._entries.clear()
+      self._bytes = 0
+      self._warm_keys_used.clear()
+      if self._db is not None:
+        self._pending.clear()
+        self._touched.clear()
+        with self._db_lock:
+          self._db.execute("DELETE FROM responses")
+          self._db.commit()
+          self._db_count, self._db_bytes = 0, 0
+
+  def flush(self) -> None:
+    """
+    Write pending entries and access times to the SQLite file now.
+    """
+    if self._db is None:
+      return
+    with self._lock:
+      pending, self._pending = self._pending, {}
+      touched, self._touched = self._touched, {}
+    now = time.time()
+    with self._db_lock:
+      for key, (value, expires_at, accessed_at, source) in pending.items():
+        self._db_forget(key)
+        self._db.execute("INSERT INTO responses VALUES (?, ?, ?, ?, ?)", (key, value, expires_at, accessed_at, source))
+        self._db_count += 1
+        self._db_bytes += len(value.encode("utf-8"))
+      self._db.executemany("UPDATE responses SET accessed_at = ? WHERE key = ?",
+                           [(accessed_at, key) for key, accessed_at in touched.items()])
+      if now - self._purged_at >= PURGE_INTERVAL:
+        self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        # Also picks up entries written by other processes sharing the file
+        self._db_count, self._db_bytes = self._db_totals()
+        self._purged_at = now
+      self._db_evict()
+      self._db.commit()
+
+  def stats(self) -> dict:
+    """
+    Return hit/miss counters and current size.
+    """
+    with self._lock:
+      lookups = self.hits + self.misses
+      return {
+          "hits": self.hits,
+          "misses": self.misses,
+          "hit_rate": self.hits / lookups if lookups else 0.0,
+          "evictions": self.evictions,
+          "entries": len(self._entries),
+          "bytes": self._bytes,
+          "warm_entries": self._count_warm_entries(),
+          "warm_entries_used": len(self._warm_keys_used),
+          "warm_hits": self.warm_hits,
+          "warm_hit_rate": self.warm_hits / lookups if lookups else 0.0,
+      }
+
+  def _memory_get(self, key: str, now: float) -> Optional[tuple]:
+    # The live (expires_at, value, source) of a key in memory or waiting to be written
+    entry = self._entries.get(key)
+    if entry is not None:
+      if entry[0] > now:
+        self._entries.move_to_end(key)
+        return entry
+      self._remove(key)
+    if self._db is not None:
+      pending = self._pending.get(key)
+      if pending is not None and pending[1] > now:
+        value, expires_at, _, source = pending
+        return expires_at, value, source
+    return None
+
+  def _record_lookup(self, key: str, entry: Optional[tuple], now: float) -> Optional[str]:
+    if entry is None:
+      self.misses += 1
+      return None
+    self._record_hit(key, entry[2])
+    if self._db is not None:
+      self._touched[key] = now
+    return entry[1]
+
+  def _record_hit(self, key: str, source: Optional[str]) -> None:
+    self.hits += 1
+    if source == WARMUP:
+      self.warm_hits += 1
+      self._warm_keys_used.add(key)
+
+  def _count_warm_entries(self) -> int:
+    if self._db is None:
+      now = time.time()
+      return sum(1 for expires_at, _, source in self._entries.values() if source == WARMUP and expires_at > now)
+    # Entries warmed by another process (e.g. the warm-up CLI) are only on disk
+    with self._db_lock:
+      return self._db.execute(
+          "SELECT COUNT(*) FROM responses WHERE source = ? AND expires_at > ?", (WARMUP, time.time())
+      ).fetchone()[0]
+
+  def _insert(self, key: str, value: str, expires_at: float, source: Optional[str] = None) -> None:
+    self._remove(key)
+    self._entries[key] = (expires_at, value, source)
+    self._bytes += len(value.encode("utf-8"))
+    while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+      oldest = next(iter(self._entries))
+      self._remove(oldest)
+      self.evictions += 1
+
+  def _remove(self, key: str) -> None:
+    entry = self._entries.pop(key, None)
+    if entry is not None:
+      self._bytes -= len(entry[1].encode("utf-8"))
+
+  def _db_read(self, key: str, now: float) -> Optional[tuple]:
+    # Run in a worker thread: it waits for the writer to finish a batch
+    with self._db_lock:
+      return self._db.execute(
+          "SELECT value, expires_at, source FROM responses WHERE key = ? AND expires_at > ?", (key, now)
+      ).fetchone()
+
+  def _run_writer(self) -> None:
+    while True:
+      time.sleep(FLUSH_INTERVAL)
+      self.flush()
+
+  def _db_totals(self) -> tuple:
+    return self._db.execute(
+        "SELECT COUNT(*), COALESCE(SUM(LENGTH(CAST(value AS BLOB))), 0) FROM responses"
+    ).fetchone()
+
+  def _db_forget(self, key: str) -> None:
+    # Takes an entry about to be replaced out of the totals
+    row = self._db.execute("SELECT LENGTH(CAST(value AS BLOB)) FROM responses WHERE key = ?", (key,)).fetchone()
+    if row is not None:
+      self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+      self._db_count -= 1
+      self._db_bytes -= row[0]
+
+  def _db_evict(self) -> None:
+    while self._db_count > self.max_entries or self._db_bytes > self.max_bytes:
+      rows = self._db.execute(
+          "SELECT key, LENGTH(CAST(value AS BLOB)) FROM responses ORDER BY accessed_at LIMIT 100"
+      ).fetchall()
+      if not rows:
+        self._db_count, self._db_bytes = 0, 0
+        return
+      for key, length in rows:
+        if self._db_count <= self.max_entries and self._db_bytes <= self.max_bytes:
+          return
+        self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+        self._db_count -= 1
+        self._db_bytes -= length
+        self.evictions += 1
+
+
+_response_cache = None
+
+
+def get_response_cache() -> ResponseCache:
+  """
+  Return the process-wide response cache shared by the server and the agents,
+  configured from the environment on first use.
+  """
+  global _response_cache
+  if _response_cache is None:
+    _response_cache = ResponseCache(
+        ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+        max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024")),
+        max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+        path=os.getenv("RESPONSE_CACHE_PATH") or None,
+    )
+  return _response_cache
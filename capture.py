@@ -0,0 +1,350 @@
+import functools
+import json
+import os
+import queue
+import random
+import threading
+import time
+from typing import Iterator, List, Optional
+
+"""
+StudyMate Traffic Capture
+
+Records the requests handled by the server and the agents, with their timing
+and response size, so that real traffic can be replayed against a change (see
+benchmarks/replay.py). Each record is one line of JSON:
+
+  {"at": 1718000000.0, "source": "http", "endpoint": "/notes", "query": "",
+   "type": "notes", "request": {...}, "status": 200, "latency": 1.52,
+   "ttfb": 1.51, "response_bytes": 2048}
+
+`type` and `request` match the items of /batch, so a capture file can also be
+used as WARMUP_SOURCE. Texts longer than LONG_TEXT characters, such as whole
+chapters sent as reference material, are recorded as {"$filler": length}
+and replayed as filler text of that length.
+
+Records are handed to a background thread that decodes request bodies and
+writes them, so capturing costs the request a queue put. The queue is bounded
+by record count and by the bytes of raw bodies it holds; when either is full,
+records are dropped rather than slowing requests down. The file is rotated
+after `max_bytes`, keeping `backups` older files (path.1 the most recent).
+"""
+
+# Longest text recorded verbatim, in characters
+LONG_TEXT = 2000
+
+
+def compact(value):
+  """
+  Replace long texts in a request body with their length.
+  """
+  if isinstance(value, str) and len(value) > LONG_TEXT:
+    return {"$filler": len(value)}
+  if isinstance(value, dict):
+    return {key: compact(item) for key, item in value.items()}
+  if isinstance(value, list):
+    return [compact(item) for item in value]
+  return value
+
+
+def request_type(endpoint: str) -> Optional[str]:
+  """
+  The /batch item type of a request to an HTTP endpoint, e.g. "notes" for
+  /notes/stream, or None for other endpoints.
+  """
+  name = endpoint.strip("/").split("/")[0]
+  return name if name in ("notes", "questions", "career-guidance") else None
+
+
+class CaptureLog:
+  """
+  Appends records to a rotating JSON Lines file from a background thread.
+
+  Args:
+      path (str): File the records are appended to.
+      max_bytes (int): Size after which the file is rotated.
+      backups (int): Rotated files kept.
+      sample_rate (float): Fraction of requests recorded.
+      queue_size (int): Records waiting to be written before new ones are dropped.
+      queue_bytes (int): Bytes of raw request bodies waiting to be written
+          before new records are dropped.
+  """
+
+  def __init__(self, path: str, max_bytes: int = 16 * 1024 * 1024, backups: int = 3,
+               sample_rate: float = 1.0, queue_size: int = 10000, queue_bytes: int = 64 * 1024 * 1024):
+    self.path = path
+    self.max_bytes = max_bytes
+    self.backups = backups
+    self.sample_rate = sample_rate
+    self.written = 0
+    self.dropped = 0
+    self.rotations = 0
+    self.queue_bytes = queue_bytes
+    self._queue = queue.Queue(maxsize=queue_size)
+    self._queued_bytes = 0
+    self._bytes_lock = threading.Lock()
+    # Opened here so that a bad path fails on first use rather than in the writer
+    self._file = open(path, "a")
+    self._thread = threading.Thread(target=self._run, name="capture-writer", daemon=True)
+    self._thread.start()
+
+  def sampled(self) -> bool:
+    """
+    Whether to record the next request.
+    """
+    return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+  def record(self, record: dict, body: Optional[bytes] = None, json_body: bool = True) -> None:
+    """
+    Queue a record to be written. Never blocks.
+
+    Args:
+        record (dict): The record. Its "request" is compacted when written.
+        body (bytes, optional): Raw request body, decoded into "request" when written.
+        json_body (bool, optional): Whether the body is JSON rather than text.
+    """
+    size = len(body) if body is not None else 0
+    with self._bytes_lock:
+      if self._queued_bytes + size > self.queue_bytes:
+        self.dropped += 1
+        return
+      self._queued_bytes += size
+    try:
+      self._queue.put_nowait((record, body, json_body))
+    except queue.Full:
+      self._written_off(size)
+      self.dropped += 1
+
+  def flush(self, timeout: float = 5.0) -> None:
+    """
+    Wait until the queued records have been written.
+    """
+    done = threading.Event()
+    self._queue.put(done, timeout=timeout)
+    done.wait(timeout)
+
+  def stats(self) -> dict:
+    """
+    Return the number of records written, dropped and waiting, and rotations.
+    """
+    return {"written": self.written, "dropped": self.dropped, "queued": self._queue.qsize(),
+            "queued_bytes": self._queued_bytes, "rotations": self.rotations}
+
+  def _run(self) -> None:
+    f = self._file
+    size = f.tell()
+    while True:
+      item = self._queue.get()
+      # Write everything queued before flushing, so bursts cost one flush
+      while True:
+        if isinstance(item, threading.Event):
+          f.flush()
+          item.set()
+        else:
+          line = json.dumps(_prepare(*item), separators=(",", ":")) + "\n"
+          self._written_off(len(item[1]) if item[1] is not None else 0)
+          f.write(line)
+          size += len(line)
+          self.written += 1
+          if size >= self.max_bytes:
+            f.close()
+            self._rotate()
+            f = open(self.path, "a")
+            size = 0
+        try:
+          item = self._queue.get_nowait()
+        except queue.Empty:
+          break
+      f.flush()
+
+  def _written_off(self, size: int) -> None:
+    with self._bytes_lock:
+      self._queued_bytes -= size
+
+  def _rotate(self) -> None:
+    self.rotations += 1
+    if self.backups <= 0:
+      os.remove(self.path)
+      return
+    for index in range(self.backups - 1, 0, -1):
+      if os.path.exists(f"{self.path}.{index}"):
+        os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+    os.replace(self.path, f"{self.path}.1")
+
+
+def _prepare(record: dict, body: Optional[bytes], json_body: bool) -> dict:
+  if body is not None:
+    if json_body:
+      try:
+        record["request"] = json.loads(body)
+      except ValueError:
+        record["request"] = None
+    else:
+      record["request"] = body.decode("utf-8", "replace")
+  record["request"] = compact(record.get("request"))
+  return record
+
+
+_capture_log = None
+
+
+def get_capture_log() -> Optional[CaptureLog]:
+  """
+  Return the process-wide capture log, configured from the environment on
+  first use, or None if CAPTURE_PATH is not set.
+  """
+  global _capture_log
+  if _capture_log is None:
+    path = os.getenv("CAPTURE_PATH")
+    if not path:
+      return None
+    _capture_log = CaptureLog(
+        path,
+        max_bytes=int(os.getenv("CAPTURE_MAX_BYTES", str(16 * 1024 * 1024))),
+        backups=int(os.getenv("CAPTURE_BACKUPS", "3")),
+        sample_rate=float(os.getenv("CAPTURE_SAMPLE_RATE", "1")),
+    )
+  return _capture_log
+
+
+def capture_files(path: str) -> List[str]:
+  """
+  Return a capture file and its rotated files, oldest first.
+  """
+  files = []
+  index = 1
+  while os.path.exists(f"{path}.{index}"):
+    files.insert(0, f"{path}.{index}")
+    index += 1
+  if os.path.exists(path):
+    files.append(path)
+  return files
+
+
+def read_capture(path: str) -> Iterator[dict]:
+  """
+  Yield the records of a capture file and its rotated files, oldest first.
+  Lines that are not valid JSON, such as one cut off by a crash, are skipped.
+
+  Raises:
+      FileNotFoundError: If neither the file nor a rotated file exists.
+  """
+  files = capture_files(path)
+  if not files:
+    raise FileNotFoundError(path)
+  for name in files:
+    with open(name) as f:
+      for line in f:
+        try:
+          record = json.loads(line)
+        except ValueError:
+          continue
+        if isinstance(record, dict):
+          yield record
+
+
+class CaptureMiddleware:
+  """
+  ASGI middleware recording POST requests to the capture log, if enabled.
+  """
+
+  def __init__(self, app):
+    self.app = app
+
+  async def __call__(self, scope, receive, send):
+    log = get_capture_log()
+    if scope["type"] != "http" or scope["method"] != "POST" or log is None or not log.sampled():
+      await self.app(scope, receive, send)
+      return
+
+    started = time.perf_counter()
+    record = {"at": time.time(), "source": "http", "endpoint": scope["path"],
+              "query": scope.get("query_string", b"").decode("latin-1"), "type": request_type(scope["path"]),
+              "request": None}
+    body = []
+    response = {"status": None, "ttfb": None, "bytes": 0}
+
+    async def receive_recorded():
+      message = await receive()
+      if message["type"] == "http.request":
+        body.append(message.get("body", b""))
+      return message
+
+    async def send_recorded(message):
+      if message["type"] == "http.response.start":
+        response["status"] = message["status"]
+      elif message["type"] == "http.response.body":
+        if response["ttfb"] is None:
+          response["ttfb"] = time.perf_counter() - started
+        response["bytes"] += len(message.get("body", b""))
+      await send(message)
+
+    try:
+      await self.app(scope, receive_recorded, send_recorded)
+    finally:
+      headers = dict(scope["headers"])
+      accept_encoding = headers.get(b"accept-encoding")
+      log.record({
+          **record,
+          "accept_encoding": accept_encoding.decode("latin-1") if accept_encoding else None,
+          "status": response["status"],
+          "latency": round(time.perf_counter() - started, 6),
+          "ttfb": round(response["ttfb"], 6) if response["ttfb"] is not None else None,
+          "response_bytes": response["bytes"],
+      }, b"".join(body), headers.get(b"content-type", b"").startswith(b"application/json"))
+
+
+class _RecordingContext:
+  # Passes everything through to the agent's Context, noting the replies sent
+  def __init__(self, ctx, started: float):
+    self._ctx = ctx
+    self._started = started
+    self.status = None
+    self.ttfb = None
+    self.response_bytes = 0
+
+  def __getattr__(self, name):
+    return getattr(self._ctx, name)
+
+  async def send(self, destination, message, *args, **kwargs):
+    if self.ttfb is None:
+      self.ttfb = time.perf_counter() - self._started
+    text = getattr(message, "message", None)
+    if isinstance(text, str):
+      self.response_bytes += len(text.encode("utf-8"))
+    message_type = getattr(message, "type", None)
+    self.status = getattr(message_type, "value", message_type)
+    return await self._ctx.send(destination, message, *args, **kwargs)
+
+
+def capture_messages(endpoint: str, request_type: str):
+  """
+  Decorator recording the messages an agent handler receives to the capture
+  log, if enabled.
+
+  Args:
+      endpoint (str): Name of the handler, e.g. "notes_agent".
+      request_type (str): /batch item type of its messages, e.g. "notes".
+  """
+  def decorator(handler):
+    @functools.wraps(handler)
+    async def wrapper(ctx, sender, msg):
+      log = get_capture_log()
+      if log is None or not log.sampled():
+        return await handler(ctx, sender, msg)
+      at = time.time()
+      started = time.perf_counter()
+      recording = _RecordingContext(ctx, started)
+      try:
+        return await handler(recording, sender, msg)
+      finally:
+        log.record({
+            "at": at, "source": "agent", "endpoint": endpoint, "type": request_type,
+            # Compacted here, so queued records do not hold on to whole chapters
+            "request": compact(msg.dict()), "status": recording.status,
+            "latency": round(time.perf_counter() - started, 6),
+            "ttfb": round(recording.ttfb, 6) if recording.ttfb is not None else None,
+            "response_bytes": recording.response_bytes,
+        })
+    return wrapper
+  return decorator
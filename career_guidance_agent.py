@@ -1,8 +1,15 @@
 from uagents import Agent, Context, Protocol, Model
 from ai_engine import UAgentResponse, UAgentResponseType
 from pydantic import Field
-from typing import Literal
-from utils import get_llm_response
+from typing import Literal, Optional
+from prompts import CAREER_GUIDANCE_PROMPT
+from admission import PRIORITIES
+from metrics import RESPONSE_BYTES, instrument, stage
+from capture import capture_messages
+from ratelimit import reject_if_limited
+from sessions import answer_follow_up, record_turn
+from replies import reply_failure
+from utils import get_llm_completion
 
 # print("[StudyMate Career Guidance Agent] running.")
 
@@ -73,30 +80,59 @@ career_guidance_protocol = Protocol("CareerGuidanceAgentProtocol")
 
 
 @career_guidance_protocol.on_message(model=CareerGuidanceAgentModel, replies={UAgentResponse})
+@instrument("career_guidance_agent")
+@capture_messages("career_guidance_agent", "career-guidance")
 async def get_action(ctx: Context, sender: str, msg: CareerGuidanceAgentModel):
+  if await reject_if_limited(ctx, sender):
+    return
+
   ctx.logger.info(f"📩 Incoming message from {sender}:")
   ctx.logger.info(f"👉 Data: {msg.json(indent=2)}")
 
-  formatted_prompt = (
-      "You are acting as a career guidance tool that assists students in making informed decisions "
-      "about their education and future career paths. The user provides information about their current "
-      "education level, degree or class, field of interest, and future goals. Based on this information, "
-      "you provide personalized career guidance and advice to help students plan for their future.\n\n"
-      "Given the provided data for the Career Guidance Agent, your task is to provide guidance based on the following:\n\n"
-      f"- Education Level: {msg.education_level}\n"
-      f"- Degree/Class: {msg.degree_or_class}\n"
-      f"- Field of Interest: {msg.field_of_interest}\n"
-      f"- Future Goal: {msg.future_goal}\n\n"
-      "Note: If any information is missing (marked as 'NA'), please use intelligent reasoning to provide career guidance accordingly."
-  )
+  formatted_prompt = CAREER_GUIDANCE_PROMPT.render(msg)
   ctx.logger.info(f'{formatted_prompt=}')
 
   message = (
       "This is a test message. Once the language model (LLM) is integrated, this will be replaced "
       "with personalized career guidance and advice."
   )
-  message = await get_llm_response(formatted_prompt)
-  await ctx.send(sender, UAgentResponse(message=message, type=UAgentResponseType.FINAL))
+  try:
+    completion = await get_llm_completion(formatted_prompt, cache_key=CAREER_GUIDANCE_PROMPT.cache_key(msg),
+                                          priority=PRIORITIES[CAREER_GUIDANCE_PROMPT.name], profile=CAREER_GUIDANCE_PROMPT.profile(msg),
+                                          similarity_key=CAREER_GUIDANCE_PROMPT.similarity_key(msg),
+                                          parser=CAREER_GUIDANCE_PROMPT.parser)
+  except Exception as e:
+    await reply_failure(ctx, sender, e)
+    return
+  # Later follow-ups from the sender build on this response
+  record_turn(CAREER_GUIDANCE_PROMPT, sender, msg, completion)
+  message = completion.text
+  ctx.logger.info(f"🔢 Token usage: {completion.usage.dict()}")
+  RESPONSE_BYTES.observe(len(message.encode("utf-8")), endpoint="career_guidance_agent")
+  with stage("response_send"):
+    await ctx.send(sender, UAgentResponse(message=message, type=UAgentResponseType.FINAL))
+
+
+class CareerGuidanceFollowUpModel(Model):
+  follow_up: str = Field(
+      ...,
+      title="Follow-up",
+      description=(
+          "Please specify what the student wants next, building on the career guidance they received last, "
+          "e.g. more of it, more detail on a part or a change. This value must be asked from user."
+      ),
+      example="What skills should I learn first for the second option?"
+  )
+
+
+career_guidance_follow_up_protocol = Protocol("CareerGuidanceFollowUpProtocol")
+
+
+@career_guidance_follow_up_protocol.on_message(model=CareerGuidanceFollowUpModel, replies={UAgentResponse})
+@instrument("career_guidance_agent_follow_up")
+@capture_messages("career_guidance_agent_follow_up", "career-guidance")
+async def get_follow_up(ctx: Context, sender: str, msg: CareerGuidanceFollowUpModel):
+  await answer_follow_up(ctx, sender, CAREER_GUIDANCE_PROMPT, msg.follow_up, endpoint="career_guidance_agent_follow_up")
 
 
 AGENT_NAME = 'career_guidance_agent'
@@ -105,20 +141,52 @@ AGENT_SEED = AGENT_NAME
 AGENT_ENDPOINT = [f'http://localhost:{AGENT_PORT}/submit']
 AGENT_MAILBOX_KEY = ""
 
-career_guidance_agent = Agent(name=AGENT_NAME,
-                              seed=AGENT_SEED,
-                              # port=AGENT_PORT,
-                              # endpoint=AGENT_ENDPOINT,
-                              # mailbox=f"{AGENT_MAILBOX_KEY}@https://agentverse.ai"
-                              )
-career_guidance_agent.include(career_guidance_protocol, publish_manifest=True)
 
-
-@career_guidance_agent.on_event("startup")
 async def startup(ctx: Context):
   ctx.logger.info(f"🤖 Agent Address: {ctx.address}")
 
-CAREER_GUIDANCE_AGENT_ADDRESS = career_guidance_agent.address
+
+def create_agent(name: str = AGENT_NAME, seed: str = AGENT_SEED, port: Optional[int] = None) -> Agent:
+  """
+  Build a Career Guidance Agent. Without a port it is meant to run inside a Bureau; with a
+  port it serves its own endpoint, as the replicas started by launcher.py do.
+  """
+  agent = Agent(name=name,
+                seed=seed,
+                port=port,
+                endpoint=[f'http://localhost:{port}/submit'] if port else None,
+                # mailbox=f"{AGENT_MAILBOX_KEY}@https://agentverse.ai"
+                )
+  agent.include(career_guidance_protocol, publish_manifest=True)
+  agent.include(career_guidance_follow_up_protocol, publish_manifest=True)
+  agent.on_event("startup")(startup)
+  return agent
+
+
+_default_agent = None
+
+
+def get_agent() -> Agent:
+  """
+  Return the Career Guidance Agent run by main.py, building it on first use.
+  """
+  global _default_agent
+  if _default_agent is None:
+    _default_agent = create_agent()
+  return _default_agent
+
+
+def __getattr__(name: str):
+  # The agent and its address are built on first access, so importing this
+  # module for its model or handler does not construct an Agent or derive keys
+  if name == "career_guidance_agent":
+    return get_agent()
+  if name == "CAREER_GUIDANCE_AGENT_ADDRESS":
+    return get_agent().address
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__ == "__main__":
-  career_guidance_agent.run()
+  from dotenv import load_dotenv
+  load_dotenv()
+  get_agent().run()
@@ -0,0 +1,121 @@
+import gzip
+from typing import Dict, Optional
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+"""
+StudyMate Response Compression
+
+ASGI middleware that compresses responses with the best encoding the client
+accepts: brotli when the `brotli` package is installed, otherwise gzip. Only
+complete responses of at least `minimum_size` bytes are compressed; streamed
+responses (Server-Sent Events, batch results) pass through unchanged so that
+every chunk still reaches the client as soon as it is produced.
+"""
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def supported_encodings() -> tuple:
+  """
+  Encodings this server can produce, most preferred first.
+  """
+  return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+  """
+  Pick the response encoding for an Accept-Encoding header, or None to send
+  the response uncompressed. Codings with a higher q-value win; ties go to
+  the more compact encoding.
+  """
+  weights: Dict[str, float] = {}
+  for part in accept_encoding.split(","):
+    coding, _, params = part.partition(";")
+    coding = coding.strip().lower()
+    if not coding:
+      continue
+    weight = 1.0
+    params = params.strip().lower()
+    if params.startswith("q="):
+      try:
+        weight = float(params[2:])
+      except ValueError:
+        weight = 0.0
+    weights[coding] = weight
+
+  best = None
+  for coding in supported_encodings():
+    weight = weights.get(coding, weights.get("*", 0.0))
+    if weight > 0 and (best is None or weight > best[1]):
+      best = (coding, weight)
+  return best[0] if best else None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+  if encoding == "br":
+    return brotli.compress(body, quality=BROTLI_QUALITY)
+  return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+  """
+  Compress responses according to the request's Accept-Encoding header.
+
+  Args:
+      app: The ASGI application to wrap.
+      minimum_size (int): Smallest response body, in bytes, worth compressing.
+  """
+
+  def __init__(self, app, minimum_size: int = 500):
+    self.app = app
+    self.minimum_size = minimum_size
+
+  async def __call__(self, scope, receive, send):
+    if scope["type"] != "http":
+      await self.app(scope, receive, send)
+      return
+    headers = dict(scope["headers"])
+    encoding = negotiate(headers.get(b"accept-encoding", b"").decode("latin-1"))
+    if encoding is None:
+      await self.app(scope, receive, send)
+      return
+
+    state = {"start": None, "passthrough": False}
+
+    async def send_compressed(message):
+      if state["passthrough"]:
+        await send(message)
+        return
+      if message["type"] == "http.response.start":
+        # Held back until the first body chunk shows whether to compress
+        state["start"] = message
+        return
+
+      start = state["start"]
+      body = message.get("body", b"")
+      response_headers = [(name.lower(), value) for name, value in start.get("headers", [])]
+      already_encoded = any(name == b"content-encoding" for name, _ in response_headers)
+      if message.get("more_body", False) or already_encoded or len(body) < self.minimum_size:
+        state["passthrough"] = True
+        await send(start)
+        await send(message)
+        return
+
+      body = compress(body, encoding)
+      response_headers = [(name, value) for name, value in response_headers if name != b"content-length"]
+      vary = [value for name, value in response_headers if name == b"vary"]
+      response_headers = [(name, value) for name, value in response_headers if name != b"vary"]
+      response_headers += [
+          (b"content-encoding", encoding.encode("latin-1")),
+          (b"content-length", str(len(body)).encode("latin-1")),
+          (b"vary", b", ".join(vary + [b"Accept-Encoding"])),
+      ]
+      await send({**start, "headers": response_headers})
+      await send({**message, "body": body})
+
+    await self.app(scope, receive, send_compressed)
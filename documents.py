@@ -0,0 +1,283 @@
+import asyncio
+import os
+import re
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from admission import PRIORITIES
+from backends import Completion, Usage, estimate_tokens
+from prompts import DOCUMENT_CHUNK_PROMPT, DOCUMENT_REDUCE_PROMPT, NOTES_PROMPT
+from ratelimit import charge_client
+from utils import get_cached_completion, get_llm_completion, profile_cache_key, store_completion
+
+"""
+StudyMate Long Documents
+
+Notes on long reference material, e.g. a whole chapter pasted or uploaded as
+`reference_material`, are generated map-reduce style instead of from a single
+prompt that would be slow and could exceed the model's context:
+
+  1. The text is split into chunks of at most DOCUMENT_CHUNK_TOKENS tokens at
+     line and sentence boundaries. Chunks can be produced while the text is
+     still being received (see Chunker).
+  2. Each chunk is summarized into notes, at most DOCUMENT_MAX_CONCURRENCY at a
+     time. Chunk notes do not depend on the notes style and are cached per
+     chunk, so asking for the same material in another style reuses them.
+  3. The chunk notes are combined into notes in the requested style. If they
+     are too long to combine at once, they are first combined in groups.
+
+Whichever way it arrives, reference material over DOCUMENT_MAX_BYTES is
+rejected, and the client is charged one request per chunk.
+"""
+
+# Defaults of the settings, which are read from the environment when used
+# since the server loads .env only after importing this module
+DEFAULTS = {
+    "DOCUMENT_MIN_TOKENS": 1500,  # reference material longer than this is a document
+    "DOCUMENT_CHUNK_TOKENS": 2000,
+    "DOCUMENT_MAX_CONCURRENCY": 4,
+    "DOCUMENT_REDUCE_TOKENS": 8000,  # largest input to a single combining step
+    "DOCUMENT_MAX_BYTES": 2 * 1024 * 1024,  # largest reference material accepted
+}
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+class DocumentTooLarge(ValueError):
+  """
+  Raised for reference material over DOCUMENT_MAX_BYTES.
+  """
+
+  def __init__(self, max_bytes: int):
+    super().__init__(f"Reference material may be at most {max_bytes} bytes")
+    self.max_bytes = max_bytes
+
+
+class ChunkRequest(BaseModel):
+  topic: str
+  additional_requirements: str
+  excerpt: str
+
+
+class ReduceRequest(BaseModel):
+  topic: str
+  notes_style: str
+  additional_requirements: str
+  partial_notes: str
+
+
+def setting(name: str) -> int:
+  return int(os.getenv(name, str(DEFAULTS[name])))
+
+
+def is_document(reference_material: str) -> bool:
+  """
+  Whether reference material is long enough to be generated map-reduce style.
+  """
+  return estimate_tokens(reference_material) > setting("DOCUMENT_MIN_TOKENS")
+
+
+def check_document_size(reference_material: str) -> None:
+  """
+  Reject reference material over DOCUMENT_MAX_BYTES.
+
+  Raises:
+      DocumentTooLarge: If it is over the limit.
+  """
+  max_bytes = setting("DOCUMENT_MAX_BYTES")
+  # A character is at most four bytes, so short material need not be encoded
+  if len(reference_material) * 4 > max_bytes and len(reference_material.encode("utf-8")) > max_bytes:
+    raise DocumentTooLarge(max_bytes)
+
+
+def document_chunks(reference_material: str) -> List[str]:
+  """
+  Split reference material into the chunks its notes are generated from, e.g.
+  to charge a client for them up front.
+
+  Raises:
+      DocumentTooLarge: If it is over DOCUMENT_MAX_BYTES.
+  """
+  check_document_size(reference_material)
+  return split_chunks(reference_material)
+
+
+class Chunker:
+  """
+  Splits text fed to it piece by piece into chunks of at most `max_tokens`
+  tokens. Chunks end at line boundaries where possible, then at sentence
+  boundaries, and only split inside a sentence when it alone is too long.
+  """
+
+  def __init__(self, max_tokens: Optional[int] = None):
+    self.max_tokens = max_tokens or setting("DOCUMENT_CHUNK_TOKENS")
+    self._pending = ""  # text after the last complete line
+    self._lines: List[str] = []
+    self._tokens = 0
+
+  def feed(self, text: str) -> List[str]:
+    """
+    Add text and return the chunks completed by it.
+    """
+    self._pending += text
+    complete, newline, pending = self._pending.rpartition("\n")
+    if newline:
+      self._pending = pending
+      return self._add_lines(complete.split("\n"))
+    if len(self._pending) <= self.max_tokens * 4:
+      return []
+    # A very long line: take its complete sentences rather than wait for its end
+    sentences = _SENTENCE_END.split(self._pending)
+    self._pending = sentences.pop()
+    return self._add_lines(sentences)
+
+  def finish(self) -> List[str]:
+    """
+    Return the remaining chunks once all text has been fed.
+    """
+    chunks = self._add_lines([self._pending])
+    self._pending = ""
+    if self._lines:
+      chunks.append("\n".join(self._lines).strip())
+      self._lines, self._tokens = [], 0
+    return [chunk for chunk in chunks if chunk]
+
+  def _add_lines(self, lines: List[str]) -> List[str]:
+    chunks = []
+    for line in lines:
+      for piece in self._split(line):
+        tokens = estimate_tokens(piece) + 1
+        if self._lines and self._tokens + tokens > self.max_tokens:
+          chunks.append("\n".join(self._lines).strip())
+          self._lines, self._tokens = [], 0
+        self._lines.append(piece)
+        self._tokens += tokens
+    return [chunk for chunk in chunks if chunk]
+
+  def _split(self, line: str) -> List[str]:
+    if estimate_tokens(line) <= self.max_tokens:
+      return [line]
+    pieces = []
+    max_chars = self.max_tokens * 4
+    for sentence in _SENTENCE_END.split(line):
+      pieces.extend(sentence[i:i + max_chars] for i in range(0, len(sentence), max_chars))
+    return pieces
+
+
+def split_chunks(text: str, max_tokens: Optional[int] = None) -> List[str]:
+  """
+  Split a complete text into chunks (see Chunker).
+  """
+  chunker = Chunker(max_tokens)
+  return chunker.feed(text) + chunker.finish()
+
+
+def _combine_usage(completions: List[Completion]) -> Usage:
+  """
+  Total usage of the calls behind a document's notes. The result counts as
+  cached only if every call was answered from the cache.
+  """
+  usage = Usage(finish_reason=completions[-1].usage.finish_reason, cached=all(c.usage.cached for c in completions))
+  for completion in completions:
+    usage.prompt_tokens += completion.usage.prompt_tokens
+    usage.output_tokens += completion.usage.output_tokens
+  return usage
+
+
+async def map_chunks(request: BaseModel, chunks: List[str], priority: int) -> List[Completion]:
+  """
+  Generate notes for each chunk, at most DOCUMENT_MAX_CONCURRENCY at a time,
+  and return them in document order.
+  """
+  limit = asyncio.Semaphore(setting("DOCUMENT_MAX_CONCURRENCY"))
+
+  async def map_chunk(chunk: str) -> Completion:
+    chunk_request = ChunkRequest(topic=request.topic, additional_requirements=request.additional_requirements,
+                                 excerpt=chunk)
+    async with limit:
+      return await get_llm_completion(DOCUMENT_CHUNK_PROMPT.render(chunk_request),
+                                      cache_key=DOCUMENT_CHUNK_PROMPT.cache_key(chunk_request), priority=priority,
+                                      profile=DOCUMENT_CHUNK_PROMPT.profile(chunk_request))
+
+  tasks = [asyncio.create_task(map_chunk(chunk)) for chunk in chunks]
+  try:
+    return list(await asyncio.gather(*tasks))
+  finally:
+    # Stop the other chunks if one fails
+    for task in tasks:
+      task.cancel()
+
+
+async def reduce_notes(request: BaseModel, partial_notes: List[str], priority: int) -> Completion:
+  """
+  Combine chunk notes into notes in the request's style. Notes too long to
+  combine at once are first combined in groups into detailed notes.
+  """
+  completions = []
+  max_tokens = setting("DOCUMENT_REDUCE_TOKENS")
+  while len(partial_notes) > 1 and estimate_tokens("\n\n".join(partial_notes)) > max_tokens:
+    groups, group, tokens = [], [], 0
+    for notes in partial_notes:
+      if group and tokens + estimate_tokens(notes) > max_tokens:
+        groups.append(group)
+        group, tokens = [], 0
+      group.append(notes)
+      tokens += estimate_tokens(notes)
+    groups.append(group)
+    if len(groups) == len(partial_notes):
+      # Every group holds a single part; combining would not shrink anything
+      break
+    combined = await asyncio.gather(*(_reduce(request, group, "Detailed", priority) for group in groups))
+    completions.extend(combined)
+    partial_notes = [completion.text for completion in combined]
+
+  # The final notes are cached by the caller under the notes request
+  completion = await _reduce(request, partial_notes, request.notes_style, priority, cache=False)
+  return Completion(completion.text, _combine_usage(completions + [completion]), completion.structured)
+
+
+async def _reduce(request: BaseModel, partial_notes: List[str], notes_style: str, priority: int,
+                  cache: bool = True) -> Completion:
+  reduce_request = ReduceRequest(topic=request.topic, notes_style=notes_style,
+                                 additional_requirements=request.additional_requirements,
+                                 partial_notes="\n\n".join(f"Part {i}:\n{notes}" for i, notes in enumerate(partial_notes, 1)))
+  return await get_llm_completion(DOCUMENT_REDUCE_PROMPT.render(reduce_request),
+                                  cache_key=DOCUMENT_REDUCE_PROMPT.cache_key(reduce_request) if cache else None,
+                                  priority=priority,
+                                  profile=NOTES_PROMPT.profile(reduce_request), parser=DOCUMENT_REDUCE_PROMPT.parser)
+
+
+async def get_document_notes_completion(request: BaseModel, priority: int = PRIORITIES[NOTES_PROMPT.name],
+                                        chunks: Optional[List[str]] = None) -> Completion:
+  """
+  Return notes on a request whose reference material is a long document.
+
+  Args:
+      request (BaseModel): A notes request (NotesRequest or NotesAgentModel).
+      priority (int, optional): Admission priority class for LLM calls.
+      chunks (list, optional): Chunks of the reference material, if it was
+          split while being received. Defaults to splitting it.
+
+  Raises:
+      AdmissionRejected: As get_llm_completion.
+      DocumentTooLarge: If the reference material is over DOCUMENT_MAX_BYTES.
+      RateLimited: If the client of the current request cannot be charged for every chunk.
+  """
+  check_document_size(request.reference_material)
+  # The notes on the whole document are cached under the notes request itself
+  profile = NOTES_PROMPT.profile(request)
+  cache_key = DOCUMENT_REDUCE_PROMPT.cache_key(request)
+  cached = await get_cached_completion(cache_key, profile, parser=DOCUMENT_REDUCE_PROMPT.parser)
+  if cached is not None:
+    return cached
+
+  if chunks is None:
+    chunks = split_chunks(request.reference_material)
+  # The request was charged as one; each further chunk is an LLM call of its own
+  charge_client(len(chunks) - 1)
+  mapped = await map_chunks(request, chunks, priority)
+  reduced = await reduce_notes(request, [chunk.text for chunk in mapped], priority)
+  completion = Completion(reduced.text, _combine_usage(mapped + [reduced]), reduced.structured)
+  store_completion(profile_cache_key(cache_key, profile), None, profile, completion)
+  return completion
@@ -0,0 +1,181 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from admission import AdmissionController
+
+"""
+StudyMate Request Hedging
+
+Cuts the latency tail of LLM calls. When a call has not returned after the
+`percentile`-th percentile of recent call latencies, an identical second call
+is started; whichever returns first is used and the other is cancelled.
+
+Hedges are limited by a global budget: every call earns `budget` hedge credits
+(0.05 allows at most 5% extra calls) and a hedge spends one, with at most
+`burst` credits saved up. Latencies are tracked per generation profile, since
+a 'Detailed' notes response takes much longer than a 'Short' one, and no call
+is hedged until its profile has `min_samples` latencies.
+
+A hedge is a call of its own and needs its own admission slot: it is only
+started if the admission controller has a slot free right away, so hedging
+never takes upstream concurrency beyond LLM_MAX_CONCURRENCY or delays a
+queued request. Only complete responses are hedged. Streams are not, as their first chunks
+have already been sent by the time a hedge would start.
+"""
+
+T = TypeVar("T")
+
+
+class Hedger:
+  """
+  Issues a backup call for slow calls, within a budget of extra calls.
+
+  Args:
+      percentile (float): Percentile (0-100) of recent latencies after which
+          a call is hedged.
+      budget (float): Extra calls allowed per call, e.g. 0.05 for 5%.
+      burst (float): Most hedge credits saved up while calls are fast.
+      window (int): Recent latencies kept per profile.
+      min_samples (int): Latencies needed before a profile's calls are hedged.
+  """
+
+  def __init__(self, percentile: float = 95, budget: float = 0.05, burst: float = 10,
+               window: int = 500, min_samples: int = 50):
+    self.percentile = percentile
+    self.budget = budget
+    self.burst = burst
+    self.window = window
+    self.min_samples = min_samples
+    self.calls = 0
+    self.hedged = 0
+    self.hedge_wins = 0
+    self.skipped = 0  # calls that were slow enough to hedge but over budget
+    self.no_slot = 0  # calls that were slow enough to hedge but found no free admission slot
+    self._credits = 0.0
+    self._latencies: Dict[str, deque] = {}
+
+  def delay(self, key: str) -> Optional[float]:
+    """
+    Return the seconds after which a call for `key` is hedged, or None until
+    enough latencies have been seen.
+    """
+    latencies = self._latencies.get(key)
+    if latencies is None or len(latencies) < self.min_samples:
+      return None
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, math.ceil(len(ordered) * self.percentile / 100) - 1)]
+
+  def observe(self, key: str, latency: float) -> None:
+    """
+    Record the latency of a completed call.
+    """
+    latencies = self._latencies.get(key)
+    if latencies is None:
+      latencies = self._latencies[key] = deque(maxlen=self.window)
+    latencies.append(latency)
+
+  async def call(self, key: str, fn: Callable[[], Awaitable[T]],
+                 slots: Optional[AdmissionController] = None) -> T:
+    """
+    Call fn(), and call it again if the first call is slow and the budget allows.
+    The first call to succeed wins; if one call fails, the other is awaited.
+
+    Args:
+        key (str): Profile the call's latency is tracked under.
+        fn (Callable): Makes the call.
+        slots (AdmissionController, optional): Controller the second call
+            takes a slot from, only if one is free without waiting. The
+            first call is expected to hold a slot already.
+    """
+    self.calls += 1
+    self._credits = min(self.burst, self._credits + self.budget)
+    delay = self.delay(key)
+    started = time.monotonic()
+    primary = asyncio.ensure_future(fn())
+    if delay is None:
+      result = await primary
+      self.observe(key, time.monotonic() - started)
+      return result
+
+    tasks = {primary}
+    try:
+      done, _ = await asyncio.wait(tasks, timeout=delay)
+      if not done:
+        if self._credits < 1:
+          self.skipped += 1
+        elif slots is not None and not slots.try_acquire():
+          self.no_slot += 1
+        else:
+          self._credits -= 1
+          self.hedged += 1
+          hedge = asyncio.ensure_future(fn())
+          if slots is not None:
+            # Freed whether the hedge finishes, fails or is cancelled
+            hedge.add_done_callback(lambda _: slots.release())
+          tasks.add(hedge)
+      error = None
+      while tasks:
+        done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+          if task.exception() is None:
+            if task is not primary:
+              self.hedge_wins += 1
+            # For a hedge win, a lower bound of the primary's latency
+            self.observe(key, time.monotonic() - started)
+            return task.result()
+          # The other call may still succeed; the primary's error is raised if both fail
+          if error is None or task is primary:
+            error = task.exception()
+      raise error
+    finally:
+      for task in tasks:
+        task.cancel()
+
+  def stats(self) -> dict:
+    """
+    Return call and hedge counters.
+    """
+    return {
+        "calls": self.calls,
+        "hedged": self.hedged,
+        "hedge_wins": self.hedge_wins,
+        "over_budget": self.skipped,
+        "no_slot": self.no_slot,
+        "credits": round(self._credits, 2),
+    }
+
+
+_hedger = None
+
+
+def get_hedger() -> Optional[Hedger]:
+  """
+  Return the process-wide hedger, configured from the environment on first
+  use, or None if hedging is off (LLM_HEDGE_BUDGET is 0).
+  """
+  global _hedger
+  if _hedger is None:
+    budget = float(os.getenv("LLM_HEDGE_BUDGET", "0"))
+    if budget <= 0:
+      return None
+    _hedger = Hedger(
+        percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", "95")),
+        budget=budget,
+        burst=float(os.getenv("LLM_HEDGE_BURST", "10")),
+        window=int(os.getenv("LLM_HEDGE_WINDOW", "500")),
+        min_samples=int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "50")),
+    )
+  return _hedger
+
+
+def set_hedger(hedger: Optional[Hedger]) -> None:
+  """
+  Replace the process-wide hedger, e.g. in benchmarks, or pass None to
+  configure it from the environment again on next use.
+  """
+  global _hedger
+  _hedger = hedger
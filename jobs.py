@@ -0,0 +1,253 @@
+import asyncio
+import atexit
+import json
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, List, Optional
+
+from admission import AdmissionRejected
+
+"""
+StudyMate Job Queue
+
+Submit/poll/fetch mode for long generations. Jobs are kept in memory, saved
+to a local SQLite file and drained by a pool of asyncio workers, so a client
+does not need to hold a connection open while the LLM works and a burst of
+submissions is absorbed by the queue. Job IDs are the request's cache key, so
+submitting the same request twice returns the same job. Finished results
+expire after a TTL, like cached responses. State changes are batched and
+written to the file by a background thread every FLUSH_INTERVAL seconds, so
+the event loop never waits for the disk, and jobs survive a restart.
+"""
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Seconds between batched writes to the SQLite file, and between purges of expired jobs
+FLUSH_INTERVAL = 1.0
+PURGE_INTERVAL = 60.0
+
+COLUMNS = ("id", "type", "request", "status", "result", "error", "attempts", "not_before", "created_at", "updated_at")
+
+
+class JobStore:
+  """
+  Job table held in memory and backed by SQLite.
+
+  Args:
+      path (str): Database file. Use ":memory:" for a non-persistent store.
+      ttl (float): Seconds a finished job's result is kept. Submitting the
+          request again after that generates it again.
+  """
+
+  def __init__(self, path: str, ttl: float = 3600):
+    self.ttl = ttl
+    self._jobs = {}  # id -> job dict
+    self._lock = threading.Lock()
+    self._purged_at = time.time()
+    self._db = None
+    if path and path != ":memory:":
+      self._db = sqlite3.connect(path, check_same_thread=False)
+      self._db.row_factory = sqlite3.Row
+      self._db.execute(
+          "CREATE TABLE IF NOT EXISTS jobs ("
+          "id TEXT PRIMARY KEY, type TEXT NOT NULL, request TEXT NOT NULL, "
+          "status TEXT NOT NULL, result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+          "not_before REAL NOT NULL DEFAULT 0, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+      )
+      self._db.execute("DELETE FROM jobs WHERE status = ? AND updated_at <= ?", (DONE, self._purged_at - ttl))
+      # Jobs left running by a previous process are queued again
+      self._db.execute("UPDATE jobs SET status = ? WHERE status = ?", (QUEUED, RUNNING))
+      self._db.commit()
+      for row in self._db.execute("SELECT * FROM jobs"):
+        job = dict(row)
+        job["request"] = json.loads(job["request"])
+        self._jobs[job["id"]] = job
+      self._db_lock = threading.Lock()
+      self._pending = {}  # id -> job dict not yet on disk
+      threading.Thread(target=self._run_writer, name="job-store-writer", daemon=True).start()
+      # Write the last batch on shutdown
+      atexit.register(self.flush)
+
+  def submit(self, job_id: str, job_type: str, request: dict) -> dict:
+    """
+    Queue a job unless one with the same ID exists. A failed or expired job
+    is queued again; a queued, running or finished one is returned as is.
+    """
+    now = time.time()
+    with self._lock:
+      job = self._live(job_id, now)
+      if job is None:
+        job = {"id": job_id, "type": job_type, "request": request, "status": QUEUED, "result": None,
+               "error": None, "attempts": 0, "not_before": 0, "created_at": now, "updated_at": now}
+        self._jobs[job_id] = job
+        self._changed(job)
+      elif job["status"] == FAILED:
+        self._update(job, now, status=QUEUED, error=None, not_before=0)
+      return dict(job)
+
+  def get(self, job_id: str) -> Optional[dict]:
+    """
+    Return a job as a dict, or None if it does not exist or has expired.
+    """
+    with self._lock:
+      job = self._live(job_id, time.time())
+      return dict(job) if job is not None else None
+
+  def claim(self) -> Optional[dict]:
+    """
+    Mark the oldest runnable queued job as running and return it.
+    """
+    now = time.time()
+    with self._lock:
+      runnable = [job for job in self._jobs.values() if job["status"] == QUEUED and job["not_before"] <= now]
+      if not runnable:
+        return None
+      job = min(runnable, key=lambda job: job["created_at"])
+      self._update(job, now, status=RUNNING, attempts=job["attempts"] + 1)
+      return dict(job)
+
+  def complete(self, job_id: str, result: str) -> None:
+    self._finish(job_id, status=DONE, result=result)
+
+  def fail(self, job_id: str, error: str) -> None:
+    self._finish(job_id, status=FAILED, error=error)
+
+  def requeue(self, job_id: str, delay: float) -> None:
+    """
+    Put a running job back in the queue, runnable after `delay` seconds.
+    """
+    now = time.time()
+    self._finish(job_id, status=QUEUED, not_before=now + delay)
+
+  def counts(self) -> dict:
+    """
+    Return the number of live jobs in each status.
+    """
+    counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+    with self._lock:
+      self._prune(time.time())
+      for job in self._jobs.values():
+        counts[job["status"]] += 1
+    return counts
+
+  def flush(self) -> None:
+    """
+    Write pending state changes to the SQLite file now, and purge expired
+    jobs from it every PURGE_INTERVAL seconds.
+    """
+    if self._db is None:
+      return
+    now = time.time()
+    with self._lock:
+      pending, self._pending = self._pending, {}
+      purge = now - self._purged_at >= PURGE_INTERVAL
+      if purge:
+        self._prune(now)
+        self._purged_at = now
+    rows = [tuple(json.dumps(job[c]) if c == "request" else job[c] for c in COLUMNS) for job in pending.values()]
+    with self._db_lock:
+      self._db.executemany(
+          f"INSERT OR REPLACE INTO jobs ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+      if purge:
+        self._db.execute("DELETE FROM jobs WHERE status = ? AND updated_at <= ?", (DONE, now - self.ttl))
+      self._db.commit()
+
+  def _live(self, job_id: str, now: float) -> Optional[dict]:
+    # The job with this ID, unless it finished more than `ttl` seconds ago
+    job = self._jobs.get(job_id)
+    if job is not None and job["status"] == DONE and job["updated_at"] <= now - self.ttl:
+      del self._jobs[job_id]
+      return None
+    return job
+
+  def _prune(self, now: float) -> None:
+    for job_id in [job_id for job_id, job in self._jobs.items()
+                   if job["status"] == DONE and job["updated_at"] <= now - self.ttl]:
+      del self._jobs[job_id]
+
+  def _finish(self, job_id: str, **changes) -> None:
+    with self._lock:
+      job = self._jobs.get(job_id)
+      if job is not None:
+        self._update(job, time.time(), **changes)
+
+  def _update(self, job: dict, now: float, **changes) -> None:
+    job.update(changes, updated_at=now)
+    self._changed(job)
+
+  def _changed(self, job: dict) -> None:
+    if self._db is not None:
+      # A snapshot, so the writer never sees a half-applied change
+      self._pending[job["id"]] = dict(job)
+
+  def _run_writer(self) -> None:
+    while True:
+      time.sleep(FLUSH_INTERVAL)
+      self.flush()
+
+
+class JobWorkerPool:
+  """
+  Drains a JobStore with a fixed number of asyncio workers.
+
+  Args:
+      store (JobStore): The job table to drain.
+      handler (Callable): Coroutine taking (job type, request fields) and
+          returning the response text.
+      workers (int): Number of jobs processed concurrently.
+      poll_interval (float): Seconds an idle worker waits before checking the
+          queue again, in case jobs were delayed.
+  """
+
+  def __init__(self, store: JobStore, handler: Callable[[str, dict], Awaitable[str]],
+               workers: int = 4, poll_interval: float = 1.0):
+    self.store = store
+    self.handler = handler
+    self.workers = workers
+    self.poll_interval = poll_interval
+    self._wakeup = asyncio.Event()
+    self._tasks: List[asyncio.Task] = []
+
+  def start(self) -> None:
+    self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+  async def stop(self) -> None:
+    for task in self._tasks:
+      task.cancel()
+    await asyncio.gather(*self._tasks, return_exceptions=True)
+    self._tasks = []
+
+  def notify(self) -> None:
+    """
+    Wake idle workers after a job was submitted.
+    """
+    self._wakeup.set()
+
+  async def _work(self) -> None:
+    while True:
+      # Clear before claiming so a submission made in between is not missed
+      self._wakeup.clear()
+      job = self.store.claim()
+      if job is None:
+        try:
+          await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+        except asyncio.TimeoutError:
+          pass
+        continue
+
+      try:
+        result = await self.handler(job["type"], job["request"])
+      except AdmissionRejected as e:
+        # The LLM is saturated; leave the job queued and try again later
+        self.store.requeue(job["id"], e.retry_after)
+      except asyncio.CancelledError:
+        self.store.requeue(job["id"], 0)
+        raise
+      except Exception as e:
+        self.store.fail(job["id"], str(e))
+      else:
+        self.store.complete(job["id"], result)
@@ -0,0 +1,270 @@
+import argparse
+import importlib
+import itertools
+import json
+import multiprocessing
+import signal
+import sys
+import time
+import urllib.request
+import zlib
+from typing import Dict, List
+
+"""
+StudyMate Agent Launcher
+
+Runs each agent, or several replicas of a busy agent, in its own worker
+process instead of sharing one Bureau event loop. Every replica gets its own
+seed (and therefore address), port and metrics port. The launcher checks each
+worker's /healthz, restarts workers that die or stop answering, and shuts them
+down gracefully on Ctrl+C or SIGTERM.
+
+Replica 0 keeps the agent's usual name and seed, so its address is the one in
+NOTES_AGENT_ADDRESS etc. To spread one protocol's load across replicas, senders
+pick addresses with ReplicaRouter, e.g. ReplicaRouter.for_agent("notes", 3).
+Each replica keeps its own sessions, so a sender that sends follow-ups must
+keep to one replica (ReplicaRouter.address_for).
+
+Usage:
+    python launcher.py --replicas notes=3 questions=1 career_guidance=1
+"""
+
+# Agent key -> module defining AGENT_NAME, AGENT_SEED, AGENT_PORT and create_agent()
+AGENTS = {
+    "notes": "notes_agent",
+    "questions": "questions_agent",
+    "career_guidance": "career_guidance_agent",
+}
+
+# Replica r of an agent listens on AGENT_PORT + REPLICA_PORT_STEP * r
+REPLICA_PORT_STEP = 10
+
+# A worker's metrics and health endpoint listens on its agent port + METRICS_PORT_OFFSET
+METRICS_PORT_OFFSET = 1100
+
+
+def replica_spec(agent_key: str, replica: int) -> dict:
+  """
+  Return the name, seed, port and metrics port of an agent replica.
+  """
+  module = importlib.import_module(AGENTS[agent_key])
+  suffix = f"_{replica}" if replica else ""
+  port = module.AGENT_PORT + REPLICA_PORT_STEP * replica
+  return {
+      "agent": agent_key,
+      "replica": replica,
+      "name": module.AGENT_NAME + suffix,
+      "seed": module.AGENT_SEED + suffix,
+      "port": port,
+      "metrics_port": port + METRICS_PORT_OFFSET,
+  }
+
+
+def replica_address(agent_key: str, replica: int) -> str:
+  """
+  Return the agent address of a replica without starting it.
+  """
+  from uagents.crypto import Identity
+
+  return Identity.from_seed(replica_spec(agent_key, replica)["seed"], 0).address
+
+
+class ReplicaRouter:
+  """
+  Spreads messages for one protocol across its replicas, in round-robin order
+  or by a key such as the sender's address.
+
+  Follow-ups are answered from the session of the sender's last request, which
+  only the replica that handled it has, as sessions are cached in memory even
+  with SESSION_DB_PATH. Send a sender's requests and follow-ups with
+  address_for(sender); next_address() suits senders that never follow up.
+  """
+
+  def __init__(self, addresses: List[str]):
+    if not addresses:
+      raise ValueError("ReplicaRouter needs at least one address")
+    self.addresses = list(addresses)
+    self._next = itertools.cycle(self.addresses)
+
+  @classmethod
+  def for_agent(cls, agent_key: str, replicas: int) -> "ReplicaRouter":
+    return cls([replica_address(agent_key, replica) for replica in range(replicas)])
+
+  def next_address(self) -> str:
+    return next(self._next)
+
+  def address_for(self, key: str) -> str:
+    """
+    Return the same replica's address for every message with the same key.
+    """
+    return self.addresses[zlib.crc32(key.encode("utf-8")) % len(self.addresses)]
+
+
+def _raise_system_exit(signum, frame):
+  raise SystemExit(0)
+
+
+def run_worker(spec: dict) -> None:
+  """
+  Entry point of a worker process: serve metrics and health, then run one
+  agent replica until SIGTERM.
+  """
+  from dotenv import load_dotenv
+  from metrics import Heartbeat, start_http_exporter
+
+  load_dotenv()
+  # SystemExit unwinds the agent's event loop so in-flight handlers are cancelled cleanly
+  signal.signal(signal.SIGTERM, _raise_system_exit)
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+  module = importlib.import_module(AGENTS[spec["agent"]])
+  heartbeat = Heartbeat()
+  start_http_exporter(spec["metrics_port"], host="127.0.0.1", heartbeat=heartbeat)
+  agent = module.create_agent(name=spec["name"], seed=spec["seed"], port=spec["port"])
+  heartbeat.watch(agent)
+  agent.run()
+
+
+class Worker:
+
+  def __init__(self, spec: dict, context):
+    self.spec = spec
+    self.context = context
+    self.process = None
+    self.started_at = 0.0
+    self.restarts = 0
+    self.failed_checks = 0
+
+  @property
+  def label(self) -> str:
+    return f"{self.spec['name']} (port {self.spec['port']})"
+
+  def start(self) -> None:
+    self.process = self.context.Process(target=run_worker, args=(self.spec,), name=self.spec["name"], daemon=False)
+    self.process.start()
+    self.started_at = time.monotonic()
+    self.failed_checks = 0
+
+  def healthy(self, timeout: float) -> bool:
+    url = f"http://127.0.0.1:{self.spec['metrics_port']}/healthz"
+    try:
+      with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.status == 200
+    except OSError:
+      return False
+
+  def stop(self, grace: float) -> None:
+    if self.process is None or not self.process.is_alive():
+      return
+    self.process.terminate()
+    self.process.join(grace)
+    if self.process.is_alive():
+      self.process.kill()
+      self.process.join()
+
+
+class Supervisor:
+  """
+  Starts the worker processes, restarts them when they exit or fail health
+  checks, and stops them on shutdown.
+
+  Args:
+      specs (list): Replica specs from replica_spec().
+      health_interval (float): Seconds between health checks.
+      startup_grace (float): Seconds a new worker has before it is health checked.
+      max_failed_checks (int): Consecutive failed checks before a restart.
+      shutdown_grace (float): Seconds a worker has to exit after SIGTERM.
+  """
+
+  def __init__(self, specs: List[dict], health_interval: float = 5.0, startup_grace: float = 15.0,
+               max_failed_checks: int = 3, shutdown_grace: float = 10.0):
+    context = multiprocessing.get_context("spawn")
+    self.workers = [Worker(spec, context) for spec in specs]
+    self.health_interval = health_interval
+    self.startup_grace = startup_grace
+    self.max_failed_checks = max_failed_checks
+    self.shutdown_grace = shutdown_grace
+    self._stopping = False
+
+  def run(self) -> None:
+    signal.signal(signal.SIGTERM, self._request_stop)
+    signal.signal(signal.SIGINT, self._request_stop)
+    for worker in self.workers:
+      worker.start()
+      print(f"Started {worker.label}, pid {worker.process.pid}")
+    try:
+      while not self._stopping:
+        time.sleep(self.health_interval)
+        if not self._stopping:
+          self.check()
+    finally:
+      self.shutdown()
+
+  def check(self) -> None:
+    for worker in self.workers:
+      if not worker.process.is_alive():
+        self.restart(worker, f"exited with code {worker.process.exitcode}")
+        continue
+      if time.monotonic() - worker.started_at < self.startup_grace:
+        continue
+      if worker.healthy(timeout=self.health_interval / 2):
+        worker.failed_checks = 0
+        continue
+      worker.failed_checks += 1
+      if worker.failed_checks >= self.max_failed_checks:
+        self.restart(worker, f"failed {worker.failed_checks} health checks")
+
+  def restart(self, worker: Worker, reason: str) -> None:
+    print(f"Restarting {worker.label}: {reason}")
+    worker.stop(self.shutdown_grace)
+    worker.restarts += 1
+    worker.start()
+
+  def shutdown(self) -> None:
+    print("Stopping workers...")
+    for worker in self.workers:
+      if worker.process is not None and worker.process.is_alive():
+        worker.process.terminate()
+    for worker in self.workers:
+      worker.stop(self.shutdown_grace)
+
+  def _request_stop(self, signum, frame):
+    self._stopping = True
+
+
+def parse_replicas(values: List[str]) -> Dict[str, int]:
+  replicas = {agent_key: 1 for agent_key in AGENTS}
+  for value in values:
+    agent_key, _, count = value.partition("=")
+    if agent_key not in AGENTS or not count.isdigit():
+      raise argparse.ArgumentTypeError(f"Expected AGENT=COUNT with AGENT in {', '.join(AGENTS)}, got {value!r}")
+    replicas[agent_key] = int(count)
+  return replicas
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Run StudyMate agents in separate worker processes")
+  parser.add_argument("--replicas", nargs="*", default=[], metavar="AGENT=COUNT",
+                      help="replicas per agent, e.g. notes=3 (default 1 each; 0 disables an agent)")
+  parser.add_argument("--health-interval", type=float, default=5.0)
+  parser.add_argument("--shutdown-grace", type=float, default=10.0)
+  parser.add_argument("--registry", default="replicas.json",
+                      help="file listing each agent's replica addresses for senders")
+  args = parser.parse_args()
+
+  try:
+    replicas = parse_replicas(args.replicas)
+  except argparse.ArgumentTypeError as e:
+    parser.error(str(e))
+
+  specs = [replica_spec(agent_key, replica) for agent_key, count in replicas.items() for replica in range(count)]
+  with open(args.registry, "w") as f:
+    json.dump({agent_key: [replica_address(agent_key, replica) for replica in range(count)]
+               for agent_key, count in replicas.items()}, f, indent=2)
+
+  Supervisor(specs, health_interval=args.health_interval, shutdown_grace=args.shutdown_grace).run()
+  sys.exit(0)
+
+
+if __name__ == "__main__":
+  main()
@@ -1,8 +1,22 @@
+import os
+from dotenv import load_dotenv
 from uagents import Bureau
 from notes_agent import notes_agent
 from questions_agent import questions_agent
 from career_guidance_agent import career_guidance_agent
 from test_agent import test_agent
+from metrics import Heartbeat, start_http_exporter
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Serve the Bureau's metrics for scraping; set BUREAU_METRICS_PORT empty to disable
+metrics_port = os.getenv("BUREAU_METRICS_PORT", "9090")
+if metrics_port:
+  # /healthz fails if the Bureau's event loop stops running its agents' tasks
+  heartbeat = Heartbeat()
+  heartbeat.watch(notes_agent)
+  start_http_exporter(int(metrics_port), heartbeat=heartbeat)
 
 bureau = Bureau()
 bureau.add(notes_agent)
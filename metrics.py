@@ -0,0 +1,388 @@
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+"""
+StudyMate Metrics
+
+Minimal Prometheus-style metrics: counters, gauges and histograms with labels,
+rendered in the Prometheus text exposition format. Recording a sample is a dict
+lookup and an addition, so collection can stay on in production. The FastAPI
+server serves the registry at /metrics; the Bureau process can serve it with
+start_http_exporter(), whose /healthz follows a Heartbeat of the agents' event
+loop.
+
+The endpoint or agent handling the current request is kept in a context
+variable, so code deep in the LLM path can label its samples without the label
+being passed through every call.
+"""
+
+# Endpoint or agent label of the request being handled in the current context
+current_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar("current_endpoint", default="unknown")
+
+# perf_counter() time at which the current request was received
+request_started: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_started", default=None)
+
+# Outcome of the request being handled in the current context
+_outcome: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("outcome", default=None)
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 768, 1024, 1536, 2048, 4096, 8192)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+  pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+  if extra:
+    pairs.append(extra)
+  return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+  kind = ""
+
+  def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+    self.name = name
+    self.documentation = documentation
+    self.label_names = tuple(labels)
+    self._values: Dict[Tuple[str, ...], object] = {}
+
+  def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+    return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+  def render(self) -> List[str]:
+    lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+    for key, value in list(self._values.items()):
+      lines.extend(self._render_value(key, value))
+    return lines
+
+  def _render_value(self, key, value) -> List[str]:
+    return [f"{self.name}{_format_labels(self.label_names, key)} {value}"]
+
+
+class Counter(_Metric):
+  kind = "counter"
+
+  def inc(self, amount: float = 1, **labels) -> None:
+    key = self._key(labels)
+    self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+  kind = "gauge"
+
+  def set(self, value: float, **labels) -> None:
+    self._values[self._key(labels)] = value
+
+  def inc(self, amount: float = 1, **labels) -> None:
+    key = self._key(labels)
+    self._values[key] = self._values.get(key, 0) + amount
+
+  def dec(self, amount: float = 1, **labels) -> None:
+    self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+  kind = "histogram"
+
+  def __init__(self, name: str, documentation: str, labels: Iterable[str] = (),
+               buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+    super().__init__(name, documentation, labels)
+    self.buckets = tuple(buckets)
+
+  def observe(self, value: float, **labels) -> None:
+    key = self._key(labels)
+    state = self._values.get(key)
+    if state is None:
+      # Per-bucket counts (non-cumulative), then sum and count
+      state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+    state[0][bisect.bisect_left(self.buckets, value)] += 1
+    state[1] += value
+    state[2] += 1
+
+  @contextmanager
+  def time(self, **labels):
+    """
+    Observe the duration of the block in seconds.
+    """
+    started = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.observe(time.perf_counter() - started, **labels)
+
+  def _render_value(self, key, value) -> List[str]:
+    counts, total, count = value
+    lines = []
+    cumulative = 0
+    for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+      cumulative += bucket_count
+      le = "+Inf" if bound == float("inf") else repr(bound)
+      bucket_labels = _format_labels(self.label_names, key, f'le="{le}"')
+      lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+    labels = _format_labels(self.label_names, key)
+    lines.append(f"{self.name}_sum{labels} {total}")
+    lines.append(f"{self.name}_count{labels} {count}")
+    return lines
+
+
+class Registry:
+  """
+  Holds metrics and collectors and renders them for scraping. Collectors are
+  callables run at scrape time to refresh gauges from other components
+  (cache, admission controller, circuit breaker).
+  """
+
+  def __init__(self):
+    self._metrics: List[_Metric] = []
+    self._collectors: List[Callable[[], None]] = []
+
+  def register(self, metric: _Metric) -> _Metric:
+    self._metrics.append(metric)
+    return metric
+
+  def add_collector(self, collector: Callable[[], None]) -> None:
+    self._collectors.append(collector)
+
+  def render(self) -> str:
+    for collector in self._collectors:
+      collector()
+    lines = []
+    for metric in self._metrics:
+      lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    "studymate_requests_total", "Requests handled, by endpoint or agent and outcome.", ("endpoint", "status")))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    "studymate_requests_in_flight", "Requests currently being handled.", ("endpoint",)))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "studymate_stage_seconds", "Time spent per request stage.", ("endpoint", "stage")))
+PROMPT_BYTES = REGISTRY.register(Histogram(
+    "studymate_prompt_bytes", "Size of prompts sent to the LLM.", ("endpoint",), SIZE_BUCKETS))
+RESPONSE_BYTES = REGISTRY.register(Histogram(
+    "studymate_response_bytes", "Size of responses returned to clients.", ("endpoint",), SIZE_BUCKETS))
+TOKENS = REGISTRY.register(Histogram(
+    "studymate_llm_tokens", "Prompt and output tokens per generated response, by generation profile.",
+    ("endpoint", "profile", "kind"), TOKEN_BUCKETS))
+TRUNCATED = REGISTRY.register(Counter(
+    "studymate_llm_truncated_total", "Responses that reached their profile's output token limit.",
+    ("endpoint", "profile")))
+DERIVED = REGISTRY.register(Counter(
+    "studymate_question_sets_derived_total",
+    "Question sets served from the cached set with or without answers instead of a full generation.", ("kind",)))
+COMPONENT = REGISTRY.register(Gauge(
+    "studymate_component", "Counters and sizes reported by the caches, admission controller and circuit breaker.",
+    ("component", "stat")))
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+  """
+  Record the duration of a request stage for the current endpoint.
+  """
+  STAGE_SECONDS.observe(seconds, endpoint=current_endpoint.get(), stage=stage)
+
+
+@contextmanager
+def stage(name: str):
+  """
+  Time the block as a stage of the current request.
+  """
+  started = time.perf_counter()
+  try:
+    yield
+  finally:
+    observe_stage(name, time.perf_counter() - started)
+
+
+@contextmanager
+def track_request(endpoint: str):
+  """
+  Label the current context with an endpoint or agent and count the request,
+  its outcome and the number in flight. The outcome is "ok" unless the block
+  raises or calls set_outcome().
+  """
+  endpoint_token = current_endpoint.set(endpoint)
+  outcome = {"status": "ok"}
+  outcome_token = _outcome.set(outcome)
+  IN_FLIGHT.inc(endpoint=endpoint)
+  try:
+    yield
+  except BaseException:
+    outcome["status"] = "error"
+    raise
+  finally:
+    IN_FLIGHT.dec(endpoint=endpoint)
+    REQUESTS.inc(endpoint=endpoint, status=outcome["status"])
+    _outcome.reset(outcome_token)
+    current_endpoint.reset(endpoint_token)
+
+
+def set_outcome(status: str) -> None:
+  """
+  Set the outcome label recorded for the current request.
+  """
+  outcome = _outcome.get()
+  if outcome is not None:
+    outcome["status"] = status
+
+
+def instrument(endpoint: str):
+  """
+  Decorator wrapping an agent message handler in track_request().
+  """
+  def decorator(handler):
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+      with track_request(endpoint):
+        return await handler(*args, **kwargs)
+    return wrapper
+  return decorator
+
+
+def mark_handler_start() -> None:
+  """
+  Record the time between receiving the request and entering its handler,
+  which covers body parsing and validation, as the "validation" stage.
+  """
+  started = request_started.get()
+  if started is not None:
+    observe_stage("validation", time.perf_counter() - started)
+
+
+def _collect_components() -> None:
+  from admission import get_admission_controller
+  from cache import get_response_cache
+  from capture import get_capture_log
+  from hedging import get_hedger
+  from ratelimit import get_rate_limiter
+  from resilience import get_retry_policy
+  from semantic_cache import get_semantic_cache
+  from sessions import get_session_store
+
+  semantic_cache = get_semantic_cache()
+  rate_limiter = get_rate_limiter()
+  hedger = get_hedger()
+  capture_log = get_capture_log()
+  for component, stats in (("cache", get_response_cache().stats()),
+                           ("semantic_cache", semantic_cache.stats() if semantic_cache is not None else {}),
+                           ("rate_limit", rate_limiter.stats() if rate_limiter is not None else {}),
+                           ("hedging", hedger.stats() if hedger is not None else {}),
+                           ("capture", capture_log.stats() if capture_log is not None else {}),
+                           ("admission", get_admission_controller().stats()),
+                           ("sessions", get_session_store().stats())):
+    for name, value in stats.items():
+      COMPONENT.set(value, component=component, stat=name)
+  policy = get_retry_policy()
+  COMPONENT.set(policy.retries, component="retry", stat="retries")
+  if policy.breaker is not None:
+    breaker = policy.breaker.stats()
+    COMPONENT.set(1 if breaker["state"] != "closed" else 0, component="circuit_breaker", stat="open")
+    COMPONENT.set(breaker["rejected"], component="circuit_breaker", stat="rejected")
+
+
+REGISTRY.add_collector(_collect_components)
+
+
+# Seconds between heartbeats of a watched event loop
+HEARTBEAT_INTERVAL = 2.0
+
+# Seconds without a heartbeat after which /healthz reports the loop as stuck
+HEARTBEAT_STALE_AFTER = 15.0
+
+
+class Heartbeat:
+  """
+  Time of the last run of a periodic task on an event loop, so that a health
+  check served from another thread can tell a hung loop from a live process.
+
+  Args:
+      interval (float): Seconds between beats.
+      stale_after (float): Seconds without a beat after which the loop is unhealthy.
+  """
+
+  def __init__(self, interval: float = HEARTBEAT_INTERVAL, stale_after: float = HEARTBEAT_STALE_AFTER):
+    self.interval = interval
+    self.stale_after = stale_after
+    self.last_beat: Optional[float] = None
+
+  def beat(self) -> None:
+    self.last_beat = time.monotonic()
+
+  def age(self) -> Optional[float]:
+    """
+    Return the seconds since the last beat, or None before the first one.
+    """
+    return None if self.last_beat is None else time.monotonic() - self.last_beat
+
+  def healthy(self) -> bool:
+    age = self.age()
+    return age is not None and age <= self.stale_after
+
+  def watch(self, agent) -> None:
+    """
+    Beat from an interval handler of a uAgents agent. Agents in one Bureau
+    share its event loop, so watching one of them covers them all.
+    """
+    async def heartbeat(ctx):
+      self.beat()
+
+    agent.on_interval(period=self.interval)(heartbeat)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+  def do_GET(self):
+    path = self.path.split("?")[0]
+    status = 200
+    if path == "/metrics":
+      body = REGISTRY.render().encode("utf-8")
+      content_type = "text/plain; version=0.0.4"
+    elif path == "/healthz":
+      heartbeat = self.server.heartbeat
+      if heartbeat is None or heartbeat.healthy():
+        body = b"ok\n"
+      else:
+        # The process answers, but its event loop has stopped running tasks
+        age = heartbeat.age()
+        status = 503
+        body = (b"starting\n" if age is None else f"stale: last heartbeat {age:.1f}s ago\n".encode("utf-8"))
+      content_type = "text/plain"
+    else:
+      self.send_error(404)
+      return
+    self.send_response(status)
+    self.send_header("Content-Type", content_type)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+
+def start_http_exporter(port: int, host: str = "0.0.0.0",
+                        heartbeat: Optional[Heartbeat] = None) -> ThreadingHTTPServer:
+  """
+  Serve /metrics, and /healthz for health checks, from a background thread,
+  for processes without an HTTP server of their own such as the Bureau.
+
+  Args:
+      port (int): Port to listen on.
+      host (str, optional): Address to listen on.
+      heartbeat (Heartbeat, optional): Heartbeat of the process's event loop.
+          /healthz answers 503 while it is stale; without one it only shows
+          that the process is alive.
+  """
+  server = ThreadingHTTPServer((host, port), _MetricsHandler)
+  server.heartbeat = heartbeat
+  threading.Thread(target=server.serve_forever, name="metrics-exporter", daemon=True).start()
+  return server
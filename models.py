@@ -0,0 +1,41 @@
+from typing import Dict, Literal, Tuple, Type
+
+from pydantic import BaseModel
+
+from prompts import CAREER_GUIDANCE_PROMPT, NOTES_PROMPT, QUESTIONS_PROMPT, PromptTemplate
+
+"""
+StudyMate Request Models
+
+Request bodies of the HTTP API and the prompt template each is rendered with.
+Kept apart from the agent modules so that the server, the warm-up and the
+benchmarks can use them without importing uagents or building agents.
+"""
+
+
+class NotesRequest(BaseModel):
+  topic: str
+  notes_style: Literal['Short', 'Detailed', 'Last-minute revision']
+  reference_material: str
+  additional_requirements: str
+
+
+class QuestionsRequest(BaseModel):
+  topic: str
+  with_answers: Literal['Yes', 'No']
+  additional_requirements: str
+
+
+class CareerGuidanceRequest(BaseModel):
+  education_level: str
+  degree_or_class: str
+  field_of_interest: str
+  future_goal: str
+
+
+# Request model and prompt template for each request type, as named in /batch and /jobs
+REQUEST_TYPES: Dict[str, Tuple[Type[BaseModel], PromptTemplate]] = {
+    "notes": (NotesRequest, NOTES_PROMPT),
+    "questions": (QuestionsRequest, QUESTIONS_PROMPT),
+    "career-guidance": (CareerGuidanceRequest, CAREER_GUIDANCE_PROMPT),
+}
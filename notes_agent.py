@@ -1,8 +1,16 @@
 from uagents import Agent, Context, Protocol, Model
 from ai_engine import UAgentResponse, UAgentResponseType
 from pydantic import Field
-from typing import Literal
-from utils import get_llm_response
+from typing import Literal, Optional
+from prompts import NOTES_PROMPT
+from admission import PRIORITIES
+from metrics import RESPONSE_BYTES, instrument, stage
+from capture import capture_messages
+from ratelimit import reject_if_limited
+from sessions import answer_follow_up, record_turn
+from replies import reply_failure
+from documents import get_document_notes_completion, is_document
+from utils import get_llm_completion
 
 # print("[StudyMate Notes Agent] running.")
 
@@ -72,31 +80,62 @@ notes_agent_protocol = Protocol("NotesAgentProtocol")
 
 
 @notes_agent_protocol.on_message(model=NotesAgentModel, replies={UAgentResponse})
+@instrument("notes_agent")
+@capture_messages("notes_agent", "notes")
 async def get_action(ctx: Context, sender: str, msg: NotesAgentModel):
+  if await reject_if_limited(ctx, sender):
+    return
+
   ctx.logger.info(f"📩 Incoming message from {sender}:")
   ctx.logger.info(f"👉 Data: {msg.json(indent=2)}")
 
-  formatted_prompt = (
-      "You are acting as a tool that helps students prepare notes for various subjects and topics. "
-      "The user supplies specific details such as the topic they need notes on, the preferred style "
-      "of the notes (short, detailed, or last-minute revision), any reference material, and additional "
-      "requirements or focus areas for the notes. Based on this information, you generate concise and "
-      "tailored notes to assist students in studying effectively and efficiently.\n\n"
-      "Given the provided data for the Notes Agent, your task is to prepare notes on the following:\n\n"
-      f"- Topic: {msg.topic}\n"
-      f"- Notes Style: {msg.notes_style}\n"
-      f"- Reference Material: {msg.reference_material}\n"
-      f"- Additional Requirements: {msg.additional_requirements}\n\n"
-      "Note: If any information is missing (marked as 'NA'), please use intelligent reasoning to generate the notes accordingly."
-  )
-  ctx.logger.info(f'{formatted_prompt=}')
-
   #   message = (
   #       "This is a test message. Once the language model (LLM) is integrated, this will be replaced "
   #       "with the final notes."
   #   )
-  message = await get_llm_response(formatted_prompt)
-  await ctx.send(sender, UAgentResponse(message=message, type=UAgentResponseType.FINAL))
+  try:
+    if is_document(msg.reference_material):
+      # Whole chapters are summarized chunk by chunk, then combined, and are too long to log as a prompt
+      completion = await get_document_notes_completion(msg, priority=PRIORITIES[NOTES_PROMPT.name])
+    else:
+      formatted_prompt = NOTES_PROMPT.render(msg)
+      ctx.logger.info(f'{formatted_prompt=}')
+      completion = await get_llm_completion(formatted_prompt, cache_key=NOTES_PROMPT.cache_key(msg),
+                                            priority=PRIORITIES[NOTES_PROMPT.name], profile=NOTES_PROMPT.profile(msg),
+                                            similarity_key=NOTES_PROMPT.similarity_key(msg),
+                                            parser=NOTES_PROMPT.parser)
+  except Exception as e:
+    await reply_failure(ctx, sender, e)
+    return
+  # Later follow-ups from the sender build on this response
+  record_turn(NOTES_PROMPT, sender, msg, completion)
+  message = completion.text
+  ctx.logger.info(f"🔢 Token usage: {completion.usage.dict()}")
+  RESPONSE_BYTES.observe(len(message.encode("utf-8")), endpoint="notes_agent")
+  with stage("response_send"):
+    await ctx.send(sender, UAgentResponse(message=message, type=UAgentResponseType.FINAL))
+
+
+class NotesFollowUpModel(Model):
+  follow_up: str = Field(
+      ...,
+      title="Follow-up",
+      description=(
+          "Please specify what the student wants next, building on the notes they received last, "
+          "e.g. more of it, more detail on a part or a change. This value must be asked from user."
+      ),
+      example="Explain the Calvin cycle in more detail"
+  )
+
+
+notes_follow_up_protocol = Protocol("NotesFollowUpProtocol")
+
+
+@notes_follow_up_protocol.on_message(model=NotesFollowUpModel, replies={UAgentResponse})
+@instrument("notes_agent_follow_up")
+@capture_messages("notes_agent_follow_up", "notes")
+async def get_follow_up(ctx: Context, sender: str, msg: NotesFollowUpModel):
+  await answer_follow_up(ctx, sender, NOTES_PROMPT, msg.follow_up, endpoint="notes_agent_follow_up")
 
 
 AGENT_NAME = 'notes_agent'
@@ -105,20 +144,52 @@ AGENT_SEED = AGENT_NAME
 AGENT_ENDPOINT = [f'http://localhost:{AGENT_PORT}/submit']
 AGENT_MAILBOX_KEY = ""
 
-notes_agent = Agent(name=AGENT_NAME,
-                    seed=AGENT_SEED,
-                    # port=AGENT_PORT,
-                    # endpoint=AGENT_ENDPOINT,
-                    # mailbox=f"{AGENT_MAILBOX_KEY}@https://agentverse.ai"
-                    )
-notes_agent.include(notes_agent_protocol, publish_manifest=True)
 
-
-@notes_agent.on_event("startup")
 async def startup(ctx: Context):
   ctx.logger.info(f"🤖 Agent Address: {ctx.address}")
 
-NOTES_AGENT_ADDRESS = notes_agent.address
+
+def create_agent(name: str = AGENT_NAME, seed: str = AGENT_SEED, port: Optional[int] = None) -> Agent:
+  """
+  Build a Notes Agent. Without a port it is meant to run inside a Bureau; with a
+  port it serves its own endpoint, as the replicas started by launcher.py do.
+  """
+  agent = Agent(name=name,
+                seed=seed,
+                port=port,
+                endpoint=[f'http://localhost:{port}/submit'] if port else None,
+                # mailbox=f"{AGENT_MAILBOX_KEY}@https://agentverse.ai"
+                )
+  agent.include(notes_agent_protocol, publish_manifest=True)
+  agent.include(notes_follow_up_protocol, publish_manifest=True)
+  agent.on_event("startup")(startup)
+  return agent
+
+
+_default_agent = None
+
+
+def get_agent() -> Agent:
+  """
+  Return the Notes Agent run by main.py, building it on first use.
+  """
+  global _default_agent
+  if _default_agent is None:
+    _default_agent = create_agent()
+  return _default_agent
+
+
+def __getattr__(name: str):
+  # The agent and its address are built on first access, so importing this
+  # module for its model or handler does not construct an Agent or derive keys
+  if name == "notes_agent":
+    return get_agent()
+  if name == "NOTES_AGENT_ADDRESS":
+    return get_agent().address
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__ == "__main__":
-  notes_agent.run()
+  from dotenv import load_dotenv
+  load_dotenv()
+  get_agent().run()
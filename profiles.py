@@ -0,0 +1,78 @@
+from typing import Dict, Optional, Tuple
+
+from pydantic import BaseModel
+
+"""
+StudyMate Generation Profiles
+
+Generation settings (output token budget, temperature and stop sequences) per
+request type, and per notes style for notes. Capping the output of 'Short' and
+'Last-minute revision' notes keeps their latency and cost below that of
+'Detailed' notes instead of leaving the length to the model.
+"""
+
+
+class GenerationProfile:
+  """
+  Settings passed to the LLM for one kind of request.
+
+  Args:
+      name (str): Profile name, used as a metrics label.
+      max_output_tokens (int): Upper bound on the response length in tokens.
+      temperature (float): Sampling temperature.
+      stop (tuple, optional): Sequences that end the response early.
+  """
+
+  def __init__(self, name: str, max_output_tokens: int, temperature: float, stop: Tuple[str, ...] = ()):
+    self.name = name
+    self.max_output_tokens = max_output_tokens
+    self.temperature = temperature
+    self.stop = tuple(stop)
+
+  @property
+  def key(self) -> str:
+    """
+    Identifies the settings, so that responses generated with different
+    settings are cached and coalesced separately.
+    """
+    return f"{self.name}:{self.max_output_tokens}:{self.temperature}:{'|'.join(self.stop)}"
+
+  def __repr__(self) -> str:
+    return f"GenerationProfile({self.key!r})"
+
+
+# Profile per notes style, keyed by the normalized style (see _style_key)
+NOTES_STYLE_PROFILES: Dict[str, GenerationProfile] = {
+    "short": GenerationProfile("notes_short", max_output_tokens=512, temperature=0.3),
+    "detailed": GenerationProfile("notes_detailed", max_output_tokens=2048, temperature=0.4),
+    "last minute revision": GenerationProfile("notes_revision", max_output_tokens=768, temperature=0.2),
+}
+
+# Profile per prompt template name, used when no finer-grained profile applies
+PROFILES: Dict[str, GenerationProfile] = {
+    "notes": NOTES_STYLE_PROFILES["detailed"],
+    "questions": GenerationProfile("questions", max_output_tokens=1536, temperature=0.5),
+    "answers": GenerationProfile("answers", max_output_tokens=1024, temperature=0.2),
+    "document_chunk": GenerationProfile("document_chunk", max_output_tokens=768, temperature=0.3),
+    "follow_up": GenerationProfile("follow_up", max_output_tokens=1024, temperature=0.5),
+    "career_guidance": GenerationProfile("career_guidance", max_output_tokens=1024, temperature=0.7),
+}
+
+# Used for prompts that do not come from a known template
+DEFAULT_PROFILE = GenerationProfile("default", max_output_tokens=2048, temperature=0.5)
+
+
+def _style_key(style: str) -> str:
+  # The server spells it 'Last-minute revision' and the agent 'Last Minute Revision'
+  return " ".join(style.replace("-", " ").split()).casefold()
+
+
+def get_profile(template_name: str, request: Optional[BaseModel] = None) -> GenerationProfile:
+  """
+  Return the generation profile for a request rendered with a template.
+  """
+  if template_name == "notes" and request is not None:
+    profile = NOTES_STYLE_PROFILES.get(_style_key(getattr(request, "notes_style", "")))
+    if profile is not None:
+      return profile
+  return PROFILES.get(template_name, DEFAULT_PROFILE)
@@ -0,0 +1,247 @@
+import hashlib
+import json
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from pydantic import BaseModel
+
+from cache import _normalize, cache_key
+from metrics import observe_stage
+from profiles import GenerationProfile, get_profile
+from structure import parse_answers, parse_questions, parse_sections
+
+"""
+StudyMate Prompt Templates
+
+Single source of the prompts sent to the LLM by the FastAPI server and the
+agents. Each template is compiled once at import into a format string and is
+rendered straight from a request model. Its `id` (name and version) and `hash`
+(digest of the compiled text) identify the exact prompt for cache and metrics
+keys, so changing a template's wording invalidates the responses cached for it.
+"""
+
+
+class PromptTemplate:
+  """
+  A versioned prompt template rendered from the fields of a request model.
+
+  Args:
+      name (str): Template name, e.g. "notes".
+      version (int): Template version. Bump it when the wording changes.
+      intro (str): Role description given to the LLM.
+      task (str): Task statement introducing the request fields.
+      fields (tuple): (label, attribute) pairs listed in the prompt.
+      note (str): Closing instruction.
+      similarity_fields (tuple, optional): Attributes compared by similarity in
+          the semantic cache, i.e. the subject of the request. The other fields,
+          such as the additional requirements, must match after normalization.
+      parser (Callable, optional): Parses a response into its structured form
+          (see structure.py).
+  """
+
+  def __init__(self, name: str, version: int, intro: str, task: str,
+               fields: Tuple[Tuple[str, str], ...], note: str, similarity_fields: Tuple[str, ...] = (),
+               parser: Optional[Callable[[str], dict]] = None):
+    self.name = name
+    self.version = version
+    self.id = f"{name}@v{version}"
+    self.fields = tuple(attribute for _, attribute in fields)
+    self.similarity_fields = tuple(similarity_fields)
+    self.parser = parser
+
+    # Static text is escaped so that only the field placeholders are substituted
+    def escape(text):
+      return text.replace("{", "{{").replace("}", "}}")
+
+    lines = "".join(f"- {escape(label)}: {{{attribute}}}\n" for label, attribute in fields)
+    self._format = f"{escape(intro)}\n\n{escape(task)}\n\n{lines}\n{escape(note)}"
+    self.hash = hashlib.sha256(self._format.encode("utf-8")).hexdigest()[:12]
+
+  def render(self, request: BaseModel) -> str:
+    """
+    Render the prompt for a request model.
+    """
+    started = time.perf_counter()
+    prompt = self._format.format(**{attribute: getattr(request, attribute) for attribute in self.fields})
+    observe_stage("prompt_render", time.perf_counter() - started)
+    return prompt
+
+  def cache_key(self, request: BaseModel) -> str:
+    """
+    Cache key for a request rendered with this template. Requests with the same
+    fields share a key whether they came from the server or an agent.
+    """
+    return cache_key(request, namespace=f"{self.id}:{self.hash}")
+
+  def similarity_key(self, request: BaseModel) -> Tuple[str, Dict[str, str]]:
+    """
+    Partition and free-text fields under which the semantic cache compares a
+    request with earlier ones (see semantic_cache.SemanticCache).
+    """
+    exact = {attribute: _normalize(getattr(request, attribute))
+             for attribute in self.fields if attribute not in self.similarity_fields}
+    partition = json.dumps([self.id, self.hash, exact], sort_keys=True, separators=(",", ":"))
+    return partition, {attribute: getattr(request, attribute) for attribute in self.similarity_fields}
+
+  def profile(self, request: BaseModel) -> GenerationProfile:
+    """
+    Generation profile (output budget, temperature, stop sequences) for a request.
+    """
+    return get_profile(self.name, request)
+
+
+NOTES_PROMPT = PromptTemplate(
+    name="notes",
+    version=1,
+    intro=(
+        "You are acting as a tool that helps students prepare notes for various subjects and topics. "
+        "The user supplies specific details such as the topic they need notes on, the preferred style "
+        "of the notes (short, detailed, or last-minute revision), any reference material, and additional "
+        "requirements or focus areas for the notes. Based on this information, you generate concise and "
+        "tailored notes to assist students in studying effectively and efficiently."
+    ),
+    task="Given the provided data for the Notes Agent, your task is to prepare notes on the following:",
+    fields=(
+        ("Topic", "topic"),
+        ("Notes Style", "notes_style"),
+        ("Reference Material", "reference_material"),
+        ("Additional Requirements", "additional_requirements"),
+    ),
+    note="Note: If any information is missing (marked as 'NA'), please use intelligent reasoning to generate the notes accordingly.",
+    similarity_fields=("topic",),
+    parser=parse_sections,
+)
+
+QUESTIONS_PROMPT = PromptTemplate(
+    name="questions",
+    version=1,
+    intro=(
+        "You are acting as a tool that helps students prepare practice questions and answers for various subjects and topics. "
+        "The user specifies the topic for which they need practice questions, whether they require questions with or without answers, "
+        "and any additional requirements or preferences they may have. Based on this information, you generate appropriate practice "
+        "questions tailored to the student's needs to help them prepare effectively for exams and assessments."
+    ),
+    task="Given the provided data for the Questions Agent, your task is to prepare practice questions on the following:",
+    fields=(
+        ("Topic", "topic"),
+        ("With Answers", "with_answers"),
+        ("Additional Requirements", "additional_requirements"),
+    ),
+    note="Note: If any information is missing (marked as 'NA'), please use intelligent reasoning to generate the practice questions accordingly.",
+    similarity_fields=("topic",),
+    parser=parse_questions,
+)
+
+# Map and reduce steps for notes on long reference material (see documents.py)
+DOCUMENT_CHUNK_PROMPT = PromptTemplate(
+    name="document_chunk",
+    version=1,
+    intro=(
+        "You are acting as a tool that helps students prepare notes from their study material. "
+        "The user supplies one excerpt of a longer document, such as a textbook chapter, together with the "
+        "topic they are studying and any focus areas. You write thorough notes covering every fact, definition, "
+        "formula and example in the excerpt, so that notes in any style can later be written from yours alone."
+    ),
+    task="Given the provided data, your task is to prepare notes on the following excerpt:",
+    fields=(
+        ("Topic", "topic"),
+        ("Additional Requirements", "additional_requirements"),
+        ("Excerpt", "excerpt"),
+    ),
+    note="Note: Only use the excerpt. If any information is missing (marked as 'NA'), please use intelligent reasoning to prepare the notes accordingly.",
+    parser=parse_sections,
+)
+
+DOCUMENT_REDUCE_PROMPT = PromptTemplate(
+    name="document_reduce",
+    version=1,
+    intro=(
+        "You are acting as a tool that helps students prepare notes for various subjects and topics. "
+        "The user supplies notes written for consecutive parts of a longer document, the topic, the preferred "
+        "style of the notes (short, detailed, or last-minute revision) and additional requirements. You combine "
+        "them into a single set of notes in the requested style, in the order of the document, without repetition."
+    ),
+    task="Given the provided data for the Notes Agent, your task is to combine the following notes:",
+    fields=(
+        ("Topic", "topic"),
+        ("Notes Style", "notes_style"),
+        ("Additional Requirements", "additional_requirements"),
+        ("Notes on Each Part", "partial_notes"),
+    ),
+    note="Note: If any information is missing (marked as 'NA'), please use intelligent reasoning to generate the notes accordingly.",
+    parser=parse_sections,
+)
+
+# Continues an agent conversation from its session (see sessions.py)
+FOLLOW_UP_PROMPT = PromptTemplate(
+    name="follow_up",
+    version=1,
+    intro=(
+        "You are acting as a study assistant continuing a conversation with a student. The student made a request, "
+        "received a response, and now asks a follow-up, such as more questions, more detail on one part, or a "
+        "different format. You are given the original request, a summary of the earlier responses and the latest "
+        "response, and you reply to the follow-up."
+    ),
+    task="Given the provided data, your task is to reply to the follow-up below:",
+    fields=(
+        ("Service", "service"),
+        ("Original Request", "request"),
+        ("Earlier Responses (Summary)", "history"),
+        ("Latest Response", "latest"),
+        ("Follow-up", "follow_up"),
+    ),
+    note=(
+        "Note: Only write what is new or changed. Do not repeat content from the earlier responses, and continue "
+        "any numbering where the latest response left off."
+    ),
+)
+
+# Answers a question set generated without answers (see question_sets.py)
+ANSWERS_PROMPT = PromptTemplate(
+    name="answers",
+    version=1,
+    intro=(
+        "You are acting as a tool that helps students prepare for exams with practice questions. "
+        "The user supplies a numbered list of practice questions on a topic, and you write a correct, "
+        "concise answer to each of them."
+    ),
+    task=(
+        "Given the provided data, answer every one of the following questions. Reply with one answer per "
+        "question, in order, each starting with 'Answer <number>:', and do not repeat the questions:"
+    ),
+    fields=(
+        ("Topic", "topic"),
+        ("Additional Requirements", "additional_requirements"),
+        ("Questions", "questions"),
+    ),
+    note="Note: If any information is missing (marked as 'NA'), please use intelligent reasoning to answer the questions accordingly.",
+    parser=parse_answers,
+)
+
+CAREER_GUIDANCE_PROMPT = PromptTemplate(
+    name="career_guidance",
+    version=1,
+    intro=(
+        "You are acting as a career guidance tool that helps students navigate their education and career paths. "
+        "The user supplies specific details such as their current education level, degree or class, field of interest, "
+        "and future goals. Based on this information, you provide personalized career guidance and advice to assist them "
+        "in making informed decisions about their academic and professional future."
+    ),
+    task="Given the provided data for the Career Guidance Agent, your task is to provide guidance on the following:",
+    fields=(
+        ("Education Level", "education_level"),
+        ("Degree or Class", "degree_or_class"),
+        ("Field of Interest", "field_of_interest"),
+        ("Future Goal", "future_goal"),
+    ),
+    note="Note: If any information is missing (marked as 'NA'), please use intelligent reasoning to provide the guidance accordingly.",
+    similarity_fields=("field_of_interest",),
+    parser=parse_sections,
+)
+
+# Registry of every template by its stable ID
+PROMPTS: Dict[str, PromptTemplate] = {
+    template.id: template
+    for template in (NOTES_PROMPT, QUESTIONS_PROMPT, ANSWERS_PROMPT, CAREER_GUIDANCE_PROMPT,
+                     DOCUMENT_CHUNK_PROMPT, DOCUMENT_REDUCE_PROMPT, FOLLOW_UP_PROMPT)
+}
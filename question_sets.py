@@ -0,0 +1,137 @@
+from typing import Optional
+
+from pydantic import BaseModel
+
+from admission import PRIORITIES
+from backends import Completion, Usage
+from metrics import DERIVED
+from prompts import ANSWERS_PROMPT, QUESTIONS_PROMPT
+from structure import format_questions
+from utils import get_cached_completion, get_llm_completion, profile_cache_key, store_completion
+
+"""
+StudyMate Question Sets
+
+Practice question requests that differ only in `with_answers` ask for the same
+questions, so each variant is derived from the other when it is cached:
+
+  - "No" is served from a cached "Yes" set by dropping its answers, without
+    calling the LLM.
+  - "Yes" is served from a cached "No" set by asking the LLM for the answers
+    only, which is a much shorter generation than the full set.
+
+Derivation works on the parsed question list (see structure.parse_questions).
+It only applies when every question parsed cleanly, e.g. not when answers
+were written in a separate section; otherwise the request is generated as usual.
+The derived set is cached under its own request like any other response.
+"""
+
+
+class AnswersRequest(BaseModel):
+  topic: str
+  additional_requirements: str
+  questions: str
+
+
+def variant(request: BaseModel, with_answers: str) -> BaseModel:
+  """
+  Return the same questions request with `with_answers` set to "Yes" or "No".
+  """
+  # Agent models may be built on the Pydantic 1 API, which has no model_copy
+  copy = getattr(request, "model_copy", None) or request.copy
+  return copy(update={"with_answers": with_answers})
+
+
+async def _cached(request: BaseModel) -> Optional[Completion]:
+  return await get_cached_completion(QUESTIONS_PROMPT.cache_key(request), QUESTIONS_PROMPT.profile(request),
+                                     QUESTIONS_PROMPT.similarity_key(request), QUESTIONS_PROMPT.parser)
+
+
+def _usable(completion: Optional[Completion], answered: bool) -> bool:
+  """
+  Whether a cached set parsed into distinctly numbered questions, all with
+  answers if `answered`.
+  """
+  if completion is None or not completion.structured or completion.usage.truncated:
+    return False
+  questions = completion.structured["questions"]
+  numbers = [question["number"] for question in questions]
+  if not questions or len(set(numbers)) != len(numbers):
+    return False
+  return not answered or all(question["answer"] for question in questions)
+
+
+def strip_answers(completion: Completion) -> Completion:
+  """
+  Return a question set without its answers. Usage is that of the original set.
+  """
+  structured = {"questions": [{**question, "answer": None} for question in completion.structured["questions"]]}
+  usage = completion.usage
+  return Completion(format_questions(structured, with_answers=False),
+                    Usage(usage.prompt_tokens, usage.output_tokens, usage.finish_reason, cached=True), structured)
+
+
+async def derive_cached(request: BaseModel) -> Optional[Completion]:
+  """
+  Return a "No" request's question set derived from the cached "Yes" set, or
+  None if there is none. Never calls the LLM.
+  """
+  if request.with_answers != "No":
+    return None
+  answered = await _cached(variant(request, "Yes"))
+  if not _usable(answered, answered=True):
+    return None
+  return strip_answers(answered)
+
+
+async def add_answers(request: BaseModel, unanswered: Completion, priority: int) -> Optional[Completion]:
+  """
+  Generate the answers to a cached "No" set and return the set with them, or
+  None if the LLM did not answer every question. Usage is that of the answers.
+  """
+  questions = unanswered.structured["questions"]
+  answers_request = AnswersRequest(topic=request.topic, additional_requirements=request.additional_requirements,
+                                   questions=format_questions(unanswered.structured, with_answers=False))
+  completion = await get_llm_completion(ANSWERS_PROMPT.render(answers_request), priority=priority,
+                                        profile=ANSWERS_PROMPT.profile(answers_request), parser=ANSWERS_PROMPT.parser)
+  answers = {answer["number"]: answer["answer"] for answer in completion.structured["answers"]}
+  if completion.usage.truncated or any(question["number"] not in answers for question in questions):
+    return None
+  structured = {"questions": [{**question, "answer": answers[question["number"]]} for question in questions]}
+  return Completion(format_questions(structured), completion.usage, structured)
+
+
+async def get_questions_completion(request: BaseModel, priority: int = PRIORITIES[QUESTIONS_PROMPT.name]) -> Completion:
+  """
+  Return the practice questions for a request: from the cache, derived from
+  the cached set with or without answers, or generated.
+
+  Args:
+      request (BaseModel): A questions request (QuestionsRequest or QuestionsAgentModel).
+      priority (int, optional): Admission priority class for LLM calls.
+
+  Raises:
+      AdmissionRejected: As get_llm_completion.
+  """
+  template = QUESTIONS_PROMPT
+  profile = template.profile(request)
+  similarity_key = template.similarity_key(request)
+  cached = await get_cached_completion(template.cache_key(request), profile, similarity_key, template.parser)
+  if cached is not None:
+    return cached
+
+  completion = await derive_cached(request)
+  kind = "stripped"
+  if completion is None and request.with_answers == "Yes":
+    unanswered = await _cached(variant(request, "No"))
+    if _usable(unanswered, answered=False):
+      completion = await add_answers(request, unanswered, priority)
+      kind = "answered"
+  if completion is not None:
+    DERIVED.inc(kind=kind)
+  else:
+    completion = await get_llm_completion(template.render(request), priority=priority, profile=profile,
+                                          parser=template.parser)
+
+  store_completion(profile_cache_key(template.cache_key(request), profile), similarity_key, profile, completion)
+  return completion
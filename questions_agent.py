@@ -1,8 +1,15 @@
 from uagents import Agent, Context, Protocol, Model
 from ai_engine import UAgentResponse, UAgentResponseType
 from pydantic import Field
-from typing import Literal
-from utils import get_llm_response
+from typing import Literal, Optional
+from prompts import QUESTIONS_PROMPT
+from admission import PRIORITIES
+from metrics import RESPONSE_BYTES, instrument, stage
+from capture import capture_messages
+from ratelimit import reject_if_limited
+from sessions import answer_follow_up, record_turn
+from replies import reply_failure
+from question_sets import get_questions_completion
 
 # print("[StudyMate Questions Agent] running.")
 
@@ -63,29 +70,57 @@ questions_agent_protocol = Protocol("QuestionsAgentProtocol")
 
 
 @questions_agent_protocol.on_message(model=QuestionsAgentModel, replies={UAgentResponse})
+@instrument("questions_agent")
+@capture_messages("questions_agent", "questions")
 async def get_action(ctx: Context, sender: str, msg: QuestionsAgentModel):
+  if await reject_if_limited(ctx, sender):
+    return
+
   ctx.logger.info(f"📩 Incoming message from {sender}:")
   ctx.logger.info(f"👉 Data: {msg.json(indent=2)}")
 
-  formatted_prompt = (
-      "You are acting as a tool that helps students prepare practice questions and answers for various subjects and topics. "
-      "The user specifies the topic for which they need practice questions, whether they require questions with or without answers, "
-      "and any additional requirements or preferences they may have. Based on this information, you generate appropriate practice "
-      "questions tailored to the student's needs to help them prepare effectively for exams and assessments.\n\n"
-      "Given the provided data for the Questions Agent, your task is to prepare practice questions on the following:\n\n"
-      f"- Topic: {msg.topic}\n"
-      f"- With Answers: {msg.with_answers}\n"
-      f"- Additional Requirements: {msg.additional_requirements}\n\n"
-      "Note: If any information is missing (marked as 'NA'), please use intelligent reasoning to generate the practice questions accordingly."
-  )
+  formatted_prompt = QUESTIONS_PROMPT.render(msg)
   ctx.logger.info(f'{formatted_prompt=}')
 
   message = (
       "This is a test message. Once the language model (LLM) is integrated, this will be replaced "
       "with the practice questions."
   )
-  message = await get_llm_response(formatted_prompt)
-  await ctx.send(sender, UAgentResponse(message=message, type=UAgentResponseType.FINAL))
+  try:
+    # Served from the cached set with or without answers when there is one
+    completion = await get_questions_completion(msg, priority=PRIORITIES[QUESTIONS_PROMPT.name])
+  except Exception as e:
+    await reply_failure(ctx, sender, e)
+    return
+  # Later follow-ups from the sender build on this response
+  record_turn(QUESTIONS_PROMPT, sender, msg, completion)
+  message = completion.text
+  ctx.logger.info(f"🔢 Token usage: {completion.usage.dict()}")
+  RESPONSE_BYTES.observe(len(message.encode("utf-8")), endpoint="questions_agent")
+  with stage("response_send"):
+    await ctx.send(sender, UAgentResponse(message=message, type=UAgentResponseType.FINAL))
+
+
+class QuestionsFollowUpModel(Model):
+  follow_up: str = Field(
+      ...,
+      title="Follow-up",
+      description=(
+          "Please specify what the student wants next, building on the practice questions they received last, "
+          "e.g. more of it, more detail on a part or a change. This value must be asked from user."
+      ),
+      example="Now give me 10 more questions"
+  )
+
+
+questions_follow_up_protocol = Protocol("QuestionsFollowUpProtocol")
+
+
+@questions_follow_up_protocol.on_message(model=QuestionsFollowUpModel, replies={UAgentResponse})
+@instrument("questions_agent_follow_up")
+@capture_messages("questions_agent_follow_up", "questions")
+async def get_follow_up(ctx: Context, sender: str, msg: QuestionsFollowUpModel):
+  await answer_follow_up(ctx, sender, QUESTIONS_PROMPT, msg.follow_up, endpoint="questions_agent_follow_up")
 
 
 AGENT_NAME = 'questions_agent'
@@ -94,20 +129,52 @@ AGENT_SEED = AGENT_NAME
 AGENT_ENDPOINT = [f'http://localhost:{AGENT_PORT}/submit']
 AGENT_MAILBOX_KEY = ""
 
-questions_agent = Agent(name=AGENT_NAME,
-                        seed=AGENT_SEED,
-                        # port=AGENT_PORT,
-                        # endpoint=AGENT_ENDPOINT,
-                        # mailbox=f"{AGENT_MAILBOX_KEY}@https://agentverse.ai"
-                        )
-questions_agent.include(questions_agent_protocol, publish_manifest=True)
 
-
-@questions_agent.on_event("startup")
 async def startup(ctx: Context):
   ctx.logger.info(f"🤖 Agent Address: {ctx.address}")
 
-QUESTIONS_AGENT_ADDRESS = questions_agent.address
+
+def create_agent(name: str = AGENT_NAME, seed: str = AGENT_SEED, port: Optional[int] = None) -> Agent:
+  """
+  Build a Questions Agent. Without a port it is meant to run inside a Bureau; with a
+  port it serves its own endpoint, as the replicas started by launcher.py do.
+  """
+  agent = Agent(name=name,
+                seed=seed,
+                port=port,
+                endpoint=[f'http://localhost:{port}/submit'] if port else None,
+                # mailbox=f"{AGENT_MAILBOX_KEY}@https://agentverse.ai"
+                )
+  agent.include(questions_agent_protocol, publish_manifest=True)
+  agent.include(questions_follow_up_protocol, publish_manifest=True)
+  agent.on_event("startup")(startup)
+  return agent
+
+
+_default_agent = None
+
+
+def get_agent() -> Agent:
+  """
+  Return the Questions Agent run by main.py, building it on first use.
+  """
+  global _default_agent
+  if _default_agent is None:
+    _default_agent = create_agent()
+  return _default_agent
+
+
+def __getattr__(name: str):
+  # The agent and its address are built on first access, so importing this
+  # module for its model or handler does not construct an Agent or derive keys
+  if name == "questions_agent":
+    return get_agent()
+  if name == "QUESTIONS_AGENT_ADDRESS":
+    return get_agent().address
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__ == "__main__":
-  questions_agent.run()
+  from dotenv import load_dotenv
+  load_dotenv()
+  get_agent().run()
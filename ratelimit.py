@@ -0,0 +1,326 @@
+import atexit
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Optional
+
+from metrics import set_outcome
+
+"""
+StudyMate Rate Limiting
+
+Per-client limits in front of the LLM, so one client cannot use up the
+upstream throughput shared by everyone. A client is an API key or IP address
+on the HTTP server and a sender address for the agents. Each client has:
+
+  - a token bucket refilled at `per_minute` requests per minute and holding at
+    most `burst`, which smooths out short bursts;
+  - a daily request quota, and a daily quota of LLM tokens (prompt and output
+    tokens of the responses generated for it, cached responses are free).
+
+Checks only touch the client's in-memory state, so a rejected request costs a
+dictionary lookup. With a SQLite path, daily usage is also written to disk, so
+quotas survive restarts. Usage is added up in memory and written by a
+background thread every FLUSH_INTERVAL seconds, so requests never wait for a
+commit. Processes using the same file add to the same daily totals, but each
+reads a client's totals only when it first sees the client that day.
+"""
+
+# Seconds between writes of usage to the SQLite file
+FLUSH_INTERVAL = 1.0
+
+# Client whose request is being handled, for charging LLM tokens to its quota
+current_client: ContextVar[Optional[str]] = ContextVar("current_client", default=None)
+
+
+class RateLimited(Exception):
+  """
+  Raised when a client is over its rate or quota. `retry_after` is a hint in seconds.
+  """
+
+  def __init__(self, reason: str, retry_after: int):
+    super().__init__(reason)
+    self.reason = reason
+    self.retry_after = retry_after
+
+
+class _ClientState:
+  __slots__ = ("tokens", "updated", "day", "requests", "llm_tokens")
+
+  def __init__(self, tokens: float, updated: float, day: str):
+    self.tokens = tokens
+    self.updated = updated
+    self.day = day
+    self.requests = 0
+    self.llm_tokens = 0
+
+
+def _today() -> str:
+  return time.strftime("%Y-%m-%d", time.gmtime())
+
+
+def _seconds_until_tomorrow() -> int:
+  now = time.time()
+  return max(1, math.ceil(86400 - now % 86400))
+
+
+class RateLimiter:
+  """
+  Token bucket rate limiter with daily quotas per client.
+
+  Args:
+      per_minute (float): Requests per minute a client's bucket is refilled
+          with. 0 disables the bucket.
+      burst (int): Requests a client may make at once after being idle.
+      daily_requests (int): Requests per client per UTC day. 0 for no limit.
+      daily_tokens (int): LLM tokens per client per UTC day. 0 for no limit.
+      path (str, optional): SQLite file recording daily usage.
+      max_clients (int): Clients kept in memory. The least recently seen are
+          dropped first; their daily usage is reloaded from disk if there is a path.
+  """
+
+  def __init__(self, per_minute: float = 0, burst: int = 10, daily_requests: int = 0,
+               daily_tokens: int = 0, path: Optional[str] = None, max_clients: int = 100000):
+    self.per_second = per_minute / 60
+    self.burst = burst
+    self.daily_requests = daily_requests
+    self.daily_tokens = daily_tokens
+    self.max_clients = max_clients
+    self.rejected = {"rate": 0, "daily_requests": 0, "daily_tokens": 0}
+    self._clients = OrderedDict()  # client -> _ClientState
+    self._lock = threading.Lock()
+    self._db = None
+    self._db_day = None  # day up to which old usage has been deleted
+    if path:
+      self._db = sqlite3.connect(path, check_same_thread=False)
+      self._db.execute(
+          "CREATE TABLE IF NOT EXISTS usage ("
+          "client TEXT NOT NULL, day TEXT NOT NULL, requests INTEGER NOT NULL, tokens INTEGER NOT NULL, "
+          "PRIMARY KEY (client, day))"
+      )
+      self._db.commit()
+      self._db_lock = threading.Lock()
+      self._pending = {}  # (client, day) -> [requests, tokens] not yet on disk
+      threading.Thread(target=self._run_writer, name="rate-limit-writer", daemon=True).start()
+      atexit.register(self.flush)
+
+  def acquire(self, client: str, cost: int = 1) -> None:
+    """
+    Take `cost` requests from a client's bucket and daily quota.
+
+    Raises:
+        RateLimited: If the client is over its rate or a daily quota. Nothing
+            is taken in that case.
+    """
+    now = time.monotonic()
+    with self._lock:
+      state = self._state(client, now)
+      if self.daily_requests and state.requests + cost > self.daily_requests:
+        self._reject("daily_requests", "Daily request quota exceeded", _seconds_until_tomorrow())
+      if self.daily_tokens and state.llm_tokens >= self.daily_tokens:
+        self._reject("daily_tokens", "Daily token quota exceeded", _seconds_until_tomorrow())
+      if self.per_second > 0:
+        state.tokens = min(self.burst, state.tokens + (now - state.updated) * self.per_second)
+        state.updated = now
+        # A batch larger than the bucket needs a full bucket rather than never fitting
+        needed = min(cost, self.burst)
+        if state.tokens < needed:
+          self._reject("rate", "Too many requests", math.ceil((needed - state.tokens) / self.per_second))
+        state.tokens -= needed
+      state.requests += cost
+      self._db_add(client, state.day, cost, 0)
+
+  def record_tokens(self, client: str, tokens: int) -> None:
+    """
+    Charge LLM tokens used for a client's request to its daily quota.
+    """
+    with self._lock:
+      state = self._state(client, time.monotonic())
+      state.llm_tokens += tokens
+      self._db_add(client, state.day, 0, tokens)
+
+  def usage(self, client: str) -> dict:
+    """
+    Return a client's usage and limits for the current day.
+    """
+    with self._lock:
+      state = self._state(client, time.monotonic())
+      return {
+          "day": state.day,
+          "requests": state.requests,
+          "tokens": state.llm_tokens,
+          "daily_requests": self.daily_requests or None,
+          "daily_tokens": self.daily_tokens or None,
+      }
+
+  def flush(self) -> None:
+    """
+    Write the usage added since the last flush to the SQLite file now.
+    """
+    if self._db is None:
+      return
+    with self._lock:
+      pending, self._pending = self._pending, {}
+      if not pending:
+        return
+      # Taken before the lock is released, so _db_get waits for these totals to be written
+      self._db_lock.acquire()
+    try:
+      self._db.executemany(
+          "INSERT INTO usage VALUES (?, ?, ?, ?) ON CONFLICT (client, day) DO UPDATE SET "
+          "requests = requests + excluded.requests, tokens = tokens + excluded.tokens",
+          [(client, day, requests, tokens) for (client, day), (requests, tokens) in pending.items()],
+      )
+      day = max(day for _, day in pending)
+      if day != self._db_day:
+        self._db.execute("DELETE FROM usage WHERE day < ?", (day,))
+        self._db_day = day
+      self._db.commit()
+    finally:
+      self._db_lock.release()
+
+  def stats(self) -> dict:
+    """
+    Return the number of clients tracked and rejections per reason.
+    """
+    with self._lock:
+      return {"clients": len(self._clients), **{f"rejected_{reason}": count for reason, count in self.rejected.items()}}
+
+  def _state(self, client: str, now: float) -> _ClientState:
+    today = _today()
+    state = self._clients.get(client)
+    if state is None or state.day != today:
+      tokens = state.tokens if state is not None else self.burst
+      updated = state.updated if state is not None else now
+      state = _ClientState(tokens, updated, today)
+      row = self._db_get(client, today)
+      if row is not None:
+        state.requests, state.llm_tokens = row
+      self._clients[client] = state
+      while len(self._clients) > self.max_clients:
+        self._clients.popitem(last=False)
+    self._clients.move_to_end(client)
+    return state
+
+  def _reject(self, reason: str, message: str, retry_after: int) -> None:
+    self.rejected[reason] += 1
+    raise RateLimited(message, retry_after)
+
+  def _db_get(self, client: str, day: str):
+    if self._db is None:
+      return None
+    with self._db_lock:
+      row = self._db.execute("SELECT requests, tokens FROM usage WHERE client = ? AND day = ?",
+                             (client, day)).fetchone()
+    # Usage of a client dropped from memory may not have been written yet
+    pending = self._pending.get((client, day))
+    if pending is not None:
+      row = (row[0] + pending[0], row[1] + pending[1]) if row is not None else tuple(pending)
+    return row
+
+  def _db_add(self, client: str, day: str, requests: int, tokens: int) -> None:
+    # Called with self._lock held; flush() writes the totals
+    if self._db is None:
+      return
+    pending = self._pending.setdefault((client, day), [0, 0])
+    pending[0] += requests
+    pending[1] += tokens
+
+  def _run_writer(self) -> None:
+    while True:
+      time.sleep(FLUSH_INTERVAL)
+      self.flush()
+
+
+_rate_limiter = None
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+  """
+  Return the process-wide rate limiter, configured from the environment on
+  first use, or None if no limit is set.
+  """
+  global _rate_limiter
+  if _rate_limiter is None:
+    per_minute = float(os.getenv("RATE_LIMIT_PER_MINUTE", "0"))
+    daily_requests = int(os.getenv("RATE_LIMIT_DAILY_REQUESTS", "0"))
+    daily_tokens = int(os.getenv("RATE_LIMIT_DAILY_TOKENS", "0"))
+    if not (per_minute or daily_requests or daily_tokens):
+      return None
+    _rate_limiter = RateLimiter(
+        per_minute=per_minute,
+        burst=int(os.getenv("RATE_LIMIT_BURST", "10")),
+        daily_requests=daily_requests,
+        daily_tokens=daily_tokens,
+        path=os.getenv("RATE_LIMIT_DB_PATH") or None,
+        max_clients=int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "100000")),
+    )
+  return _rate_limiter
+
+
+def limit_client(client: str, cost: int = 1) -> None:
+  """
+  Apply the rate limiter, if any, to a request from a client, and attribute
+  the LLM tokens used while handling it to that client.
+
+  Raises:
+      RateLimited: If the client is over its rate or a daily quota.
+  """
+  limiter = get_rate_limiter()
+  if limiter is not None:
+    limiter.acquire(client, cost)
+  current_client.set(client)
+
+
+def charge_client(cost: int) -> None:
+  """
+  Take `cost` more requests from the client of the current request, if known,
+  e.g. for each further LLM call a long document needs.
+
+  Raises:
+      RateLimited: If the client is over its rate or a daily quota.
+  """
+  client = current_client.get()
+  limiter = get_rate_limiter()
+  if client is not None and limiter is not None and cost > 0:
+    limiter.acquire(client, cost)
+
+
+def record_client_tokens(tokens: int) -> None:
+  """
+  Charge LLM tokens to the client of the current request, if known.
+  """
+  client = current_client.get()
+  limiter = get_rate_limiter()
+  if client is not None and limiter is not None and tokens:
+    limiter.record_tokens(client, tokens)
+
+
+async def reject_if_limited(ctx, sender: str) -> bool:
+  """
+  Apply the rate limiter to a message an agent received, replying to the
+  sender with an error UAgentResponse if it is over its rate or quota.
+
+  Args:
+      ctx (Context): Context of the agent's message handler.
+      sender (str): Address of the sender.
+
+  Returns:
+      bool: Whether the message was rejected, in which case the handler is done.
+  """
+  # Only the agents use this, so the server does not import ai_engine
+  from ai_engine import UAgentResponse, UAgentResponseType
+
+  try:
+    limit_client(sender)
+  except RateLimited as e:
+    ctx.logger.info(f"⛔ Rate limited {sender}: {e.reason}")
+    set_outcome("rate_limited")
+    message = f"{e.reason}. Please retry in {e.retry_after} seconds."
+    await ctx.send(sender, UAgentResponse(message=message, type=UAgentResponseType.ERROR))
+    return True
+  return False
@@ -0,0 +1,53 @@
+from admission import AdmissionRejected
+from documents import DocumentTooLarge
+from metrics import set_outcome
+from ratelimit import RateLimited
+
+"""
+StudyMate Agent Replies
+
+Error replies of the agents' message handlers, so that every agent words a
+busy service, an exhausted quota or a failed LLM call the same way. Only the
+agents use this, so ai_engine is imported when a reply is sent rather than by
+the server.
+"""
+
+
+async def reply_error(ctx, sender: str, message: str, outcome: str = "error") -> None:
+  """
+  Send an error UAgentResponse to a sender and record the handler's outcome.
+
+  Args:
+      ctx (Context): Context of the agent's message handler.
+      sender (str): Address of the sender.
+      message (str): Text of the reply.
+      outcome (str, optional): Metrics outcome of the handler.
+  """
+  from ai_engine import UAgentResponse, UAgentResponseType
+
+  set_outcome(outcome)
+  await ctx.send(sender, UAgentResponse(message=message, type=UAgentResponseType.ERROR))
+
+
+async def reply_failure(ctx, sender: str, error: Exception) -> None:
+  """
+  Reply to a message whose response could not be generated, with an error
+  UAgentResponse explaining why.
+
+  Args:
+      ctx (Context): Context of the agent's message handler.
+      sender (str): Address of the sender.
+      error (Exception): What the response failed with.
+  """
+  if isinstance(error, AdmissionRejected):
+    await reply_error(ctx, sender, f"The service is busy ({error.reason}). "
+                                   f"Please retry in {error.retry_after} seconds.")
+  elif isinstance(error, RateLimited):
+    # A long document is charged one request per chunk
+    await reply_error(ctx, sender, f"{error.reason}. Please retry in {error.retry_after} seconds.",
+                      outcome="rate_limited")
+  elif isinstance(error, DocumentTooLarge):
+    await reply_error(ctx, sender, f"{error}.")
+  else:
+    ctx.logger.error(f"LLM request failed: {error}")
+    await reply_error(ctx, sender, "Sorry, the response could not be generated right now. Please try again later.")
@@ -0,0 +1,227 @@
+import asyncio
+import os
+import random
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from admission import AdmissionRejected
+
+"""
+StudyMate Resilience
+
+Retry and circuit breaking for LLM calls. Only errors classified as transient
+(timeouts, connection failures, rate limiting and 5xx responses) are retried,
+with capped exponential backoff, full jitter and an overall deadline. The
+circuit breaker opens after repeated failures and rejects calls immediately
+until the upstream has had time to recover.
+"""
+
+T = TypeVar("T")
+
+# Upstream status codes worth retrying
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Exception class names raised by the Google client libraries for transient failures
+TRANSIENT_ERROR_NAMES = {
+    "ResourceExhausted",
+    "ServiceUnavailable",
+    "DeadlineExceeded",
+    "InternalServerError",
+    "TooManyRequests",
+    "GatewayTimeout",
+    "BadGateway",
+}
+
+
+def is_transient(error: BaseException) -> bool:
+  """
+  Classify an error raised by an LLM call as transient (worth retrying).
+  """
+  if isinstance(error, AdmissionRejected):
+    return False
+  if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+    return True
+  if type(error).__name__ in TRANSIENT_ERROR_NAMES:
+    return True
+  for attribute in ("status_code", "code"):
+    status = getattr(error, attribute, None)
+    if isinstance(status, int) and status in TRANSIENT_STATUS_CODES:
+      return True
+  return False
+
+
+class CircuitOpenError(AdmissionRejected):
+  """
+  Raised when the circuit breaker is open and calls are failing fast.
+  """
+
+
+class CircuitBreaker:
+  """
+  Consecutive-failure circuit breaker.
+
+  Closed: calls pass through. After `failure_threshold` consecutive failures it
+  opens and rejects calls for `reset_timeout` seconds. It then half-opens and
+  lets a single probe call through; success closes it, failure re-opens it.
+  """
+
+  CLOSED = "closed"
+  OPEN = "open"
+  HALF_OPEN = "half_open"
+
+  def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0,
+               clock: Callable[[], float] = time.monotonic):
+    self.failure_threshold = failure_threshold
+    self.reset_timeout = reset_timeout
+    self._clock = clock
+    self._state = self.CLOSED
+    self._failures = 0
+    self._opened_at = 0.0
+    self._probing = False
+    self.rejected = 0
+
+  @property
+  def state(self) -> str:
+    if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+      self._state = self.HALF_OPEN
+      self._probing = False
+    return self._state
+
+  def before_call(self) -> None:
+    """
+    Raise CircuitOpenError unless a call may go through now.
+    """
+    state = self.state
+    if state == self.CLOSED:
+      return
+    if state == self.HALF_OPEN and not self._probing:
+      self._probing = True
+      return
+    self.rejected += 1
+    remaining = max(0.0, self.reset_timeout - (self._clock() - self._opened_at))
+    raise CircuitOpenError("LLM upstream is unavailable", max(1, int(remaining + 0.999)))
+
+  def record_success(self) -> None:
+    self._state = self.CLOSED
+    self._failures = 0
+    self._probing = False
+
+  def record_failure(self) -> None:
+    self._failures += 1
+    if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+      self._state = self.OPEN
+      self._opened_at = self._clock()
+      self._probing = False
+
+  def release_probe(self) -> None:
+    """
+    Give back a half-open probe whose call ended without reaching the upstream.
+    """
+    self._probing = False
+
+  def stats(self) -> dict:
+    return {
+        "state": self.state,
+        "consecutive_failures": self._failures,
+        "rejected": self.rejected,
+    }
+
+
+class RetryPolicy:
+  """
+  Retries transient failures with capped exponential backoff and full jitter.
+
+  Args:
+      attempts (int): Maximum number of attempts, including the first.
+      base_delay (float): Backoff before the first retry, in seconds.
+      max_delay (float): Cap on a single backoff, in seconds.
+      deadline (float): Overall time budget for all attempts, in seconds.
+      breaker (CircuitBreaker, optional): Breaker consulted before each attempt.
+  """
+
+  def __init__(self, attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0,
+               deadline: float = 60.0, breaker: Optional[CircuitBreaker] = None,
+               sleep: Callable[[float], Awaitable[None]] = asyncio.sleep):
+    self.attempts = attempts
+    self.base_delay = base_delay
+    self.max_delay = max_delay
+    self.deadline = deadline
+    self.breaker = breaker
+    self._sleep = sleep
+    self.retries = 0
+
+  def backoff(self, attempt: int) -> float:
+    """
+    Return the jittered delay before retry number `attempt` (0-based).
+    """
+    return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+  async def call(self, fn: Callable[[float], Awaitable[T]]) -> T:
+    """
+    Call fn(deadline), retrying transient failures within the deadline.
+
+    fn receives the deadline as a time.monotonic() value and applies it to the
+    upstream call only. Time spent queueing for a local slot must not look
+    like an upstream timeout, which would count towards the circuit breaker;
+    fn raises AdmissionRejected instead if the deadline passes while queued.
+    """
+    deadline = time.monotonic() + self.deadline
+    attempt = 0
+    while True:
+      if self.breaker is not None:
+        self.breaker.before_call()
+      try:
+        result = await fn(deadline)
+      except (AdmissionRejected, asyncio.CancelledError):
+        if self.breaker is not None:
+          self.breaker.release_probe()
+        raise
+      except Exception as e:
+        transient = is_transient(e)
+        if self.breaker is not None:
+          # Non-transient errors still mean the upstream answered
+          if transient:
+            self.breaker.record_failure()
+          else:
+            self.breaker.record_success()
+        delay = self.backoff(attempt)
+        attempt += 1
+        if not transient or attempt >= self.attempts or time.monotonic() + delay >= deadline:
+          raise
+        self.retries += 1
+        await self._sleep(delay)
+        continue
+      if self.breaker is not None:
+        self.breaker.record_success()
+      return result
+
+
+_retry_policy = None
+
+
+def get_retry_policy() -> RetryPolicy:
+  """
+  Return the process-wide retry policy and circuit breaker for LLM calls,
+  configured from the environment on first use.
+  """
+  global _retry_policy
+  if _retry_policy is None:
+    _retry_policy = RetryPolicy(
+        attempts=int(os.getenv("LLM_RETRY_ATTEMPTS", "3")),
+        base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5")),
+        max_delay=float(os.getenv("LLM_RETRY_MAX_DELAY", "8")),
+        deadline=float(os.getenv("LLM_RETRY_DEADLINE", "60")),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.getenv("LLM_BREAKER_THRESHOLD", "5")),
+            reset_timeout=float(os.getenv("LLM_BREAKER_RESET", "30")),
+        ),
+    )
+  return _retry_policy
+
+
+def set_retry_policy(policy: RetryPolicy) -> None:
+  """
+  Replace the process-wide retry policy, e.g. in tests or benchmarks.
+  """
+  global _retry_policy
+  _retry_policy = policy
@@ -0,0 +1,241 @@
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Dict, Optional, Tuple
+
+from metrics import observe_stage
+
+"""
+StudyMate Semantic Cache
+
+Second cache tier for requests that are worded differently but ask for the same
+thing, e.g. "Photosynthesis (NCERT 12)" and "NCERT 12 - photosynthesis".
+The free-text fields of a request are turned into a sparse vector by a hashing
+vectorizer (words and character trigrams, no model download), and the vectors
+of previously answered requests are kept in an inverted index. A lookup only
+scores stored requests sharing one of the query's rarer features, which is
+enough to find every request that can reach the similarity threshold, and
+returns the most similar one if it does.
+
+Only the subject of a request (the topic, or the field of interest) is compared
+by similarity. Requests are only compared within a partition: the same prompt
+template, generation profile and normalized values of the remaining fields, so
+'Short' notes never answer a request for 'Detailed' notes and "with worked
+examples" never answers "without worked examples". Within the subject, the
+words that change a request while barely changing its vector must match exactly
+too: numbers ("Class 11" and "Class 12"), number words and roman numerals
+("World War I" and "II"), languages, negations, difficulty levels and other
+short words. The index stores response cache keys, not responses, so the
+response cache stays the single store of text. The semantic cache is off unless
+SEMANTIC_CACHE_MAX_ENTRIES is set.
+"""
+
+# Words too common in requests to say anything about the topic
+STOPWORDS = frozenset((
+    "a", "an", "and", "about", "all", "any", "are", "as", "at", "be", "by", "can", "do", "for", "get",
+    "how", "in", "is", "it", "its", "me", "my", "of", "on", "or", "so", "the", "to", "with",
+    "na", "note", "notes", "please", "class",
+))
+
+# Words that must match exactly, in addition to those with a digit, roman
+# numerals and words of at most SHORT_WORD characters
+EXACT_WORDS = frozenset((
+    "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten", "eleven", "twelve",
+    "fifteen", "twenty", "thirty", "forty", "fifty", "hundred", "first", "second", "third", "fourth",
+    "fifth", "sixth", "seventh", "eighth", "ninth", "tenth", "eleventh", "twelfth",
+    "english", "hindi", "bengali", "gujarati", "kannada", "malayalam", "marathi", "odia", "punjabi",
+    "sanskrit", "tamil", "telugu", "urdu", "french", "german", "spanish",
+    "without", "except", "exclude", "excluding", "include", "including", "only",
+    "easy", "medium", "hard", "difficult", "basic", "advanced", "beginner",
+))
+
+SHORT_WORD = 3
+
+# Weight of a character trigram relative to a whole word
+TRIGRAM_WEIGHT = 0.3
+
+_WORD = re.compile(r"\w+")
+_ROMAN = re.compile(r"(?=[ivxlc])c{0,3}(xc|xl|l?x{0,3})(ix|iv|v?i{0,3})")
+
+
+def exact_words(fields: Dict[str, str]) -> str:
+  """
+  Return the words of a request's text fields that must match exactly for a
+  stored request to answer it, as a canonical string.
+  """
+  words = []
+  for name in sorted(fields):
+    found = sorted({word for word in _WORD.findall(fields[name].casefold()) if word not in STOPWORDS and (
+        len(word) <= SHORT_WORD or word in EXACT_WORDS or _ROMAN.fullmatch(word) or any(c.isdigit() for c in word))})
+    if found:
+      words.append(f"{name}={' '.join(found)}")
+  return ";".join(words)
+
+
+def vectorize(fields: Dict[str, str]) -> Dict[int, float]:
+  """
+  Return the unit-length sparse feature vector of a request's text fields.
+  Features are hashed per field, so a word in one field does not match the
+  same word in another.
+  """
+  vector = defaultdict(float)
+  for name, text in fields.items():
+    for word in _WORD.findall(text.casefold()):
+      if word in STOPWORDS:
+        continue
+      vector[hash((name, word))] += 1.0
+      padded = f"<{word}>"
+      for i in range(len(padded) - 2):
+        vector[hash((name, padded[i:i + 3]))] += TRIGRAM_WEIGHT
+  norm = math.sqrt(sum(value * value for value in vector.values()))
+  return {feature: value / norm for feature, value in vector.items()} if norm else {}
+
+
+class SemanticCache:
+  """
+  In-memory nearest-neighbour index from request vectors to response cache keys.
+
+  Args:
+      threshold (float): Minimum cosine similarity for a stored request to
+          answer a new one.
+      max_entries (int): Requests kept in the index. The least recently
+          matched are dropped first.
+  """
+
+  def __init__(self, threshold: float = 0.95, max_entries: int = 4096):
+    self.threshold = threshold
+    self.max_entries = max_entries
+    self.lookups = 0
+    self.hits = 0
+    self.lookup_time_total = 0.0
+    self.lookup_time_max = 0.0
+    self._entries = OrderedDict()  # cache key -> (partition, vector)
+    self._postings = {}  # (partition, feature) -> {cache key: weight}
+    self._lock = threading.Lock()
+
+  def search(self, partition: str, fields: Dict[str, str]) -> Optional[Tuple[str, float]]:
+    """
+    Return the cache key and similarity of the closest stored request in the
+    partition, or None if none reaches the threshold.
+    """
+    started = time.perf_counter()
+    partition = self._partition(partition, fields)
+    query = vectorize(fields)
+    with self._lock:
+      match = None
+      for key in self._candidates(partition, query):
+        vector = self._entries[key][1]
+        score = sum(weight * vector.get(feature, 0.0) for feature, weight in query.items())
+        if match is None or score > match[1]:
+          match = (key, score)
+      if match is not None and match[1] >= self.threshold:
+        self._entries.move_to_end(match[0])
+      else:
+        match = None
+      self._record_lookup(time.perf_counter() - started, match is not None)
+    return match
+
+  def add(self, partition: str, fields: Dict[str, str], key: str) -> None:
+    """
+    Index a request whose response is stored under `key` in the response cache.
+    """
+    partition = self._partition(partition, fields)
+    vector = vectorize(fields)
+    if not vector:
+      return
+    with self._lock:
+      self._remove(key)
+      self._entries[key] = (partition, vector)
+      for feature, weight in vector.items():
+        self._postings.setdefault((partition, feature), {})[key] = weight
+      while len(self._entries) > self.max_entries:
+        self._remove(next(iter(self._entries)))
+
+  def discard(self, key: str) -> None:
+    """
+    Drop a request from the index, e.g. once its response has left the cache.
+    """
+    with self._lock:
+      self._remove(key)
+
+  def stats(self) -> dict:
+    """
+    Return index size, hit rate and lookup latency.
+    """
+    with self._lock:
+      return {
+          "entries": len(self._entries),
+          "features": len(self._postings),
+          "lookups": self.lookups,
+          "hits": self.hits,
+          "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+          "threshold": self.threshold,
+          "lookup_time_avg": self.lookup_time_total / self.lookups if self.lookups else 0.0,
+          "lookup_time_max": self.lookup_time_max,
+      }
+
+  @staticmethod
+  def _partition(partition: str, fields: Dict[str, str]) -> str:
+    # Requests differing in a number, numeral or short word are never compared
+    exact = exact_words(fields)
+    return f"{partition}\n{exact}" if exact else partition
+
+  def _candidates(self, partition: str, query: Dict[int, float]) -> set:
+    """
+    Return the stored requests that can reach the threshold. Features are taken
+    rarest first until the rest of the query's norm is below the threshold: a
+    request sharing none of the features taken cannot score more than that
+    remaining norm, so the common features need not be scanned.
+    """
+    postings = [(self._postings.get((partition, feature), {}), weight) for feature, weight in query.items()]
+    postings.sort(key=lambda item: len(item[0]))
+    candidates = set()
+    remaining = 1.0
+    for posting, weight in postings:
+      if math.sqrt(max(remaining, 0.0)) < self.threshold:
+        break
+      candidates.update(posting)
+      remaining -= weight * weight
+    return candidates
+
+  def _remove(self, key: str) -> None:
+    entry = self._entries.pop(key, None)
+    if entry is None:
+      return
+    partition, vector = entry
+    for feature in vector:
+      posting = self._postings.get((partition, feature))
+      if posting is not None:
+        posting.pop(key, None)
+        if not posting:
+          del self._postings[(partition, feature)]
+
+  def _record_lookup(self, seconds: float, hit: bool) -> None:
+    observe_stage("semantic_lookup", seconds)
+    self.lookups += 1
+    self.hits += hit
+    self.lookup_time_total += seconds
+    self.lookup_time_max = max(self.lookup_time_max, seconds)
+
+
+_semantic_cache = None
+
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+  """
+  Return the process-wide semantic cache, configured from the environment on
+  first use, or None unless it is enabled with SEMANTIC_CACHE_MAX_ENTRIES.
+  """
+  global _semantic_cache
+  if _semantic_cache is None:
+    max_entries = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "0"))
+    if max_entries <= 0:
+      return None
+    _semantic_cache = SemanticCache(
+        threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+        max_entries=max_entries,
+    )
+  return _semantic_cache
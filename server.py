@@ -1,99 +1,511 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import Literal
+import asyncio
+import codecs
+import hashlib
+import json
+import os
+import time
+from dotenv import load_dotenv
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Match
+from pydantic import BaseModel, ValidationError
+from typing import Any, AsyncIterator, Dict, List, Literal
 
-from notes_agent import NotesAgentModel
-from questions_agent import QuestionsAgentModel
-from career_guidance_agent import CareerGuidanceAgentModel
-from utils import get_llm_response
+from admission import PRIORITIES, AdmissionRejected, get_admission_controller
+from backends import Completion, Usage
+from cache import get_response_cache
+from capture import CaptureMiddleware
+from compression import CompressionMiddleware
+from documents import (Chunker, DocumentTooLarge, document_chunks, get_document_notes_completion, is_document,
+                       setting)
+from jobs import DONE, FAILED, JobStore, JobWorkerPool
+from models import REQUEST_TYPES, CareerGuidanceRequest, NotesRequest, QuestionsRequest
+from metrics import REGISTRY, RESPONSE_BYTES, mark_handler_start, observe_stage, request_started, set_outcome, track_request
+from resilience import get_retry_policy
+from semantic_cache import get_semantic_cache
+from ratelimit import RateLimited, get_rate_limiter, limit_client
+from prompts import CAREER_GUIDANCE_PROMPT, NOTES_PROMPT, QUESTIONS_PROMPT, PromptTemplate
+from question_sets import get_questions_completion
+from utils import get_llm_completion, get_llm_response, stream_llm_response
+from warmup import coverage_report, create_warmup_runner
+
+# Load environment variables from .env file
+load_dotenv()
 
 app = FastAPI()
 
 
-class NotesRequest(BaseModel):
-  topic: str
-  notes_style: Literal['Short', 'Detailed', 'Last-minute revision']
-  reference_material: str
-  additional_requirements: str
+def route_label(scope) -> str:
+  """
+  Metrics label of a request: the path of the route it matches, or "other",
+  so that arbitrary URLs cannot create new label sets.
+  """
+  for route in app.router.routes:
+    match, _ = route.matches(scope)
+    if match == Match.FULL:
+      return route.path.strip("/")
+  return "other"
+
+
+class MetricsMiddleware:
+  """
+  ASGI middleware that counts POST requests per endpoint, labels the request
+  context for stage timings, and records response size and send time.
+  """
+
+  def __init__(self, app):
+    self.app = app
+
+  async def __call__(self, scope, receive, send):
+    if scope["type"] != "http" or scope["method"] != "POST":
+      await self.app(scope, receive, send)
+      return
+
+    endpoint = route_label(scope)
+    request_started.set(time.perf_counter())
+    response = {"started": None, "bytes": 0}
+
+    async def send_with_metrics(message):
+      if message["type"] == "http.response.start":
+        response["started"] = time.perf_counter()
+        set_outcome(str(message["status"]))
+      elif message["type"] == "http.response.body":
+        response["bytes"] += len(message.get("body", b""))
+        if not message.get("more_body", False):
+          observe_stage("response_send", time.perf_counter() - response["started"])
+          RESPONSE_BYTES.observe(response["bytes"], endpoint=endpoint)
+      await send(message)
+
+    with track_request(endpoint):
+      await self.app(scope, receive, send_with_metrics)
+
+
+# Added first so that it runs inside MetricsMiddleware, which then records the compressed size
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", "500")))
+app.add_middleware(MetricsMiddleware)
+# Outermost, so captured timings and sizes are those seen by the client
+app.add_middleware(CaptureMiddleware)
+
+# "text" returns the response as written by the LLM, "structured" its parsed
+# form: sections and bullets for notes and career guidance, a question list for
+# practice questions (see structure.py)
+ResponseFormat = Literal["text", "structured"]
+
+
+def overloaded(rejection: AdmissionRejected) -> HTTPException:
+  return HTTPException(status_code=503, detail=rejection.reason,
+                       headers={"Retry-After": str(rejection.retry_after)})
 
 
-class QuestionsRequest(BaseModel):
-  topic: str
-  with_answers: Literal['Yes', 'No']
-  additional_requirements: str
+def too_many_requests(rejection: RateLimited) -> HTTPException:
+  return HTTPException(status_code=429, detail=rejection.reason, headers={"Retry-After": str(rejection.retry_after)})
 
 
-class CareerGuidanceRequest(BaseModel):
-  education_level: str
-  degree_or_class: str
-  field_of_interest: str
-  future_goal: str
+def too_large(rejection: DocumentTooLarge) -> HTTPException:
+  return HTTPException(status_code=413, detail=str(rejection))
 
 
-@app.post("/notes")
-async def generate_notes(request: NotesRequest):
-  formatted_prompt = (
-      "You are acting as a tool that helps students prepare notes for various subjects and topics. "
-      "The user supplies specific details such as the topic they need notes on, the preferred style "
-      "of the notes (short, detailed, or last-minute revision), any reference material, and additional "
-      "requirements or focus areas for the notes. Based on this information, you generate concise and "
-      "tailored notes to assist students in studying effectively and efficiently.\n\n"
-      "Given the provided data for the Notes Agent, your task is to prepare notes on the following:\n\n"
-      f"- Topic: {request.topic}\n"
-      f"- Notes Style: {request.notes_style}\n"
-      f"- Reference Material: {request.reference_material}\n"
-      f"- Additional Requirements: {request.additional_requirements}\n\n"
-      "Note: If any information is missing (marked as 'NA'), please use intelligent reasoning to generate the notes accordingly."
-  )
+def client_id(http_request: Request) -> str:
+  """
+  Identify the client of a request for rate limiting: its API key (hashed, so
+  keys are never stored) or else its IP address.
+  """
+  api_key = http_request.headers.get("x-api-key")
+  if api_key:
+    return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+  return "ip:" + (http_request.client.host if http_request.client else "unknown")
 
+
+def check_rate_limit(http_request: Request, cost: int = 1) -> None:
+  try:
+    limit_client(client_id(http_request), cost)
+  except RateLimited as e:
+    raise too_many_requests(e)
+
+
+async def rate_limited(http_request: Request) -> None:
+  """
+  Dependency rejecting clients over their rate or quota before the request is
+  rendered or sent to the LLM.
+  """
+  check_rate_limit(http_request)
+
+
+async def generate_response(template: PromptTemplate, request: BaseModel) -> Completion:
+  """
+  Render the prompt for a request and return the LLM response and its token
+  usage, mapping failures to HTTP errors.
+  """
   try:
-    response = await get_llm_response(formatted_prompt)
-    return {"response": response}
+    if template is QUESTIONS_PROMPT:
+      # Served from the cached set with or without answers when there is one
+      return await get_questions_completion(request, priority=PRIORITIES[template.name])
+    if template is NOTES_PROMPT and is_document(request.reference_material):
+      return await get_document_notes_completion(request, priority=PRIORITIES[template.name])
+    formatted_prompt = template.render(request)
+    return await get_llm_completion(formatted_prompt, cache_key=template.cache_key(request),
+                                    priority=PRIORITIES[template.name], profile=template.profile(request),
+                                    similarity_key=template.similarity_key(request), parser=template.parser)
+  except AdmissionRejected as e:
+    raise overloaded(e)
+  except RateLimited as e:
+    raise too_many_requests(e)
+  except DocumentTooLarge as e:
+    raise too_large(e)
   except Exception as e:
     raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/questions")
-async def generate_questions(request: QuestionsRequest):
-  formatted_prompt = (
-      "You are acting as a tool that helps students by providing practice questions and answers. "
-      "Users specify the topic for which they need practice questions, whether they require questions "
-      "with or without answers, and any additional requirements or preferences they may have. You generate "
-      "appropriate practice questions tailored to the student's needs to help them prepare effectively for exams and assessments.\n\n"
-      "Given the provided data for the Questions Agent, your task is to prepare questions on the following:\n\n"
-      f"- Topic: {request.topic}\n"
-      f"- With Answers: {request.with_answers}\n"
-      f"- Additional Requirements: {request.additional_requirements}\n\n"
-      "Note: If any information is missing (marked as 'NA'), please use intelligent reasoning to generate the questions accordingly."
-  )
+def completion_body(completion: Completion, response_format: ResponseFormat = "text") -> dict:
+  if response_format == "structured":
+    return {"structured": completion.structured, "usage": completion.usage.dict()}
+  return {"response": completion.text, "usage": completion.usage.dict()}
+
+
+@app.post("/notes", dependencies=[Depends(rate_limited)])
+async def generate_notes(request: NotesRequest, response_format: ResponseFormat = Query("text", alias="format")):
+  mark_handler_start()
+  return completion_body(await generate_response(NOTES_PROMPT, request), response_format)
+
+
+@app.post("/questions", dependencies=[Depends(rate_limited)])
+async def generate_questions(request: QuestionsRequest, response_format: ResponseFormat = Query("text", alias="format")):
+  mark_handler_start()
+  return completion_body(await generate_response(QUESTIONS_PROMPT, request), response_format)
+
+
+@app.post("/career-guidance", dependencies=[Depends(rate_limited)])
+async def generate_career_guidance(request: CareerGuidanceRequest,
+                                   response_format: ResponseFormat = Query("text", alias="format")):
+  mark_handler_start()
+  return completion_body(await generate_response(CAREER_GUIDANCE_PROMPT, request), response_format)
 
+
+async def server_sent_events(first_chunk: str, chunks: AsyncIterator[str], usage: Usage) -> AsyncIterator[str]:
+  """
+  Wrap response chunks as Server-Sent Events. Each chunk is sent as a JSON
+  string in a `data` event, followed by a final `done` event carrying the
+  token usage, or an `error` event if the LLM fails mid-stream.
+  """
+  yield f"data: {json.dumps(first_chunk)}\n\n"
+  try:
+    async for chunk in chunks:
+      yield f"data: {json.dumps(chunk)}\n\n"
+  except Exception as e:
+    yield f"event: error\ndata: {json.dumps(str(e))}\n\n"
+    return
+  yield f"event: done\ndata: {json.dumps({'usage': usage.dict()})}\n\n"
+
+
+async def no_chunks() -> AsyncIterator[str]:
+  return
+  yield
+
+
+async def stream_response(template: PromptTemplate, request: BaseModel) -> StreamingResponse:
+  usage = Usage()
+  if template is NOTES_PROMPT and is_document(request.reference_material):
+    # Notes on a long document are only complete once its parts are combined
+    completion = await generate_response(template, request)
+    usage.update(completion.usage)
+    return StreamingResponse(server_sent_events(completion.text, no_chunks(), usage), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+  chunks = stream_llm_response(template.render(request), cache_key=template.cache_key(request),
+                               priority=PRIORITIES[template.name], profile=template.profile(request),
+                               similarity_key=template.similarity_key(request), usage=usage,
+                               parser=template.parser)
+
+  # Wait for the first chunk so that admission and upstream errors still map to a status code
   try:
-    response = await get_llm_response(formatted_prompt)
-    return {"response": response}
+    first_chunk = await chunks.__anext__()
+  except StopAsyncIteration:
+    first_chunk = ""
+  except AdmissionRejected as e:
+    raise overloaded(e)
   except Exception as e:
     raise HTTPException(status_code=500, detail=str(e))
 
+  return StreamingResponse(server_sent_events(first_chunk, chunks, usage), media_type="text/event-stream",
+                           headers={"Cache-Control": "no-cache"})
+
+
+@app.post("/notes/stream", dependencies=[Depends(rate_limited)])
+async def stream_notes(request: NotesRequest):
+  mark_handler_start()
+  return await stream_response(NOTES_PROMPT, request)
+
 
-@app.post("/career-guidance")
-async def generate_career_guidance(request: CareerGuidanceRequest):
-  formatted_prompt = (
-      "You are acting as a career guidance tool that helps students navigate their education and career paths. "
-      "The user supplies specific details such as their current education level, degree or class, field of interest, "
-      "and future goals. Based on this information, you provide personalized career guidance and advice to assist them "
-      "in making informed decisions about their academic and professional future.\n\n"
-      "Given the provided data for the Career Guidance Agent, your task is to provide guidance on the following:\n\n"
-      f"- Education Level: {request.education_level}\n"
-      f"- Degree or Class: {request.degree_or_class}\n"
-      f"- Field of Interest: {request.field_of_interest}\n"
-      f"- Future Goal: {request.future_goal}\n\n"
-      "Note: If any information is missing (marked as 'NA'), please use intelligent reasoning to provide the guidance accordingly."
-  )
+@app.post("/notes/document", dependencies=[Depends(rate_limited)])
+async def generate_document_notes(http_request: Request, topic: str,
+                                  notes_style: Literal['Short', 'Detailed', 'Last-minute revision'],
+                                  additional_requirements: str = "NA",
+                                  response_format: ResponseFormat = Query("text", alias="format")):
+  """
+  Generate notes on a long document, e.g. a textbook chapter, sent as the
+  plain-text request body. The other notes fields are query parameters. The
+  body is split into chunks as it is received.
+  """
+  mark_handler_start()
+  decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+  chunker = Chunker()
+  max_bytes = setting("DOCUMENT_MAX_BYTES")
+  chunks, parts, size = [], [], 0
+  async for data in http_request.stream():
+    size += len(data)
+    if size > max_bytes:
+      raise HTTPException(status_code=413, detail=f"A document may be at most {max_bytes} bytes")
+    text = decoder.decode(data)
+    parts.append(text)
+    chunks.extend(chunker.feed(text))
+  text = decoder.decode(b"", final=True)
+  parts.append(text)
+  chunks.extend(chunker.feed(text) + chunker.finish())
+  if not chunks:
+    raise HTTPException(status_code=422, detail="The document is empty")
 
+  request = NotesRequest(topic=topic, notes_style=notes_style, reference_material="".join(parts),
+                         additional_requirements=additional_requirements)
   try:
-    response = await get_llm_response(formatted_prompt)
-    return {"response": response}
+    completion = await get_document_notes_completion(request, priority=PRIORITIES[NOTES_PROMPT.name], chunks=chunks)
+  except AdmissionRejected as e:
+    raise overloaded(e)
+  except RateLimited as e:
+    raise too_many_requests(e)
   except Exception as e:
     raise HTTPException(status_code=500, detail=str(e))
+  return completion_body(completion, response_format)
+
+
+@app.post("/questions/stream", dependencies=[Depends(rate_limited)])
+async def stream_questions(request: QuestionsRequest):
+  mark_handler_start()
+  return await stream_response(QUESTIONS_PROMPT, request)
+
+
+@app.post("/career-guidance/stream", dependencies=[Depends(rate_limited)])
+async def stream_career_guidance(request: CareerGuidanceRequest):
+  mark_handler_start()
+  return await stream_response(CAREER_GUIDANCE_PROMPT, request)
+
+
+class BatchItem(BaseModel):
+  type: Literal['notes', 'questions', 'career-guidance']
+  request: Dict[str, Any]
+  format: ResponseFormat = "text"
+
+
+class BatchRequest(BaseModel):
+  items: List[BatchItem]
+
+
+# Largest batch accepted, and how many of its items run at once
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+
+
+async def generate_batch_item(index: int, item: BatchItem, fan_out: asyncio.Semaphore) -> dict:
+  """
+  Generate one batch item, returning its response or its error instead of raising.
+  """
+  model, template = REQUEST_TYPES[item.type]
+  result = {"index": index, "type": item.type}
+  try:
+    request = model(**item.request)
+  except ValidationError as e:
+    return {**result, "status": 422, "error": e.errors()}
+
+  async with fan_out:
+    try:
+      completion = await generate_response(template, request)
+    except HTTPException as e:
+      return {**result, "status": e.status_code, "error": e.detail}
+  return {**result, "status": 200, **completion_body(completion, item.format)}
+
+
+async def batch_results(items: List[BatchItem]) -> AsyncIterator[str]:
+  fan_out = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+  tasks = [asyncio.create_task(generate_batch_item(index, item, fan_out)) for index, item in enumerate(items)]
+  try:
+    for next_result in asyncio.as_completed(tasks):
+      yield json.dumps(await next_result) + "\n"
+  finally:
+    # Stop outstanding items if the client goes away
+    for task in tasks:
+      task.cancel()
+
+
+@app.post("/batch")
+async def generate_batch(request: BatchRequest, http_request: Request):
+  """
+  Run many notes, questions and career guidance requests concurrently and
+  stream one JSON line per item as it completes. Each line carries the item's
+  index and either its response or its error, so one failed item does not
+  fail the batch. Each item counts as one request towards the client's limits.
+  """
+  mark_handler_start()
+  if len(request.items) > BATCH_MAX_ITEMS:
+    raise HTTPException(status_code=413, detail=f"A batch may contain at most {BATCH_MAX_ITEMS} items")
+  check_rate_limit(http_request, len(request.items))
+  return StreamingResponse(batch_results(request.items), media_type="application/x-ndjson")
+
+
+# Local job queue for submit/poll/fetch generation
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.db")
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "4"))
+# Finished results are kept as long as cached responses
+JOBS_RESULT_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+
+job_store = None
+job_workers = None
+warmup_runner = None
+warmup_task = None
+
+
+async def run_job(job_type: str, fields: dict) -> str:
+  model, template = REQUEST_TYPES[job_type]
+  request = model(**fields)
+  if template is QUESTIONS_PROMPT:
+    completion = await get_questions_completion(request, priority=PRIORITIES[template.name])
+    return completion.text
+  if template is NOTES_PROMPT and is_document(request.reference_material):
+    completion = await get_document_notes_completion(request, priority=PRIORITIES[template.name])
+    return completion.text
+  return await get_llm_response(template.render(request), cache_key=template.cache_key(request),
+                                priority=PRIORITIES[template.name], profile=template.profile(request),
+                                similarity_key=template.similarity_key(request), parser=template.parser)
+
+
+@app.on_event("startup")
+async def start_job_workers():
+  global job_store, job_workers
+  job_store = JobStore(JOBS_DB_PATH, ttl=JOBS_RESULT_TTL)
+  job_workers = JobWorkerPool(job_store, run_job, workers=JOBS_WORKERS)
+  job_workers.start()
+
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+  await job_workers.stop()
+  # Jobs interrupted by the shutdown were queued again
+  job_store.flush()
+
+
+@app.on_event("startup")
+async def start_warmup():
+  global warmup_runner, warmup_task
+  warmup_runner = create_warmup_runner(REQUEST_TYPES)
+  if warmup_runner is not None:
+    warmup_task = asyncio.create_task(warmup_runner.run_forever())
+
+
+@app.on_event("shutdown")
+async def stop_warmup():
+  if warmup_task is not None:
+    warmup_task.cancel()
+    await asyncio.gather(warmup_task, return_exceptions=True)
+
+
+@app.post("/jobs", status_code=202, dependencies=[Depends(rate_limited)])
+async def submit_job(item: BatchItem, http_request: Request):
+  """
+  Queue a notes, questions or career guidance request and return its job ID
+  immediately. Submitting the same request again returns the same job.
+  """
+  mark_handler_start()
+  model, template = REQUEST_TYPES[item.type]
+  try:
+    request = model(**item.request)
+  except ValidationError as e:
+    raise HTTPException(status_code=422, detail=e.errors())
+  if template is NOTES_PROMPT and is_document(request.reference_material):
+    # Jobs run outside the client's request, so each further chunk is charged now
+    try:
+      chunks = document_chunks(request.reference_material)
+    except DocumentTooLarge as e:
+      raise too_large(e)
+    check_rate_limit(http_request, len(chunks) - 1)
+
+  job = job_store.submit(template.cache_key(request), item.type, request.dict())
+  job_workers.notify()
+  return {"job_id": job["id"], "status": job["status"]}
+
+
+def get_job_or_404(job_id: str) -> dict:
+  job = job_store.get(job_id)
+  if job is None:
+    raise HTTPException(status_code=404, detail="Job not found")
+  return job
+
+
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+  job = get_job_or_404(job_id)
+  return {"job_id": job["id"], "type": job["type"], "status": job["status"], "attempts": job["attempts"],
+          "created_at": job["created_at"], "updated_at": job["updated_at"]}
+
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+  job = get_job_or_404(job_id)
+  if job["status"] == DONE:
+    return {"job_id": job["id"], "response": job["result"]}
+  if job["status"] == FAILED:
+    raise HTTPException(status_code=500, detail=job["error"])
+  raise HTTPException(status_code=409, detail=f"Job is {job['status']}", headers={"Retry-After": "5"})
+
+
+@app.get("/cache-stats")
+async def cache_stats():
+  return get_response_cache().stats()
+
+
+@app.get("/semantic-cache-stats")
+async def semantic_cache_stats():
+  semantic_cache = get_semantic_cache()
+  return semantic_cache.stats() if semantic_cache is not None else {"enabled": False}
+
+
+@app.get("/rate-limit-stats")
+async def rate_limit_stats():
+  rate_limiter = get_rate_limiter()
+  return rate_limiter.stats() if rate_limiter is not None else {"enabled": False}
+
+
+@app.get("/usage")
+async def client_usage(http_request: Request):
+  """
+  Return the calling client's usage and limits for the day.
+  """
+  rate_limiter = get_rate_limiter()
+  return rate_limiter.usage(client_id(http_request)) if rate_limiter is not None else {"enabled": False}
+
+
+@app.get("/warmup-stats")
+async def warmup_stats():
+  return coverage_report(warmup_runner)
+
+
+@app.get("/admission-stats")
+async def admission_stats():
+  return get_admission_controller().stats()
+
+
+@app.get("/jobs-stats")
+async def jobs_stats():
+  return job_store.counts()
+
+
+@app.get("/upstream-stats")
+async def upstream_stats():
+  policy = get_retry_policy()
+  breaker = policy.breaker.stats() if policy.breaker is not None else None
+  return {"retries": policy.retries, "circuit_breaker": breaker}
+
+
+@app.get("/metrics")
+async def metrics():
+  return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
   import uvicorn
@@ -0,0 +1,352 @@
+import asyncio
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from admission import PRIORITIES
+from backends import Completion, estimate_tokens
+from metrics import RESPONSE_BYTES, stage
+from prompts import FOLLOW_UP_PROMPT, PromptTemplate
+from ratelimit import reject_if_limited
+from replies import reply_error, reply_failure
+from utils import get_llm_completion
+
+"""
+StudyMate Sessions
+
+Lets agent users follow up on their last request ("now give me 10 more
+questions", "explain the Calvin cycle in more detail") without regenerating
+everything. Each sender has a session per agent holding its recent turns:
+the request, the response and a compact summary of it derived from the
+parsed response (section headings, question list), so no LLM call is spent
+on summarizing.
+
+A follow-up is answered from a bounded context window of SESSION_CONTEXT_TOKENS
+tokens: the latest response, cut to fit, and the summaries of the turns before
+it, newest first, as far as the budget allows. The LLM is asked for the new
+content only.
+
+Sessions are kept in memory with LRU eviction and expire after SESSION_TTL
+seconds of inactivity. With SESSION_DB_PATH they are also written to SQLite,
+so they survive agent restarts. Writes are batched and applied by a background
+thread every FLUSH_INTERVAL seconds, which also purges expired sessions from
+the file, and sessions missing from memory are read from it in a worker thread,
+so a message handler never waits for the disk.
+"""
+
+# A turn: {"request": {...}, "follow_up": str or None, "output": str, "summary": str, "at": float}
+Turn = dict
+
+# Longest summary kept per turn, in characters
+SUMMARY_CHARS = 600
+
+# Seconds between batched writes to the SQLite file, and between purges of expired sessions from it
+FLUSH_INTERVAL = 1.0
+PURGE_INTERVAL = 60.0
+
+
+class FollowUpRequest(BaseModel):
+  service: str
+  request: str
+  history: str
+  latest: str
+  follow_up: str
+
+
+class SessionStore:
+  """
+  Recent turns per (agent, sender), in memory with LRU eviction and
+  optionally on disk.
+
+  Args:
+      max_sessions (int): Sessions kept in memory.
+      max_turns (int): Turns kept per session. Older turns are dropped.
+      ttl (float): Seconds after its last turn that a session expires.
+      path (str, optional): SQLite file the sessions are written to.
+  """
+
+  def __init__(self, max_sessions: int = 1024, max_turns: int = 8, ttl: float = 3600, path: Optional[str] = None):
+    self.max_sessions = max_sessions
+    self.max_turns = max_turns
+    self.ttl = ttl
+    self.follow_ups = 0
+    self.missing = 0  # follow-ups without a session to continue
+    self.superseded = 0  # follow-ups whose session was replaced while they were answered
+    self._sessions = OrderedDict()  # key -> (updated_at, turns)
+    self._lock = threading.Lock()
+    self._db = None
+    if path:
+      self._db = sqlite3.connect(path, check_same_thread=False)
+      self._db.execute(
+          "CREATE TABLE IF NOT EXISTS sessions (key TEXT PRIMARY KEY, turns TEXT NOT NULL, updated_at REAL NOT NULL)"
+      )
+      self._db.commit()
+      self._db_lock = threading.Lock()
+      self._pending = {}  # key -> (updated_at, turns) not yet on disk
+      self._purged_at = 0.0
+      threading.Thread(target=self._run_writer, name="session-store-writer", daemon=True).start()
+      # Write the last batch on shutdown
+      atexit.register(self.flush)
+
+  async def get(self, service: str, sender: str) -> List[Turn]:
+    """
+    Return the live turns of a sender's session with an agent, oldest first.
+    """
+    key = f"{service}:{sender}"
+    now = time.time()
+    with self._lock:
+      entry = self._memory_get(key)
+    if entry is None and self._db is not None:
+      row = await asyncio.to_thread(self._db_read, key)
+      if row is not None:
+        with self._lock:
+          # A turn saved while the file was read is newer
+          entry = self._memory_get(key) or (row[0], json.loads(row[1]))
+          self._insert(key, entry)
+    if entry is None or entry[0] + self.ttl < now:
+      return []
+    return list(entry[1])
+
+  def start(self, service: str, sender: str, turn: Turn) -> None:
+    """
+    Begin a new session with a sender, replacing any previous one.
+    """
+    self._save(f"{service}:{sender}", [turn])
+
+  async def append(self, service: str, sender: str, turn: Turn, after: Optional[Turn] = None) -> bool:
+    """
+    Add a follow-up turn to a sender's session.
+
+    Args:
+        after (Turn, optional): The turn the follow-up was answered from. If
+            the session no longer holds it, e.g. because a full request started
+            a new session while the follow-up was answered, nothing is added.
+
+    Returns:
+        bool: Whether the turn was added.
+    """
+    turns = await self.get(service, sender)
+    if after is not None and after not in turns:
+      self.superseded += 1
+      return False
+    self._save(f"{service}:{sender}", (turns + [turn])[-self.max_turns:])
+    return True
+
+  def stats(self) -> dict:
+    """
+    Return the number of sessions in memory and follow-up counters.
+    """
+    with self._lock:
+      return {
+          "sessions": len(self._sessions),
+          "turns": sum(len(turns) for _, turns in self._sessions.values()),
+          "follow_ups": self.follow_ups,
+          "follow_ups_without_session": self.missing,
+          "follow_ups_superseded": self.superseded,
+      }
+
+  def flush(self) -> None:
+    """
+    Write pending sessions to the SQLite file now, and purge expired ones from
+    it every PURGE_INTERVAL seconds.
+    """
+    if self._db is None:
+      return
+    with self._lock:
+      pending, self._pending = self._pending, {}
+    now = time.time()
+    with self._db_lock:
+      self._db.executemany("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                           [(key, json.dumps(turns), updated_at) for key, (updated_at, turns) in pending.items()])
+      if now - self._purged_at >= PURGE_INTERVAL:
+        self._db.execute("DELETE FROM sessions WHERE updated_at < ?", (now - self.ttl,))
+        self._purged_at = now
+      self._db.commit()
+
+  def _save(self, key: str, turns: List[Turn]) -> None:
+    now = time.time()
+    with self._lock:
+      self._insert(key, (now, turns))
+      if self._db is not None:
+        self._pending[key] = (now, turns)
+
+  def _memory_get(self, key: str) -> Optional[Tuple[float, List[Turn]]]:
+    # A session evicted from memory may still be waiting to be written
+    entry = self._sessions.get(key)
+    if entry is not None:
+      self._sessions.move_to_end(key)
+      return entry
+    return self._pending.get(key) if self._db is not None else None
+
+  def _db_read(self, key: str) -> Optional[tuple]:
+    # Run in a worker thread: it waits for the writer to finish a batch
+    with self._db_lock:
+      return self._db.execute("SELECT updated_at, turns FROM sessions WHERE key = ?", (key,)).fetchone()
+
+  def _run_writer(self) -> None:
+    while True:
+      time.sleep(FLUSH_INTERVAL)
+      self.flush()
+
+  def _insert(self, key: str, entry: Tuple[float, List[Turn]]) -> None:
+    self._sessions[key] = entry
+    self._sessions.move_to_end(key)
+    while len(self._sessions) > self.max_sessions:
+      self._sessions.popitem(last=False)
+
+
+_session_store = None
+
+
+def get_session_store() -> SessionStore:
+  """
+  Return the process-wide session store, configured from the environment on first use.
+  """
+  global _session_store
+  if _session_store is None:
+    _session_store = SessionStore(
+        max_sessions=int(os.getenv("SESSION_MAX_SESSIONS", "1024")),
+        max_turns=int(os.getenv("SESSION_MAX_TURNS", "8")),
+        ttl=float(os.getenv("SESSION_TTL", "3600")),
+        path=os.getenv("SESSION_DB_PATH") or None,
+    )
+  return _session_store
+
+
+def summarize(completion: Completion) -> str:
+  """
+  Compact summary of a response for the context of later follow-ups: its
+  questions or section headings if it was parsed, else its opening text.
+  """
+  structured = completion.structured or {}
+  if structured.get("questions"):
+    summary = "Questions " + "; ".join(f"{question['number']}. {question['question'][:80]}"
+                                       for question in structured["questions"])
+  elif any(section["heading"] for section in structured.get("sections", ())):
+    summary = "Sections: " + "; ".join(section["heading"] for section in structured["sections"] if section["heading"])
+  else:
+    summary = " ".join(completion.text.split())
+  return summary[:SUMMARY_CHARS]
+
+
+def _turn(request: dict, follow_up: Optional[str], completion: Completion) -> Turn:
+  return {"request": request, "follow_up": follow_up, "output": completion.text,
+          "summary": summarize(completion), "at": time.time()}
+
+
+def record_turn(template: PromptTemplate, sender: str, request: BaseModel, completion: Completion) -> None:
+  """
+  Start a sender's session with an agent from a full request and its response.
+  """
+  fields = {attribute: getattr(request, attribute) for attribute in template.fields}
+  get_session_store().start(template.name, sender, _turn(fields, None, completion))
+
+
+def context_window(turns: List[Turn], budget: int) -> Tuple[str, str]:
+  """
+  Return the summary of earlier turns and the latest response to send with a
+  follow-up, together within about `budget` tokens.
+  """
+  latest = turns[-1]["output"]
+  earlier = turns[:-1]
+  # The latest response gets up to two thirds of the budget, cut at a line end
+  latest_budget = budget * 2 // 3
+  if estimate_tokens(latest) > latest_budget:
+    cut = latest[:latest_budget * 4]
+    latest = cut[:cut.rfind("\n")] if "\n" in cut else cut
+    latest += "\n[...]"
+    # Its summary still lists what was cut off
+    earlier = turns
+
+  remaining = budget - estimate_tokens(latest)
+  history = []
+  for turn in reversed(earlier):
+    line = f"- {turn['follow_up'] or 'Original request'}: {turn['summary']}"
+    if estimate_tokens(line) > remaining:
+      break
+    history.append(line)
+    remaining -= estimate_tokens(line)
+  return "\n".join(reversed(history)) or "NA", latest
+
+
+async def get_follow_up_completion(template: PromptTemplate, sender: str, follow_up: str,
+                                   priority: int = 0) -> Optional[Completion]:
+  """
+  Answer a follow-up from a sender's session with an agent, and add it to the
+  session. Returns None if the sender has no live session with the agent.
+
+  Args:
+      template (PromptTemplate): Template of the agent's full requests, e.g. NOTES_PROMPT.
+      sender (str): Address of the sender.
+      follow_up (str): The follow-up, e.g. "Now give me 10 more questions".
+      priority (int, optional): Admission priority class for the LLM call.
+
+  Raises:
+      AdmissionRejected: As get_llm_completion.
+  """
+  store = get_session_store()
+  turns = await store.get(template.name, sender)
+  if not turns:
+    store.missing += 1
+    return None
+  store.follow_ups += 1
+
+  request_fields = turns[-1]["request"]
+  history, latest = context_window(turns, int(os.getenv("SESSION_CONTEXT_TOKENS", "1500")))
+  request = FollowUpRequest(
+      service=template.name,
+      request="; ".join(f"{name}: {value}" for name, value in request_fields.items()),
+      history=history,
+      latest=latest,
+      follow_up=follow_up,
+  )
+  completion = await get_llm_completion(FOLLOW_UP_PROMPT.render(request), cache_key=FOLLOW_UP_PROMPT.cache_key(request),
+                                        priority=priority, profile=FOLLOW_UP_PROMPT.profile(request),
+                                        parser=template.parser)
+  # A full request from the sender may have started a new session meanwhile,
+  # which this answer must not be added to
+  await store.append(template.name, sender, _turn(request_fields, follow_up, completion), after=turns[-1])
+  return completion
+
+
+async def answer_follow_up(ctx, sender: str, template: PromptTemplate, follow_up: str, endpoint: str) -> None:
+  """
+  Handle a follow-up message to an agent: apply the sender's rate limit,
+  answer it from the sender's session and reply with a UAgentResponse, or
+  with an error one if the service is busy, the LLM fails or there is no
+  session to follow up on.
+
+  Args:
+      ctx (Context): Context of the agent's message handler.
+      sender (str): Address of the sender.
+      template (PromptTemplate): Template of the agent's full requests, e.g. NOTES_PROMPT.
+      follow_up (str): The follow-up.
+      endpoint (str): Metrics label of the handler, e.g. "notes_agent_follow_up".
+  """
+  # Only the agents use this, so the server does not import ai_engine
+  from ai_engine import UAgentResponse, UAgentResponseType
+
+  if await reject_if_limited(ctx, sender):
+    return
+  ctx.logger.info(f"📩 Follow-up from {sender}: {follow_up}")
+  try:
+    # Only the follow-up and a bounded summary of the session are sent to the LLM
+    completion = await get_follow_up_completion(template, sender, follow_up, priority=PRIORITIES[template.name])
+  except Exception as e:
+    await reply_failure(ctx, sender, e)
+    return
+  if completion is None:
+    await reply_error(ctx, sender, "There is no previous request to follow up on. Please send a full request first.")
+    return
+  message = completion.text
+  ctx.logger.info(f"🔢 Token usage: {completion.usage.dict()}")
+  RESPONSE_BYTES.observe(len(message.encode("utf-8")), endpoint=endpoint)
+  with stage("response_send"):
+    await ctx.send(sender, UAgentResponse(message=message, type=UAgentResponseType.FINAL))
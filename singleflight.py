@@ -0,0 +1,57 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, TypeVar
+
+"""
+StudyMate Single-Flight
+
+Coalesces identical concurrent calls so that only one of them does the work and
+every caller receives its result. Used in front of the LLM so that a class full
+of students asking for the same notes at the same minute costs one LLM call.
+"""
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+  """
+  Deduplicates concurrent calls sharing the same key.
+
+  The shared call runs in its own task. Each caller awaits it through
+  asyncio.shield, so cancelling one caller never cancels the call for the
+  others, and an exception raised by the call is re-raised in every caller.
+  """
+
+  def __init__(self):
+    self._calls: Dict[str, asyncio.Task] = {}
+
+  def in_flight(self) -> int:
+    """
+    Return the number of distinct calls currently running.
+    """
+    return len(self._calls)
+
+  async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+    """
+    Run fn() unless a call with the same key is already running, and return
+    the result of whichever call is in flight.
+
+    Args:
+        key (str): Identifies identical calls.
+        fn (Callable): Coroutine factory performing the call.
+
+    Returns:
+        The result of the shared call.
+    """
+    task = self._calls.get(key)
+    if task is None:
+      task = asyncio.ensure_future(fn())
+      self._calls[key] = task
+      task.add_done_callback(lambda done: self._forget(key, done))
+    return await asyncio.shield(task)
+
+  def _forget(self, key: str, task: asyncio.Task) -> None:
+    if self._calls.get(key) is task:
+      del self._calls[key]
+    # Mark the exception as retrieved in case every caller was cancelled
+    if not task.cancelled():
+      task.exception()
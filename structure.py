@@ -0,0 +1,173 @@
+import re
+from typing import List, Optional
+
+"""
+StudyMate Structured Output
+
+Parses the Markdown-style text the LLM returns into a structure clients can
+use directly: sections with bullets and paragraphs for notes and career
+guidance, and a numbered question list (with options and answers where
+present) for practice questions. Responses are parsed once, when they are
+generated, and cached together with their text.
+"""
+
+_HEADING = re.compile(r"^\s*(?:(?P<hashes>#{1,6})\s+(?P<hashed>.+?)\s*#*|[*_]{2}(?P<bold>[^*_]+?)[*_]{2}:?)\s*$")
+_BULLET = re.compile(r"^(?P<indent>\s*)(?:[-*+•]|\d+[.)])\s+(?P<text>.+?)\s*$")
+
+_QUESTION = re.compile(
+    r"^\s*[*_#]*\s*(?:q(?:uestion)?\s*\.?\s*)?(?P<number>\d+)\s*[.):]\s*[*_]*\s*(?P<text>.*?)\s*[*_]*\s*$", re.I)
+_ANSWER = re.compile(
+    r"^\s*[*_]*\s*(?:(?:answer|ans)\b\.?(?:\s*\d+)?|a(?=\s*:))\s*[*_]*\s*[:\-–]?\s*[*_]*\s*(?P<text>.*?)\s*$", re.I)
+_OPTION = re.compile(r"^\s*\(?(?P<label>[a-dA-D])[.)]\s+(?P<text>.+?)\s*$")
+_NUMBERED_ANSWER = re.compile(
+    r"^\s*[*_]*\s*(?:(?:answer|ans)\b\.?\s*)?(?P<number>\d+)\s*[*_]*\s*[.):\-–]\s*[*_]*\s*(?P<text>.*?)\s*$", re.I)
+
+
+def _strip_emphasis(text: str) -> str:
+  return text.strip().strip("*_").strip()
+
+
+def parse_sections(text: str) -> dict:
+  """
+  Split notes into sections by their headings (Markdown '#' headings or lines
+  that are entirely bold). Each section has a heading (None for text before
+  the first heading), a heading level, bullets and paragraphs. A bullet is
+  {"text": ...} with its nested bullets, if any, under "bullets".
+  """
+  sections = []
+  section = None
+  paragraph: List[str] = []
+  stack = []  # (indent, bullet) of the open bullets, outermost first
+
+  def new_section(heading: Optional[str], level: int) -> dict:
+    created = {"heading": heading, "level": level, "bullets": [], "paragraphs": []}
+    sections.append(created)
+    return created
+
+  def flush_paragraph():
+    if paragraph:
+      (section or new_section(None, 0))["paragraphs"].append(" ".join(paragraph))
+      paragraph.clear()
+
+  for line in text.splitlines():
+    if not line.strip():
+      flush_paragraph()
+      continue
+
+    heading = _HEADING.match(line)
+    if heading:
+      flush_paragraph()
+      stack.clear()
+      level = len(heading.group("hashes")) if heading.group("hashes") else 0
+      section = new_section(_strip_emphasis(heading.group("hashed") or heading.group("bold")).rstrip(":"), level)
+      continue
+
+    bullet = _BULLET.match(line)
+    if bullet:
+      flush_paragraph()
+      section = section or new_section(None, 0)
+      indent = len(bullet.group("indent").expandtabs(4))
+      item = {"text": bullet.group("text")}
+      while stack and stack[-1][0] >= indent:
+        stack.pop()
+      if stack:
+        stack[-1][1].setdefault("bullets", []).append(item)
+      else:
+        section["bullets"].append(item)
+      stack.append((indent, item))
+      continue
+
+    if stack and line[:1].isspace():
+      # Continuation of a wrapped bullet
+      stack[-1][1]["text"] += " " + line.strip()
+      continue
+    stack.clear()
+    paragraph.append(line.strip())
+
+  flush_paragraph()
+  return {"sections": sections}
+
+
+def parse_questions(text: str) -> dict:
+  """
+  Extract numbered practice questions. Each question has its number, text,
+  multiple-choice options if it has any, and its answer or None. Numbered
+  lines inside an answer are kept as part of the answer unless they continue
+  the question numbering or restart it after a heading.
+  """
+  questions = []
+  current = None
+  in_answer = False
+  after_heading = False
+
+  for line in text.splitlines():
+    if not line.strip():
+      continue
+
+    question = _QUESTION.match(line)
+    if question and question.group("text"):
+      number = int(question.group("number"))
+      if current is None or number == current["number"] + 1 or (number == 1 and after_heading):
+        current = {"number": number, "question": _strip_emphasis(question.group("text"))}
+        questions.append(current)
+        in_answer = after_heading = False
+        continue
+
+    if _HEADING.match(line):
+      after_heading = True
+      continue
+    if current is None:
+      continue
+
+    answer = _ANSWER.match(line)
+    if answer:
+      current["answer"] = _strip_emphasis(answer.group("text"))
+      in_answer = True
+      continue
+
+    option = _OPTION.match(line)
+    if option and not in_answer:
+      current.setdefault("options", []).append(f"{option.group('label')}) {option.group('text')}")
+      continue
+
+    if in_answer:
+      current["answer"] = (current["answer"] + "\n" + line.strip()).strip()
+    else:
+      current["question"] += " " + _strip_emphasis(line)
+
+  for question in questions:
+    question.setdefault("answer", None)
+  return {"questions": questions}
+
+
+def parse_answers(text: str) -> dict:
+  """
+  Extract numbered answers ("Answer 3: ..." or "3. ...") from a response that
+  answers a given list of questions. Lines that are not numbered continue the
+  previous answer.
+  """
+  answers = []
+  for line in text.splitlines():
+    if not line.strip():
+      continue
+    numbered = _NUMBERED_ANSWER.match(line)
+    if numbered and numbered.group("text"):
+      answers.append({"number": int(numbered.group("number")), "answer": _strip_emphasis(numbered.group("text"))})
+    elif answers:
+      answers[-1]["answer"] += "\n" + line.strip()
+  return {"answers": answers}
+
+
+def format_questions(structured: dict, with_answers: bool = True) -> str:
+  """
+  Write a parsed question list back out as text, with or without its answers.
+  parse_questions reads the result back into the same structure.
+  """
+  blocks = []
+  for question in structured["questions"]:
+    lines = [f"{question['number']}. {question['question']}"]
+    lines.extend(f"   {option}" for option in question.get("options", ()))
+    if with_answers and question.get("answer"):
+      lines.append("   Answer: " + question["answer"].replace("\n", "\n   "))
+    blocks.append("\n".join(lines))
+  return "\n\n".join(blocks)
@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Read by server.py when it is imported, before any fixture runs
+os.environ["JOBS_DB_PATH"] = ":memory:"
+
+import admission  # noqa: E402
+import backends  # noqa: E402
+import cache  # noqa: E402
+import hedging  # noqa: E402
+import resilience  # noqa: E402
+import semantic_cache  # noqa: E402
+import utils  # noqa: E402
+from singleflight import SingleFlight  # noqa: E402
+
+"""
+Tests run offline on the fake LLM backend, with every process-wide component
+rebuilt from a clean environment for each test.
+"""
+
+
+@pytest.fixture(autouse=True)
+def offline(monkeypatch):
+  monkeypatch.setenv("LLM_BACKEND", "fake")
+  monkeypatch.setenv("FAKE_LLM_TOKENS_PER_SECOND", "0")
+  for name in ("RESPONSE_CACHE_PATH", "CAPTURE_PATH", "SESSION_DB_PATH", "RATE_LIMIT_DB_PATH", "WARMUP_SOURCE"):
+    monkeypatch.setenv(name, "")
+  monkeypatch.setenv("LLM_HEDGE_BUDGET", "0")
+  backends.set_backend(None)
+  monkeypatch.setattr(cache, "_response_cache", None)
+  monkeypatch.setattr(semantic_cache, "_semantic_cache", None)
+  monkeypatch.setattr(admission, "_admission_controller", None)
+  monkeypatch.setattr(resilience, "_retry_policy", None)
+  monkeypatch.setattr(hedging, "_hedger", None)
+  monkeypatch.setattr(utils, "_inflight", SingleFlight())
+  yield
+  backends.set_backend(None)
+
+
+@pytest.fixture
+def fake_backend():
+  """
+  Install a fake backend with a fixed 0.2 second latency and return it.
+  """
+  backend = backends.FakeBackend(latency=0.2, tokens_per_second=0, seed=0)
+  backends.set_backend(backend)
+  return backend
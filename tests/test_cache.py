@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+from cache import ResponseCache
+
+
+def get(cache: ResponseCache, key: str):
+  return asyncio.run(cache.get(key))
+
+
+def contains(cache: ResponseCache, key: str) -> bool:
+  return asyncio.run(cache.contains(key))
+
+
+def test_disk_writes_are_batched_until_flush(tmp_path):
+  path = str(tmp_path / "cache.db")
+  cache = ResponseCache(path=path)
+  cache.set("a", "response a")
+  # Served from the pending batch before it reaches the disk
+  assert get(cache, "a") == "response a"
+  assert get(ResponseCache(path=path), "a") is None
+
+  cache.flush()
+  assert get(ResponseCache(path=path), "a") == "response a"
+
+
+def test_memory_hits_keep_disk_entries_recently_used(tmp_path):
+  path = str(tmp_path / "cache.db")
+  cache = ResponseCache(max_entries=2, path=path)
+  cache.set("a", "response a")
+  cache.set("b", "response b")
+  cache.flush()
+  time.sleep(0.01)
+  # A memory hit must count as a use on disk too
+  assert get(cache, "a") == "response a"
+  cache.set("c", "response c")
+  cache.flush()
+
+  reopened = ResponseCache(max_entries=2, path=path)
+  assert contains(reopened, "a")
+  assert not contains(reopened, "b")
+  assert contains(reopened, "c")
+  assert cache.stats()["evictions"] >= 1
+
+
+def test_byte_budget_evicts_on_disk(tmp_path):
+  path = str(tmp_path / "cache.db")
+  cache = ResponseCache(max_bytes=25, path=path)
+  for key in ("a", "b", "c"):
+    cache.set(key, "x" * 10)
+    cache.flush()
+    time.sleep(0.01)
+
+  reopened = ResponseCache(max_bytes=25, path=path)
+  assert not contains(reopened, "a")
+  assert contains(reopened, "b") and contains(reopened, "c")
+
+
+def test_disk_reads_do_not_block_the_event_loop(tmp_path):
+  path = str(tmp_path / "cache.db")
+  writer = ResponseCache(path=path)
+  writer.set("a", "response a")
+  writer.flush()
+  cache = ResponseCache(path=path)
+  cache.set("b", "response b")
+
+  async def run():
+    # The writer thread holds the disk for a whole batch and its commit
+    cache._db_lock.acquire()
+    loop = asyncio.get_running_loop()
+    loop.call_later(0.2, cache._db_lock.release)
+    started = time.monotonic()
+    pending = await cache.get("b")
+    ticks = 0
+    disk = asyncio.ensure_future(cache.get("a"))
+    while not disk.done():
+      ticks += 1
+      await asyncio.sleep(0.01)
+    return pending, time.monotonic() - started, ticks, disk.result()
+
+  pending, elapsed, ticks, value = asyncio.run(run())
+  assert pending == "response b"
+  assert value == "response a"
+  # The loop kept running while the read waited for the disk
+  assert elapsed >= 0.2 and ticks >= 10
+  assert get(cache, "a") == "response a"
+  assert cache.stats()["hits"] == 3
@@ -0,0 +1,35 @@
+import asyncio
+import json
+import types
+
+import capture
+from capture import LONG_TEXT, CaptureLog, capture_messages, read_capture
+
+
+def test_queue_is_bounded_by_body_bytes(tmp_path):
+  path = str(tmp_path / "capture.jsonl")
+  log = CaptureLog(path, queue_bytes=10000)
+  chapter = json.dumps({"topic": "Optics", "reference_material": "x" * 20000}).encode("utf-8")
+  log.record({"endpoint": "/notes"}, chapter)
+  log.record({"endpoint": "/notes"}, json.dumps({"topic": "Optics", "reference_material": "y" * 5000}).encode("utf-8"))
+  log.flush()
+  assert log.stats()["dropped"] == 1
+  assert log.stats()["written"] == 1
+  assert log.stats()["queued_bytes"] == 0
+  records = list(read_capture(path))
+  assert records[0]["request"]["reference_material"] == {"$filler": 5000}
+
+
+def test_agent_messages_are_compacted_before_queueing(tmp_path, monkeypatch):
+  log = CaptureLog(str(tmp_path / "capture.jsonl"))
+  queued = []
+  monkeypatch.setattr(log, "record", lambda record, body=None, json_body=True: queued.append(record))
+  monkeypatch.setattr(capture, "_capture_log", log)
+
+  @capture_messages("notes_agent", "notes")
+  async def handler(ctx, sender, msg):
+    pass
+
+  msg = types.SimpleNamespace(dict=lambda: {"topic": "Optics", "reference_material": "z" * (LONG_TEXT + 1)})
+  asyncio.run(handler(object(), "alice", msg))
+  assert queued[0]["request"] == {"topic": "Optics", "reference_material": {"$filler": LONG_TEXT + 1}}
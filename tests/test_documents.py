@@ -0,0 +1,49 @@
+from fastapi.testclient import TestClient
+
+import ratelimit
+import server
+from documents import split_chunks
+from ratelimit import RateLimiter
+
+
+def document(paragraphs: int) -> str:
+  return "\n".join(f"Paragraph {index}. " + "The Calvin cycle fixes carbon dioxide. " * 10 for index in range(paragraphs))
+
+
+def notes(reference_material: str) -> dict:
+  return {"topic": "Photosynthesis", "notes_style": "Short", "reference_material": reference_material,
+          "additional_requirements": "NA"}
+
+
+def small_documents(monkeypatch) -> None:
+  monkeypatch.setenv("DOCUMENT_MIN_TOKENS", "50")
+  monkeypatch.setenv("DOCUMENT_CHUNK_TOKENS", "100")
+
+
+def test_oversized_reference_material_is_rejected_everywhere(fake_backend, monkeypatch):
+  small_documents(monkeypatch)
+  monkeypatch.setenv("DOCUMENT_MAX_BYTES", "1000")
+  with TestClient(server.app) as client:
+    assert client.post("/notes", json=notes(document(5))).status_code == 413
+    assert client.post("/jobs", json={"type": "notes", "request": notes(document(5))}).status_code == 413
+    lines = client.post("/batch", json={"items": [{"type": "notes", "request": notes(document(5))}]}).text
+  assert '"status": 413' in lines
+  assert fake_backend.calls == 0
+
+
+def test_documents_are_charged_per_chunk(fake_backend, monkeypatch):
+  small_documents(monkeypatch)
+  text = document(5)
+  chunks = len(split_chunks(text))
+  assert chunks > 2
+  limiter = RateLimiter(daily_requests=chunks - 1)
+  monkeypatch.setattr(ratelimit, "_rate_limiter", limiter)
+
+  with TestClient(server.app) as client:
+    response = client.post("/notes", json=notes(text))
+    assert response.status_code == 429
+    assert fake_backend.calls == 0
+    limiter.daily_requests = 1 + chunks
+    assert client.post("/notes", json=notes(text)).status_code == 200
+  # One request rejected before any chunk was generated, then one per chunk
+  assert limiter.usage("ip:testclient")["requests"] == 1 + chunks
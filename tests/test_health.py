@@ -0,0 +1,72 @@
+import asyncio
+import urllib.error
+import urllib.request
+
+import pytest
+
+from launcher import ReplicaRouter
+from metrics import Heartbeat, start_http_exporter
+
+
+def healthz(server):
+  url = f"http://127.0.0.1:{server.server_address[1]}/healthz"
+  try:
+    with urllib.request.urlopen(url, timeout=5) as response:
+      return response.status
+  except urllib.error.HTTPError as e:
+    return e.code
+
+
+@pytest.fixture
+def exporter():
+  servers = []
+
+  def start(heartbeat):
+    server = start_http_exporter(0, host="127.0.0.1", heartbeat=heartbeat)
+    servers.append(server)
+    return server
+
+  yield start
+  for server in servers:
+    server.shutdown()
+    server.server_close()
+
+
+def test_healthz_follows_the_heartbeat(exporter):
+  heartbeat = Heartbeat(stale_after=60)
+  server = exporter(heartbeat)
+  # No beat yet: the agent loop has not started
+  assert healthz(server) == 503
+  heartbeat.beat()
+  assert healthz(server) == 200
+  # A hung loop stops beating while the exporter thread keeps answering
+  heartbeat.last_beat -= 61
+  assert healthz(server) == 503
+
+
+def test_healthz_without_heartbeat_reports_liveness(exporter):
+  assert healthz(exporter(None)) == 200
+
+
+def test_heartbeat_beats_from_an_agent_interval_handler():
+  registered = {}
+
+  class Agent:
+    def on_interval(self, period):
+      def register(handler):
+        registered[period] = handler
+        return handler
+      return register
+
+  heartbeat = Heartbeat(interval=3)
+  heartbeat.watch(Agent())
+  assert list(registered) == [3]
+  asyncio.run(registered[3](None))
+  assert heartbeat.healthy()
+
+
+def test_replica_router_keeps_a_sender_on_one_replica():
+  router = ReplicaRouter([f"agent{index}" for index in range(3)])
+  senders = [f"sender{index}" for index in range(30)]
+  assert all(router.address_for(sender) == router.address_for(sender) for sender in senders)
+  assert len({router.address_for(sender) for sender in senders}) == 3
@@ -0,0 +1,61 @@
+import asyncio
+
+from admission import AdmissionController, set_admission_controller
+from backends import FakeBackend, set_backend
+from hedging import Hedger, set_hedger
+from utils import get_llm_completion
+
+
+class ConcurrencyBackend(FakeBackend):
+  """
+  Fake backend recording the most calls it served at once.
+  """
+
+  def __init__(self, **kwargs):
+    super().__init__(**kwargs)
+    self.active = 0
+    self.peak = 0
+
+  async def generate(self, *args, **kwargs):
+    self.active += 1
+    self.peak = max(self.peak, self.active)
+    try:
+      return await super().generate(*args, **kwargs)
+    finally:
+      self.active -= 1
+
+
+def setup(max_concurrency: int):
+  backend = ConcurrencyBackend(latency=0.01, latency_sigma=1.0, tokens_per_second=0, seed=0)
+  set_backend(backend)
+  controller = AdmissionController(max_concurrency=max_concurrency, max_queue=1000)
+  set_admission_controller(controller)
+  hedger = Hedger(percentile=50, budget=1, burst=100, min_samples=5)
+  set_hedger(hedger)
+  return backend, controller, hedger
+
+
+async def sequential(count: int, offset: int = 0) -> None:
+  for index in range(count):
+    await get_llm_completion(f"Hedged prompt {offset + index}")
+
+
+def test_hedges_use_free_slots():
+  backend, controller, hedger = setup(max_concurrency=2)
+  asyncio.run(sequential(60))
+  assert hedger.hedged > 0
+  assert backend.peak == 2
+  assert controller.in_flight == 0
+
+
+def test_hedges_never_exceed_the_concurrency_limit():
+  backend, controller, hedger = setup(max_concurrency=4)
+
+  async def burst():
+    await sequential(20)
+    await asyncio.gather(*(get_llm_completion(f"Burst prompt {index}") for index in range(100)))
+
+  asyncio.run(burst())
+  assert backend.peak <= 4
+  assert hedger.no_slot > 0
+  assert controller.in_flight == 0
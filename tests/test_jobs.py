@@ -0,0 +1,50 @@
+import time
+
+from jobs import DONE, QUEUED, RUNNING, JobStore
+
+
+def test_finished_jobs_expire_and_generate_again():
+  store = JobStore(":memory:", ttl=60)
+  store.submit("job", "notes", {"topic": "Photosynthesis"})
+  job = store.claim()
+  store.complete(job["id"], "Notes")
+  assert store.get("job")["status"] == DONE
+
+  # Age the result past its TTL
+  store._jobs["job"]["updated_at"] -= 61
+  assert store.get("job") is None
+  assert store.counts()[DONE] == 0
+  job = store.submit("job", "notes", {"topic": "Photosynthesis"})
+  assert job["status"] == QUEUED
+  assert job["result"] is None
+
+
+def test_state_changes_are_written_in_batches(tmp_path):
+  path = str(tmp_path / "jobs.db")
+  store = JobStore(path, ttl=60)
+  store.submit("done", "notes", {"topic": "Photosynthesis"})
+  store.submit("running", "notes", {"topic": "Respiration"})
+  store.complete(store.claim()["id"], "Notes")
+  store.claim()
+  store.flush()
+  restarted = JobStore(path, ttl=60)
+  assert restarted.get("done")["result"] == "Notes"
+  # Interrupted jobs are queued again
+  assert restarted.get("running")["status"] == QUEUED
+  assert restarted.get("running")["request"] == {"topic": "Respiration"}
+  assert restarted.counts()[RUNNING] == 0
+
+
+def test_expired_jobs_are_purged_from_disk(tmp_path):
+  path = str(tmp_path / "jobs.db")
+  store = JobStore(path, ttl=60)
+  store.submit("job", "notes", {"topic": "Photosynthesis"})
+  store.complete(store.claim()["id"], "Notes")
+  store._jobs["job"]["updated_at"] = time.time() - 61
+  store._changed(store._jobs["job"])
+  store.flush()
+
+  assert JobStore(path, ttl=60).get("job") is None
+  store._purged_at = 0
+  store.flush()
+  assert store._db.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] == 0
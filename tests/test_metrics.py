@@ -0,0 +1,18 @@
+from fastapi.testclient import TestClient
+
+import server
+from metrics import REQUESTS
+
+
+def test_request_labels_are_route_paths():
+  body = {"topic": "Photosynthesis", "notes_style": "Short", "reference_material": "NA",
+          "additional_requirements": "NA"}
+  with TestClient(server.app) as client:
+    assert client.post("/notes", json=body).status_code == 200
+    for index in range(5):
+      assert client.post(f"/no-such-endpoint/{index}", json={}).status_code == 404
+
+  endpoints = {key[0] for key in REQUESTS._values}
+  assert "notes" in endpoints
+  assert "other" in endpoints
+  assert not any(endpoint.startswith("no-such-endpoint") for endpoint in endpoints)
@@ -0,0 +1,47 @@
+import asyncio
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+
+import server
+from backends import FakeBackend, set_backend
+from models import NotesRequest
+from profiles import DEFAULT_PROFILE, PROFILES, get_profile
+from prompts import NOTES_PROMPT
+
+
+def notes(style: str) -> dict:
+  return {"topic": "Photosynthesis", "notes_style": style, "reference_material": "NA",
+          "additional_requirements": "NA"}
+
+
+def test_notes_styles_have_their_own_budgets():
+  short, revision, detailed = (get_profile("notes", NotesRequest(**notes(style)))
+                               for style in ("Short", "Last-minute revision", "Detailed"))
+  assert short.max_output_tokens < revision.max_output_tokens < detailed.max_output_tokens
+  # The agents spell the revision style differently from the server
+  assert get_profile("notes", SimpleNamespace(notes_style="Last Minute Revision")) is revision
+  assert get_profile("questions") is PROFILES["questions"]
+  assert get_profile("unknown") is DEFAULT_PROFILE
+
+
+def test_fake_backend_stops_at_the_output_budget():
+  backend = FakeBackend(latency=0, tokens_per_second=0, response_tokens=1000)
+  short = NOTES_PROMPT.profile(NotesRequest(**notes("Short")))
+  completion = asyncio.run(backend.generate("prompt", short))
+  assert completion.usage.output_tokens == short.max_output_tokens
+  assert completion.usage.finish_reason == "length"
+  assert completion.usage.truncated
+  completion = asyncio.run(backend.generate("prompt", DEFAULT_PROFILE))
+  assert completion.usage.output_tokens == 1000
+  assert completion.usage.finish_reason == "stop"
+
+
+def test_responses_report_token_usage():
+  set_backend(FakeBackend(latency=0, tokens_per_second=0, response_tokens=1000))
+  with TestClient(server.app) as client:
+    short = client.post("/notes", json=notes("Short")).json()["usage"]
+    detailed = client.post("/notes", json=notes("Detailed")).json()["usage"]
+  assert short["output_tokens"] == 512 and short["finish_reason"] == "length"
+  assert detailed["output_tokens"] == 1000 and detailed["finish_reason"] == "stop"
+  assert short["prompt_tokens"] > 0
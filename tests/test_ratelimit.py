@@ -0,0 +1,44 @@
+import sqlite3
+
+import pytest
+
+from ratelimit import RateLimited, RateLimiter
+
+
+def usage_on_disk(path: str) -> dict:
+  with sqlite3.connect(path) as db:
+    return {client: (requests, tokens) for client, requests, tokens in
+            db.execute("SELECT client, requests, tokens FROM usage")}
+
+
+def test_usage_is_written_in_batches(tmp_path):
+  path = str(tmp_path / "usage.db")
+  limiter = RateLimiter(daily_requests=100, path=path)
+  for _ in range(5):
+    limiter.acquire("alice")
+  limiter.record_tokens("alice", 300)
+  # Nothing is committed on the request path
+  assert usage_on_disk(path) == {}
+  limiter.flush()
+  assert usage_on_disk(path) == {"alice": (5, 300)}
+  limiter.acquire("alice")
+  limiter.flush()
+  assert usage_on_disk(path) == {"alice": (6, 300)}
+
+
+def test_quotas_survive_restarts_and_eviction(tmp_path):
+  path = str(tmp_path / "usage.db")
+  limiter = RateLimiter(daily_requests=3, path=path, max_clients=1)
+  limiter.acquire("alice")
+  limiter.acquire("alice")
+  # Dropping alice from memory before her usage is written must not reset it
+  limiter.acquire("bob")
+  limiter.acquire("alice")
+  with pytest.raises(RateLimited):
+    limiter.acquire("alice")
+  limiter.flush()
+
+  restarted = RateLimiter(daily_requests=3, path=path)
+  assert restarted.usage("alice")["requests"] == 3
+  with pytest.raises(RateLimited):
+    restarted.acquire("alice")
@@ -0,0 +1,11 @@
+from benchmarks.replay import expand, replayable
+from models import NotesRequest
+
+
+def test_agent_notes_styles_are_replayed_as_the_endpoint_spells_them():
+  record = {"source": "agent", "endpoint": "notes_agent", "type": "notes", "at": 0.0,
+            "request": {"topic": "Photosynthesis", "notes_style": "Last Minute Revision",
+                        "reference_material": {"$filler": 20}, "additional_requirements": "NA"}}
+  replayed = replayable(record)
+  assert replayed["endpoint"] == "/notes"
+  assert NotesRequest(**expand(replayed["request"])).notes_style == "Last-minute revision"
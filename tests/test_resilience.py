@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, set_admission_controller
+from backends import FakeBackend, FakeUpstreamError, set_backend
+from resilience import CircuitBreaker, CircuitOpenError, RetryPolicy, set_retry_policy
+from utils import get_llm_completion
+
+
+async def no_sleep(delay: float) -> None:
+  pass
+
+
+def test_transient_failures_are_retried():
+  backend = FakeBackend(latency=0.001, tokens_per_second=0, failure_rate=0.5, seed=1)
+  set_backend(backend)
+  policy = RetryPolicy(attempts=10, sleep=no_sleep)
+  set_retry_policy(policy)
+
+  completion = asyncio.run(get_llm_completion("prompt"))
+  assert completion.text
+  assert policy.retries == backend.calls - 1 > 0
+
+
+def test_breaker_fails_fast_after_repeated_failures():
+  backend = FakeBackend(latency=0.001, tokens_per_second=0, failure_rate=1.0, seed=1)
+  set_backend(backend)
+  set_retry_policy(RetryPolicy(attempts=1, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60)))
+
+  for index in range(2):
+    with pytest.raises(FakeUpstreamError):
+      asyncio.run(get_llm_completion(f"prompt {index}"))
+  with pytest.raises(CircuitOpenError):
+    asyncio.run(get_llm_completion("prompt 2"))
+  assert backend.calls == 2
+
+
+def test_deadline_passing_in_the_queue_is_not_an_upstream_failure():
+  set_backend(FakeBackend(latency=0.001, tokens_per_second=0))
+  controller = AdmissionController(max_concurrency=1, queue_timeout=10)
+  set_admission_controller(controller)
+  breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+  set_retry_policy(RetryPolicy(deadline=0.1, breaker=breaker, sleep=no_sleep))
+
+  async def run():
+    async def hold_slot():
+      async with controller.admit():
+        await asyncio.sleep(0.3)
+
+    holder = asyncio.ensure_future(hold_slot())
+    await asyncio.sleep(0)
+    try:
+      await get_llm_completion("queued prompt")
+    finally:
+      await holder
+
+  with pytest.raises(AdmissionRejected) as rejected:
+    asyncio.run(run())
+  assert not isinstance(rejected.value, CircuitOpenError)
+  assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_upstream_stats_without_a_breaker():
+  from fastapi.testclient import TestClient
+
+  import server
+
+  set_retry_policy(RetryPolicy(attempts=1, breaker=None))
+  with TestClient(server.app) as client:
+    stats = client.get("/upstream-stats").json()
+  assert stats["circuit_breaker"] is None
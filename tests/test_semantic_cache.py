@@ -0,0 +1,46 @@
+from fastapi.testclient import TestClient
+
+import server
+from benchmarks.semantic_cache import NEAR_MISSES, notes_key
+from semantic_cache import SemanticCache
+
+
+def test_reworded_request_hits():
+  for stored, query in (("Photosynthesis (NCERT 12)", "ncert 12 - PHOTOSYNTHESIS"),
+                        ("photosynthesis notes NCERT 12", "Photosynthesis - class 12 NCERT")):
+    cache = SemanticCache()
+    cache.add(*notes_key({"topic": stored}), "key")
+    match = cache.search(*notes_key({"topic": query}))
+    assert match is not None and match[0] == "key", query
+
+
+def test_near_misses_never_hit():
+  # Exact fields and words alone keep these apart, even at a lower threshold
+  for threshold in (0.8, 0.95):
+    cache = SemanticCache(threshold=threshold)
+    for index, (stored, query) in enumerate(NEAR_MISSES):
+      cache.add(*notes_key(stored), f"key-{index}")
+      assert cache.search(*notes_key(query)) is None, query
+
+
+def test_semantic_cache_is_off_by_default(monkeypatch):
+  import semantic_cache
+
+  monkeypatch.delenv("SEMANTIC_CACHE_MAX_ENTRIES", raising=False)
+  assert semantic_cache.get_semantic_cache() is None
+
+
+def test_server_does_not_serve_different_requirements(fake_backend, monkeypatch):
+  monkeypatch.setenv("SEMANTIC_CACHE_MAX_ENTRIES", "4096")
+
+  def questions(topic: str, requirements: str) -> dict:
+    return {"topic": topic, "with_answers": "No", "additional_requirements": requirements}
+
+  with TestClient(server.app) as client:
+    first = client.post("/questions", json=questions("Organic chemistry (class 12)", "Give 10 questions")).json()
+    reworded = client.post("/questions", json=questions("12 organic chemistry", "give 10 QUESTIONS")).json()
+    other = client.post("/questions", json=questions("12 organic chemistry", "Give 50 questions")).json()
+  assert reworded["usage"]["cached"]
+  assert not other["usage"]["cached"]
+  assert other != first
+  assert fake_backend.calls == 2
@@ -0,0 +1,120 @@
+import asyncio
+import sys
+import types
+
+import pytest
+
+import ratelimit
+import sessions
+from admission import AdmissionRejected
+from backends import Completion, Usage
+from models import QuestionsRequest
+from prompts import QUESTIONS_PROMPT
+from replies import reply_failure
+from sessions import SessionStore, answer_follow_up, get_follow_up_completion, record_turn
+
+
+@pytest.fixture(autouse=True)
+def session_store(monkeypatch):
+  store = SessionStore()
+  monkeypatch.setattr(sessions, "_session_store", store)
+  return store
+
+
+def start_session(topic: str) -> None:
+  request = QuestionsRequest(topic=topic, with_answers="No", additional_requirements="NA")
+  record_turn(QUESTIONS_PROMPT, "alice", request, Completion(f"1. A question on {topic}?", Usage()))
+
+
+def test_follow_ups_extend_the_session(fake_backend, session_store):
+  start_session("Optics")
+
+  async def follow_ups():
+    await asyncio.gather(get_follow_up_completion(QUESTIONS_PROMPT, "alice", "Two more"),
+                         get_follow_up_completion(QUESTIONS_PROMPT, "alice", "Harder ones"))
+
+  asyncio.run(follow_ups())
+  turns = asyncio.run(session_store.get("questions", "alice"))
+  assert [turn["follow_up"] for turn in turns] == [None, "Two more", "Harder ones"]
+
+
+def test_new_request_during_follow_up_is_not_extended(fake_backend, session_store):
+  start_session("Optics")
+
+  async def interleave():
+    follow_up = asyncio.ensure_future(get_follow_up_completion(QUESTIONS_PROMPT, "alice", "Two more"))
+    await asyncio.sleep(fake_backend.latency / 2)
+    # A full request arrives while the follow-up waits for the LLM
+    start_session("Thermodynamics")
+    return await follow_up
+
+  assert asyncio.run(interleave()) is not None
+  turns = asyncio.run(session_store.get("questions", "alice"))
+  assert len(turns) == 1 and turns[0]["request"]["topic"] == "Thermodynamics"
+  assert session_store.stats()["follow_ups_superseded"] == 1
+
+
+def test_sessions_are_written_in_batches(tmp_path):
+  path = str(tmp_path / "sessions.db")
+  store = SessionStore(path=path, ttl=60)
+  store.start("questions", "alice", {"output": "1. A question?"})
+  store.start("questions", "bob", {"output": "1. Another question?"})
+  store._sessions.clear()
+  # Not written yet, but still served
+  assert asyncio.run(store.get("questions", "alice")) == [{"output": "1. A question?"}]
+
+  store.flush()
+  restarted = SessionStore(path=path, ttl=60)
+  assert asyncio.run(restarted.get("questions", "bob")) == [{"output": "1. Another question?"}]
+
+  # Expired sessions are purged from the file on the writer's interval
+  store._pending["questions:bob"] = (0.0, [])
+  store._purged_at = 0.0
+  store.flush()
+  assert store._db.execute("SELECT key FROM sessions").fetchall() == [("questions:alice",)]
+
+
+class Context:
+  def __init__(self):
+    self.sent = []
+    self.logger = types.SimpleNamespace(info=lambda message: None, error=lambda message: None)
+
+  async def send(self, destination, message):
+    self.sent.append((destination, message.type, message.message))
+
+
+@pytest.fixture
+def agent_responses(monkeypatch):
+  # The agents' reply model, without needing uagents installed
+  module = types.ModuleType("ai_engine")
+  module.UAgentResponse = lambda message, type: types.SimpleNamespace(message=message, type=type)
+  module.UAgentResponseType = types.SimpleNamespace(FINAL="final", ERROR="error")
+  monkeypatch.setitem(sys.modules, "ai_engine", module)
+
+
+def test_answer_follow_up_replies(fake_backend, agent_responses, monkeypatch):
+  ctx = Context()
+  asyncio.run(answer_follow_up(ctx, "alice", QUESTIONS_PROMPT, "Two more", endpoint="questions_agent_follow_up"))
+  assert ctx.sent == [("alice", "error", "There is no previous request to follow up on. "
+                                         "Please send a full request first.")]
+
+  start_session("Optics")
+  asyncio.run(answer_follow_up(ctx, "alice", QUESTIONS_PROMPT, "Two more", endpoint="questions_agent_follow_up"))
+  assert ctx.sent[-1][:2] == ("alice", "final")
+
+  monkeypatch.setenv("RATE_LIMIT_DAILY_REQUESTS", "2")
+  monkeypatch.setattr(ratelimit, "_rate_limiter", None)
+  for _ in range(3):
+    asyncio.run(answer_follow_up(ctx, "bob", QUESTIONS_PROMPT, "Two more", endpoint="questions_agent_follow_up"))
+  assert ctx.sent[-1][:2] == ("bob", "error")
+  assert ctx.sent[-1][2].startswith("Daily request quota exceeded")
+  assert fake_backend.calls == 1
+
+
+def test_failures_are_explained(agent_responses):
+  ctx = Context()
+  asyncio.run(reply_failure(ctx, "alice", AdmissionRejected("Queue is full", 3)))
+  asyncio.run(reply_failure(ctx, "alice", RuntimeError("upstream down")))
+  assert ctx.sent == [("alice", "error", "The service is busy (Queue is full). Please retry in 3 seconds."),
+                      ("alice", "error", "Sorry, the response could not be generated right now. "
+                                         "Please try again later.")]
@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+from admission import AdmissionController, set_admission_controller
+from singleflight import SingleFlight
+from utils import get_llm_completion
+
+
+def test_concurrent_requests_do_not_block_each_other(fake_backend):
+  # Distinct prompts run side by side: 8 calls take about one model latency, not eight
+  set_admission_controller(AdmissionController(max_concurrency=8))
+
+  async def run():
+    return await asyncio.gather(*(get_llm_completion(f"prompt {i}") for i in range(8)))
+
+  started = time.monotonic()
+  completions = asyncio.run(run())
+  elapsed = time.monotonic() - started
+
+  assert fake_backend.calls == 8
+  assert len({completion.text for completion in completions}) == 8
+  assert elapsed < 2 * fake_backend.latency
+
+
+def test_concurrency_limit_bounds_calls_in_flight(fake_backend):
+  set_admission_controller(AdmissionController(max_concurrency=2))
+
+  async def run():
+    await asyncio.gather(*(get_llm_completion(f"prompt {i}") for i in range(4)))
+
+  started = time.monotonic()
+  asyncio.run(run())
+  elapsed = time.monotonic() - started
+
+  # Two rounds of two calls
+  assert 2 * fake_backend.latency <= elapsed < 3 * fake_backend.latency
+
+
+def test_identical_requests_share_one_call(fake_backend):
+  # N concurrent identical requests on a slow model finish in about one model latency
+  async def run():
+    return await asyncio.gather(*(get_llm_completion("same prompt") for _ in range(20)))
+
+  started = time.monotonic()
+  completions = asyncio.run(run())
+  elapsed = time.monotonic() - started
+
+  assert fake_backend.calls == 1
+  assert len({completion.text for completion in completions}) == 1
+  assert fake_backend.latency <= elapsed < 2 * fake_backend.latency
+
+
+def test_identical_requests_beyond_the_concurrency_limit_share_one_call(fake_backend):
+  # Coalesced waiters do not take admission slots, so they are not queued behind each other
+  set_admission_controller(AdmissionController(max_concurrency=1, max_queue=0))
+
+  async def run():
+    return await asyncio.gather(*(get_llm_completion("same prompt") for _ in range(50)))
+
+  started = time.monotonic()
+  completions = asyncio.run(run())
+  elapsed = time.monotonic() - started
+
+  assert fake_backend.calls == 1
+  assert len(completions) == 50
+  assert elapsed < 2 * fake_backend.latency
+
+
+def test_errors_reach_every_waiter():
+  flight = SingleFlight()
+  calls = []
+
+  async def failing():
+    calls.append(1)
+    await asyncio.sleep(0.05)
+    raise RuntimeError("upstream failed")
+
+  async def run():
+    return await asyncio.gather(*(flight.do("key", failing) for _ in range(5)), return_exceptions=True)
+
+  results = asyncio.run(run())
+  assert len(calls) == 1
+  assert all(isinstance(result, RuntimeError) for result in results)
+  assert flight.in_flight() == 0
+
+
+def test_cancelling_one_waiter_keeps_the_call_for_the_others():
+  flight = SingleFlight()
+  calls = []
+
+  async def slow():
+    calls.append(1)
+    await asyncio.sleep(0.1)
+    return "done"
+
+  async def run():
+    first = asyncio.ensure_future(flight.do("key", slow))
+    second = asyncio.ensure_future(flight.do("key", slow))
+    await asyncio.sleep(0.02)
+    first.cancel()
+    return await second, first.cancelled()
+
+  result, cancelled = asyncio.run(run())
+  assert result == "done"
+  assert cancelled
+  assert len(calls) == 1
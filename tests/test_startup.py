@@ -0,0 +1,38 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ("uagents", "ai_engine", "langchain_google_genai", "notes_agent", "questions_agent",
+                 "career_guidance_agent")
+
+
+def run_python(code: str) -> dict:
+  # A fresh interpreter, as other tests may already have imported these modules
+  env = {**os.environ, "JOBS_DB_PATH": ":memory:", "BUREAU_METRICS_PORT": ""}
+  result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True,
+                          timeout=60, check=True)
+  return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_server_imports_no_agent_or_llm_client():
+  loaded = run_python(
+      "import json, sys, server\n"
+      f"print(json.dumps(sorted({{m.split('.')[0] for m in sys.modules}} & set({HEAVY_MODULES!r}))))"
+  )
+  assert loaded == []
+
+
+def test_agent_is_built_on_first_use():
+  pytest.importorskip("ai_engine")
+  state = run_python(
+      "import json, notes_agent\n"
+      "before = notes_agent._default_agent is None\n"
+      "agent = notes_agent.notes_agent\n"
+      "print(json.dumps([before, notes_agent.notes_agent is agent, notes_agent.NOTES_AGENT_ADDRESS == agent.address]))"
+  )
+  assert state == [True, True, True]
@@ -0,0 +1,67 @@
+import asyncio
+import datetime
+from typing import Literal
+
+from pydantic import BaseModel
+
+from models import REQUEST_TYPES
+from prompts import NOTES_PROMPT
+from utils import get_llm_completion
+from warmup import NOTES_STYLES, WarmupRunner, parse_window, plan
+
+
+class AgentNotesRequest(BaseModel):
+  # The fields of notes_agent.NotesAgentModel, without importing uagents
+  topic: str
+  notes_style: Literal['Short', 'Detailed', 'Last Minute Revision']
+  reference_material: str
+  additional_requirements: str
+
+
+def test_warmed_notes_serve_agent_spellings(fake_backend):
+  assert "Last-minute revision" in NOTES_STYLES
+  runner = WarmupRunner(REQUEST_TYPES, plan(["Photosynthesis"]), rate=6000)
+  asyncio.run(runner.run_once())
+  warmed = fake_backend.calls
+
+  async def ask(style: str) -> bool:
+    request = AgentNotesRequest(topic="Photosynthesis", notes_style=style, reference_material="NA",
+                                additional_requirements="NA")
+    completion = await get_llm_completion(NOTES_PROMPT.render(request), cache_key=NOTES_PROMPT.cache_key(request),
+                                          profile=NOTES_PROMPT.profile(request))
+    return completion.usage.cached
+
+  assert all(asyncio.run(ask(style)) for style in ("Short", "Detailed", "Last Minute Revision"))
+  assert fake_backend.calls == warmed
+
+
+def test_a_run_ending_after_the_window_does_not_skip_the_next_night():
+  now = datetime.datetime(2026, 3, 1, 5, 59)
+  runs = []
+
+  class Stop(Exception):
+    pass
+
+  def clock() -> datetime.datetime:
+    return now
+
+  async def sleep(seconds: float) -> None:
+    nonlocal now
+    if len(runs) == 3:
+      raise Stop
+    now += datetime.timedelta(seconds=seconds)
+
+  async def run_once() -> None:
+    # The run overruns the 06:00 end of the window
+    nonlocal now
+    runs.append(now)
+    now += datetime.timedelta(minutes=5)
+
+  runner = WarmupRunner(REQUEST_TYPES, [], window=parse_window("01:00-06:00"), clock=clock, sleep=sleep)
+  runner.run_once = run_once
+  try:
+    asyncio.run(runner.run_forever())
+  except Stop:
+    pass
+  assert runs == [datetime.datetime(2026, 3, 1, 5, 59), datetime.datetime(2026, 3, 2, 1, 0),
+                  datetime.datetime(2026, 3, 3, 1, 0)]
@@ -1,34 +1,309 @@
 import asyncio
+import hashlib
+import json
 import os
+import time
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
 
-# Load environment variables from .env file
-load_dotenv()
+from admission import AdmissionController, AdmissionRejected, get_admission_controller, set_admission_controller
+from backends import Completion, Usage, get_backend
+from cache import get_response_cache
+from hedging import get_hedger
+from metrics import PROMPT_BYTES, TOKENS, TRUNCATED, current_endpoint, stage
+from profiles import DEFAULT_PROFILE, GenerationProfile
+from ratelimit import record_client_tokens
+from resilience import get_retry_policy, is_transient
+from semantic_cache import get_semantic_cache
+from singleflight import SingleFlight
 
-# Initialize the LLM model
-llm = ChatGoogleGenerativeAI(model="gemini-pro")
+# Coalesces identical prompts that are in flight at the same time
+_inflight = SingleFlight()
 
+# Partition and free-text fields compared by the semantic cache (see PromptTemplate.similarity_key)
+SimilarityKey = Tuple[str, Dict[str, str]]
 
-async def get_llm_response(prompt: str) -> str:
+# Turns a response into its structured form (see structure.py)
+Parser = Callable[[str], dict]
+
+
+def set_llm_concurrency(limit: int) -> None:
+  """
+  Change the number of LLM requests allowed in flight per process.
+
+  Args:
+      limit (int): The new concurrency limit. Must be at least 1.
+  """
+  current = get_admission_controller()
+  set_admission_controller(AdmissionController(
+      max_concurrency=limit,
+      max_queue=current.max_queue,
+      queue_timeout=current.queue_timeout,
+  ))
+
+
+async def get_llm_response(prompt: str, cache_key: Optional[str] = None, priority: int = 0,
+                           profile: GenerationProfile = DEFAULT_PROFILE,
+                           similarity_key: Optional[SimilarityKey] = None,
+                           parser: Optional[Parser] = None) -> str:
   """
   Function to make a request to LLM and return the response.
 
   Args:
       prompt (str): The prompt for LLM.
+      cache_key (str, optional): Key of the originating request (see cache.cache_key).
+          When given, a cached response is returned if present and the fresh
+          response is stored otherwise.
+      priority (int, optional): Admission priority class (see admission.PRIORITIES).
+          Lower values are admitted first when the LLM queue is busy.
+      profile (GenerationProfile, optional): Output token limit, temperature and
+          stop sequences for the response (see profiles.get_profile).
+      similarity_key (tuple, optional): Semantic cache key of the originating
+          request (see PromptTemplate.similarity_key). When given with a
+          cache_key, a response to a near-identical earlier request is
+          returned if the exact key misses.
+      parser (Callable, optional): Parses the response into its structured
+          form (see PromptTemplate.parser). The structure is cached with the
+          text, so a response is parsed only once.
 
   Returns:
       str: The response from LLM.
+
+  Raises:
+      AdmissionRejected: If the LLM queue is full, the wait for a slot times out,
+          or the circuit breaker is open (CircuitOpenError).
+  """
+  completion = await get_llm_completion(prompt, cache_key=cache_key, priority=priority, profile=profile,
+                                        similarity_key=similarity_key, parser=parser)
+  return completion.text
+
+
+async def get_llm_completion(prompt: str, cache_key: Optional[str] = None, priority: int = 0,
+                             profile: GenerationProfile = DEFAULT_PROFILE,
+                             similarity_key: Optional[SimilarityKey] = None,
+                             parser: Optional[Parser] = None) -> Completion:
   """
-  print("Starting LLM request...")
+  Like get_llm_response, but returns the response together with its token
+  usage and, when a parser is given, its structured form.
+  """
+  if cache_key is not None:
+    cached = await get_cached_completion(cache_key, profile, similarity_key, parser)
+    if cached is not None:
+      return cached
+    cache_key = profile_cache_key(cache_key, profile)
 
-  # Make a request to LLM
-  response = llm.invoke(prompt)
+  # Identical concurrent prompts share a single LLM call
+  prompt_key = hashlib.sha256(f"{profile.key}\0{prompt}".encode("utf-8")).hexdigest()
+  completion = await _inflight.do(prompt_key, lambda: _invoke_llm(prompt, priority, profile))
+  if parser is not None and completion.structured is None:
+    _parse(completion, parser)
 
-  print("LLM request finished.")
+  if cache_key is not None:
+    store_completion(cache_key, similarity_key, profile, completion)
 
   # Return the LLM response
-  return response.content
+  return completion
+
+
+async def get_cached_completion(cache_key: str, profile: GenerationProfile = DEFAULT_PROFILE,
+                                similarity_key: Optional[SimilarityKey] = None,
+                                parser: Optional[Parser] = None) -> Optional[Completion]:
+  """
+  Return the cached response to a request, or to a near-identical one, without
+  calling the LLM. Arguments are as for get_llm_response. Returns None on a miss.
+  """
+  cached = await _get_cached(profile_cache_key(cache_key, profile), similarity_key, profile)
+  if cached is not None and parser is not None and cached.structured is None:
+    # Cached without a parser
+    _parse(cached, parser)
+  return cached
+
+
+def profile_cache_key(cache_key: str, profile: GenerationProfile) -> str:
+  """
+  Key under which the response to a request is cached. Responses generated
+  under different limits are cached separately.
+  """
+  return f"{cache_key}:{profile.key}"
+
+
+async def _get_cached(cache_key: str, similarity_key: Optional[SimilarityKey],
+                      profile: GenerationProfile) -> Optional[Completion]:
+  """
+  Look a response up by its exact key, then among near-identical requests.
+  """
+  cache = get_response_cache()
+  cached = await cache.get(cache_key)
+  if cached is not None:
+    return _decode_completion(cached)
+
+  semantic_cache = get_semantic_cache()
+  if similarity_key is None or semantic_cache is None:
+    return None
+  partition, fields = similarity_key
+  match = semantic_cache.search(f"{partition}:{profile.key}", fields)
+  if match is None:
+    return None
+  cached = await cache.get(match[0])
+  if cached is None:
+    # The response has expired or been evicted since it was indexed
+    semantic_cache.discard(match[0])
+    return None
+  return _decode_completion(cached)
+
+
+def store_completion(cache_key: str, similarity_key: Optional[SimilarityKey], profile: GenerationProfile,
+                     completion: Completion, ttl: Optional[float] = None, source: Optional[str] = None) -> None:
+  """
+  Store a response in the response cache under its profile_cache_key, and index
+  it in the semantic cache. `ttl` and `source` are passed to ResponseCache.set.
+  """
+  get_response_cache().set(cache_key, _encode_completion(completion), ttl=ttl, source=source)
+  semantic_cache = get_semantic_cache()
+  if similarity_key is not None and semantic_cache is not None:
+    partition, fields = similarity_key
+    semantic_cache.add(f"{partition}:{profile.key}", fields, cache_key)
+
+
+def _parse(completion: Completion, parser: Parser) -> None:
+  with stage("parse"):
+    completion.structured = parser(completion.text)
+
+
+def _encode_completion(completion: Completion) -> str:
+  entry = {"text": completion.text, "usage": completion.usage.dict()}
+  if completion.structured is not None:
+    entry["structured"] = completion.structured
+  return json.dumps(entry)
+
+
+def _decode_completion(value: str) -> Completion:
+  entry = json.loads(value)
+  usage = entry["usage"]
+  return Completion(entry["text"], Usage(prompt_tokens=usage["prompt_tokens"], output_tokens=usage["output_tokens"],
+                                         finish_reason=usage["finish_reason"], cached=True),
+                    structured=entry.get("structured"))
+
+
+def _record_usage(usage: Usage, profile: GenerationProfile) -> None:
+  endpoint = current_endpoint.get()
+  TOKENS.observe(usage.prompt_tokens, endpoint=endpoint, profile=profile.name, kind="prompt")
+  TOKENS.observe(usage.output_tokens, endpoint=endpoint, profile=profile.name, kind="output")
+  if usage.truncated:
+    TRUNCATED.inc(endpoint=endpoint, profile=profile.name)
+  record_client_tokens(usage.total_tokens)
+
+
+async def _invoke_llm(prompt: str, priority: int, profile: GenerationProfile) -> Completion:
+  """
+  Make a request to LLM, retrying transient failures and failing fast while
+  the circuit breaker is open.
+  """
+  return await get_retry_policy().call(lambda deadline: _invoke_llm_once(prompt, priority, profile, deadline))
+
+
+async def _invoke_llm_once(prompt: str, priority: int, profile: GenerationProfile,
+                           deadline: Optional[float] = None) -> Completion:
+  """
+  Make a single request to LLM once admitted by the admission controller.
+  `deadline` (a time.monotonic() value) bounds the LLM call itself.
+
+  Raises:
+      AdmissionRejected: If no slot is free before the deadline.
+  """
+  # Make a non-blocking request to LLM, bounded by the per-process limit
+  controller = get_admission_controller()
+  async with controller.admit(priority):
+    remaining = deadline - time.monotonic() if deadline is not None else None
+    if remaining is not None and remaining <= 0:
+      # Local congestion, not an upstream failure
+      raise AdmissionRejected("Timed out waiting for an LLM slot", controller.retry_after())
+    PROMPT_BYTES.observe(len(prompt.encode("utf-8")), endpoint=current_endpoint.get())
+    with stage("llm_call"):
+      hedger = get_hedger()
+      if hedger is None:
+        completion = await asyncio.wait_for(get_backend().generate(prompt, profile), remaining)
+      else:
+        # A slow call gets a backup call, within the hedge budget and only if a slot is free
+        completion = await asyncio.wait_for(
+            hedger.call(profile.name, lambda: get_backend().generate(prompt, profile), slots=controller), remaining)
+
+  _record_usage(completion.usage, profile)
+
+  return completion
+
+
+async def stream_llm_response(prompt: str, cache_key: Optional[str] = None, priority: int = 0,
+                              profile: GenerationProfile = DEFAULT_PROFILE,
+                              similarity_key: Optional[SimilarityKey] = None,
+                              usage: Optional[Usage] = None, parser: Optional[Parser] = None) -> AsyncIterator[str]:
+  """
+  Streaming counterpart of get_llm_response that yields the response in chunks
+  as the LLM produces them.
+
+  Args:
+      prompt (str): The prompt for LLM.
+      cache_key (str, optional): Key of the originating request. A cached
+          response is yielded as a single chunk, and a completed stream is
+          stored in the cache.
+      priority (int, optional): Admission priority class (see admission.PRIORITIES).
+      profile (GenerationProfile, optional): Output token limit, temperature and
+          stop sequences for the response.
+      similarity_key (tuple, optional): Semantic cache key of the originating request.
+      usage (Usage, optional): Filled in with the response's token usage once
+          the stream has ended.
+      parser (Callable, optional): Parses a completed stream before it is
+          cached, so later non-streaming requests get its structured form.
+
+  Yields:
+      str: Successive chunks of the response from LLM.
+  """
+  if cache_key is not None:
+    cache_key = profile_cache_key(cache_key, profile)
+    cached = await _get_cached(cache_key, similarity_key, profile)
+    if cached is not None:
+      if usage is not None:
+        usage.update(cached.usage)
+      yield cached.text
+      return
+
+  # Streams are not retried once started, but still feed the circuit breaker
+  breaker = get_retry_policy().breaker
+  if breaker is not None:
+    breaker.before_call()
+
+  chunks = []
+  stream_usage = Usage()
+  try:
+    async with get_admission_controller().admit(priority):
+      PROMPT_BYTES.observe(len(prompt.encode("utf-8")), endpoint=current_endpoint.get())
+      with stage("llm_call"):
+        async for chunk in get_backend().stream(prompt, profile, stream_usage):
+          chunks.append(chunk)
+          yield chunk
+  except (AdmissionRejected, asyncio.CancelledError, GeneratorExit):
+    if breaker is not None:
+      breaker.release_probe()
+    raise
+  except Exception as e:
+    if breaker is not None:
+      if is_transient(e):
+        breaker.record_failure()
+      else:
+        breaker.record_success()
+    raise
+  if breaker is not None:
+    breaker.record_success()
+
+  _record_usage(stream_usage, profile)
+  if usage is not None:
+    usage.update(stream_usage)
+
+  if cache_key is not None:
+    completion = Completion("".join(chunks), stream_usage)
+    if parser is not None:
+      _parse(completion, parser)
+    store_completion(cache_key, similarity_key, profile, completion)
 
 
 async def test_llm_response():
@@ -56,5 +331,8 @@ async def test_llm_response():
 
 # Check if the file is executed directly
 if __name__ == "__main__":
+  # Load environment variables from .env file
+  load_dotenv()
+
   # Run the test function
   asyncio.run(test_llm_response())
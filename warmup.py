@@ -0,0 +1,301 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Type, get_args
+
+from pydantic import BaseModel, ValidationError
+
+from admission import PRIORITIES, AdmissionRejected
+from cache import WARMUP, _normalize, get_response_cache
+from capture import read_capture
+from metrics import track_request
+from models import REQUEST_TYPES, NotesRequest, QuestionsRequest
+from prompts import PromptTemplate
+from question_sets import derive_cached
+from utils import get_llm_completion, profile_cache_key, store_completion
+
+"""
+StudyMate Warm-up
+
+Pre-generates notes and questions for the topics students ask about most, so
+that peak-time requests are answered from the response cache. Topics come from
+a plain list (one per line) or are mined from a JSON-lines request log, and are
+expanded into every notes style and with/without answers combination. The
+warm-up runs in an off-peak window at a fixed rate, at a priority below all
+user traffic, and skips requests that are already cached.
+
+Warmed entries are tagged in the response cache, which reports how many
+requests they served (see coverage_report).
+
+Usage:
+    python warmup.py --topics topics.txt --rate 30
+    python warmup.py --topics requests.jsonl --limit 200
+"""
+
+# The values the request models accept. The agents spell some differently
+# ('Last Minute Revision'), but cache keys are normalized to the same entry.
+NOTES_STYLES = get_args(NotesRequest.__annotations__["notes_style"])
+WITH_ANSWERS = get_args(QuestionsRequest.__annotations__["with_answers"])
+
+# Admitted after every user request type, so the warm-up never delays users
+WARMUP_PRIORITY = max(PRIORITIES.values()) + 1
+
+# An item to warm: request type (as in /batch) and request fields
+WarmupItem = Tuple[str, dict]
+
+Window = Tuple[datetime.time, datetime.time]
+
+
+def mine_request_log(path: str, limit: Optional[int] = None) -> List[str]:
+  """
+  Return the topics of notes and questions requests in a request log, most
+  requested first. Each line of the log is a /batch item, i.e.
+  {"type": "notes", "request": {...}}, as in capture files, whose rotated
+  files are read too. Topics differing only in case and spacing are counted
+  together.
+  """
+  counts = Counter()
+  spellings = {}
+  for item in read_capture(path):
+    if item.get("type") not in ("notes", "questions") or not isinstance(item.get("request"), dict):
+      continue
+    topic = item["request"].get("topic")
+    if not isinstance(topic, str) or not topic.strip() or topic == "NA":
+      continue
+    key = _normalize(topic)
+    counts[key] += 1
+    spellings.setdefault(key, " ".join(topic.split()))
+  return [spellings[key] for key, _ in counts.most_common(limit)]
+
+
+def read_topics(path: str, limit: Optional[int] = None) -> List[str]:
+  """
+  Read topics from a request log (.jsonl) or a topic list with one topic per
+  line. Blank lines and lines starting with '#' are ignored.
+  """
+  if path.endswith(".jsonl"):
+    return mine_request_log(path, limit)
+  with open(path) as f:
+    topics = [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+  return topics[:limit] if limit else topics
+
+
+def plan(topics: List[str]) -> List[WarmupItem]:
+  """
+  Expand topics into notes requests for every notes style and questions
+  requests with and without answers.
+  """
+  items = []
+  for topic in topics:
+    for notes_style in NOTES_STYLES:
+      items.append(("notes", {"topic": topic, "notes_style": notes_style,
+                              "reference_material": "NA", "additional_requirements": "NA"}))
+    for with_answers in WITH_ANSWERS:
+      items.append(("questions", {"topic": topic, "with_answers": with_answers, "additional_requirements": "NA"}))
+  return items
+
+
+def parse_window(value: str) -> Optional[Window]:
+  """
+  Parse an "HH:MM-HH:MM" local time window, which may wrap past midnight.
+  An empty value means no window.
+  """
+  if not value:
+    return None
+  start, _, end = value.partition("-")
+  return datetime.time.fromisoformat(start.strip()), datetime.time.fromisoformat(end.strip())
+
+
+def in_window(window: Window, now: datetime.datetime) -> bool:
+  start, end = window
+  if start <= end:
+    return start <= now.time() < end
+  return now.time() >= start or now.time() < end
+
+
+def seconds_until(moment: datetime.time, now: datetime.datetime) -> float:
+  """
+  Return the seconds from now until the next occurrence of a time of day.
+  """
+  target = datetime.datetime.combine(now.date(), moment)
+  if target <= now:
+    target += datetime.timedelta(days=1)
+  return (target - now).total_seconds()
+
+
+class WarmupRunner:
+  """
+  Generates and caches the responses for a warm-up plan.
+
+  Args:
+      types (dict): Request type -> (request model, prompt template), as in
+          models.REQUEST_TYPES.
+      items (list): Items to warm, e.g. from plan().
+      rate (float): LLM calls per minute.
+      max_requests (int): LLM calls per run. Items beyond it wait for the next run.
+      ttl (float): Lifetime of warmed cache entries in seconds. It should outlast
+          the time from one off-peak window to the next.
+      window (tuple, optional): Off-peak window from parse_window(). Without
+          one, run_forever() refreshes the cache every ttl / 2 seconds.
+      clock (Callable): Returns the local time, e.g. a fake clock in tests.
+      sleep (Callable): Coroutine sleeping between windows.
+  """
+
+  def __init__(self, types: Dict[str, Tuple[Type[BaseModel], PromptTemplate]], items: List[WarmupItem],
+               rate: float = 30.0, max_requests: int = 1000, ttl: float = 86400.0,
+               window: Optional[Window] = None,
+               clock: Callable[[], datetime.datetime] = datetime.datetime.now,
+               sleep: Callable[[float], Awaitable[None]] = asyncio.sleep):
+    self.types = types
+    self.items = items
+    self.rate = rate
+    self.max_requests = max_requests
+    self.ttl = ttl
+    self.window = window
+    self.clock = clock
+    self._sleep = sleep
+    self.last_report: Optional[dict] = None
+
+  async def run_once(self) -> dict:
+    """
+    Warm every item not cached yet, within the rate and request budget and,
+    if there is one, the off-peak window. Returns a report of the run.
+    """
+    report = {"planned": len(self.items), "already_cached": 0, "generated": 0, "derived": 0, "failed": 0, "deferred": 0,
+              "output_tokens": 0, "started_at": time.time(), "finished_at": None}
+    self.last_report = report
+    interval = 60 / self.rate if self.rate > 0 else 0
+    next_call = time.monotonic()
+
+    with track_request("warmup"):
+      for job_type, fields in self.items:
+        window_closed = self.window is not None and not in_window(self.window, self.clock())
+        if report["generated"] >= self.max_requests or window_closed:
+          report["deferred"] += 1
+          continue
+
+        model, template = self.types[job_type]
+        try:
+          request = model(**fields)
+        except ValidationError:
+          report["failed"] += 1
+          continue
+        profile = template.profile(request)
+        cache_key = profile_cache_key(template.cache_key(request), profile)
+        if await get_response_cache().contains(cache_key):
+          report["already_cached"] += 1
+          continue
+        derived = await derive_cached(request) if job_type == "questions" else None
+        if derived is not None:
+          # Questions without answers come from the set with answers warmed just before
+          store_completion(cache_key, template.similarity_key(request), profile, derived, ttl=self.ttl, source=WARMUP)
+          report["derived"] += 1
+          continue
+
+        await asyncio.sleep(max(0.0, next_call - time.monotonic()))
+        next_call = time.monotonic() + interval
+        try:
+          completion = await get_llm_completion(template.render(request), priority=WARMUP_PRIORITY, profile=profile,
+                                                parser=template.parser)
+        except AdmissionRejected:
+          # The LLM is busy with users; leave the item for the next run
+          report["deferred"] += 1
+          continue
+        except Exception:
+          report["failed"] += 1
+          continue
+        store_completion(cache_key, template.similarity_key(request), profile, completion, ttl=self.ttl, source=WARMUP)
+        report["generated"] += 1
+        report["output_tokens"] += completion.usage.output_tokens
+
+    report["finished_at"] = time.time()
+    return report
+
+  async def run_forever(self) -> None:
+    """
+    Run the warm-up in every off-peak window, or every ttl / 2 seconds if
+    there is no window.
+    """
+    while True:
+      if self.window is None:
+        await self.run_once()
+        await self._sleep(self.ttl / 2)
+        continue
+      now = self.clock()
+      if not in_window(self.window, now):
+        await self._sleep(seconds_until(self.window[0], now))
+        continue
+      await self.run_once()
+      # Wait for the next window to open, even if the run ended after this one closed
+      await self._sleep(seconds_until(self.window[0], self.clock()))
+
+
+def create_warmup_runner(types: Dict[str, Tuple[Type[BaseModel], PromptTemplate]]) -> Optional[WarmupRunner]:
+  """
+  Build a warm-up runner from the environment, or return None if WARMUP_SOURCE
+  is not set.
+  """
+  source = os.getenv("WARMUP_SOURCE")
+  if not source:
+    return None
+  limit = int(os.getenv("WARMUP_TOPICS_LIMIT", "200"))
+  return WarmupRunner(
+      types,
+      plan(read_topics(source, limit or None)),
+      rate=float(os.getenv("WARMUP_RATE", "30")),
+      max_requests=int(os.getenv("WARMUP_MAX_REQUESTS", "1000")),
+      ttl=float(os.getenv("WARMUP_TTL", "86400")),
+      window=parse_window(os.getenv("WARMUP_WINDOW", "01:00-06:00")),
+  )
+
+
+def coverage_report(runner: Optional[WarmupRunner] = None) -> dict:
+  """
+  Report how much of the traffic warmed entries served: warmed entries, how
+  many of them were used, and warm hits against all cache lookups.
+  """
+  stats = get_response_cache().stats()
+  lookups = stats["hits"] + stats["misses"]
+  return {
+      "warm_entries": stats["warm_entries"],
+      "warm_entries_used": stats["warm_entries_used"],
+      "warm_hits": stats["warm_hits"],
+      "cache_lookups": lookups,
+      "coverage": stats["warm_hit_rate"],
+      "last_run": runner.last_report if runner is not None else None,
+  }
+
+
+def main():
+  from dotenv import load_dotenv
+
+  load_dotenv()
+  parser = argparse.ArgumentParser(description="Pre-generate notes and questions for popular topics")
+  parser.add_argument("--topics", default=os.getenv("WARMUP_SOURCE"), required=not os.getenv("WARMUP_SOURCE"),
+                      help="topic list (one per line) or request log (.jsonl)")
+  parser.add_argument("--limit", type=int, default=int(os.getenv("WARMUP_TOPICS_LIMIT", "200")),
+                      help="most requested topics to warm (0 for all)")
+  parser.add_argument("--rate", type=float, default=float(os.getenv("WARMUP_RATE", "30")), help="LLM calls per minute")
+  parser.add_argument("--max-requests", type=int, default=int(os.getenv("WARMUP_MAX_REQUESTS", "1000")))
+  parser.add_argument("--ttl", type=float, default=float(os.getenv("WARMUP_TTL", "86400")))
+  parser.add_argument("--dry-run", action="store_true", help="print the plan without generating")
+  args = parser.parse_args()
+
+  items = plan(read_topics(args.topics, args.limit or None))
+  if args.dry_run:
+    for item in items:
+      print(json.dumps({"type": item[0], "request": item[1]}))
+    return
+  if not os.getenv("RESPONSE_CACHE_PATH"):
+    print("RESPONSE_CACHE_PATH is not set; warmed responses will be lost when this process exits.")
+
+  runner = WarmupRunner(REQUEST_TYPES, items, rate=args.rate, max_requests=args.max_requests, ttl=args.ttl)
+  print(json.dumps(asyncio.run(runner.run_once()), indent=2))
+
+
+if __name__ == "__main__":
+  main()